@@ -0,0 +1,186 @@
+"""Mide el tiempo de construcción de los documentos Bokeh de /perfil y /prediccion a partir de respuestas grabadas de RapidMiner
+(ver RAPIDMINER_RECORD_DIR en utils/server_config.py), desglosado por etapas, y el tamaño del documento serializado.
+
+	python -m benchmarks.bench_documents --dir recordings --repeat 20
+
+Con --parser se compara además el tiempo y el pico de memoria de parse_json_tables con decodificar la respuesta completa y aplanar
+cada tabla con json_normalize.
+"""
+from bokeh_edar40.applications.cartuja.first_descriptive import clean_perfil_dataframes, create_perfil_layout
+from bokeh_edar40.applications.cartuja.second_descriptive import clean_prediction_dataframes, create_model_layout, create_prediction_plot, create_outlier_plot, MODEL_DISCRETISE, MODEL_NUM_ATTRIBUTES
+from utils.rapidminer_proxy import get_recording_path, call_webservice, parse_json_tables, RESPONSE_CHUNK_SIZE
+from utils.table_schemas import TABLE_SCHEMAS, normalize_table
+from utils.server_config import RAPIDMINER_RECORD_DIR
+
+from bokeh.document import Document
+from bokeh.layouts import column
+from collections import OrderedDict
+from pandas.io.json import json_normalize
+import numpy as np
+import argparse
+import json
+import time
+import tracemalloc
+
+STAGES = ['fetch', 'parse', 'clean', 'figures', 'to_json']
+PERCENTILES = [50, 90, 99]
+
+class StageTimer:
+	"""Clase StageTimer para acumular los tiempos de cada etapa en cada repetición
+
+	Attributes:
+		timings (OrderedDict): Lista de tiempos en milisegundos por etapa
+		sizes (list): Tamaño en bytes del documento serializado en cada repetición
+	"""
+
+	def __init__(self):
+		self.timings = OrderedDict((stage, []) for stage in STAGES + ['total'])
+		self.sizes = []
+
+	def run(self, stage, func, *args):
+		"""Ejecuta una etapa y guarda su duración
+
+		Parameters:
+			stage (string): Nombre de la etapa
+			func (function): Función de la etapa
+			*args: Parámetros de la función
+
+		Returns:
+			Valor devuelto por la función
+		"""
+		start = time.perf_counter()
+		result = func(*args)
+		self.timings[stage].append((time.perf_counter()-start)*1000)
+		return result
+
+	def report(self, title):
+		"""Devuelve el informe de percentiles de cada etapa
+
+		Parameters:
+			title (string): Título del informe
+
+		Returns:
+			string: Informe en texto
+		"""
+		lines = [title, f"{'etapa':<16}" + ''.join(f'{f"p{p} (ms)":>12}' for p in PERCENTILES) + f"{'media (ms)':>12}"]
+		for stage, values in self.timings.items():
+			lines.append(f'{stage:<16}' + ''.join(f'{np.percentile(values, p):>12.1f}' for p in PERCENTILES) + f'{np.mean(values):>12.1f}')
+		lines.append(f'documento: {int(np.median(self.sizes))} bytes')
+		return '\n'.join(lines)
+
+	def to_dict(self):
+		"""Devuelve los percentiles de cada etapa y el tamaño del documento en forma de diccionario
+		"""
+		return {
+			'timings': {stage: {f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES} for stage, values in self.timings.items()},
+			'document_bytes': int(np.median(self.sizes))
+		}
+
+def make_fetcher(record_dir, url):
+	"""Crea la función que obtiene el cuerpo (bytes) de la respuesta de un proceso, leyendo la grabación del disco o llamando a url
+	(por ejemplo el servidor de sustitución utils/rapidminer_standin.py)
+	"""
+	def fetch(process, parameters=None):
+		if url is not None:
+			return call_webservice(f'{url}/{process}?', 'rapidminer', 'rapidminer', parameters).encode('utf-8')
+		with open(get_recording_path(record_dir, process, parameters), 'rb') as recording_file:
+			return recording_file.read()
+	return fetch
+
+def parse(process, content):
+	"""Convierte el cuerpo de una respuesta en DataFrames con sus tipos igual que call_webservice_tables, en bloques del mismo tamaño
+	"""
+	chunks = (content[i:i+RESPONSE_CHUNK_SIZE] for i in range(0, len(content), RESPONSE_CHUNK_SIZE))
+	return parse_json_tables(chunks, TABLE_SCHEMAS.get(process))
+
+def parse_json_normalize(process, content):
+	"""Convierte el cuerpo de una respuesta en DataFrames decodificándolo completo y aplanando cada tabla con json_normalize, como se
+	hacía antes de parse_json_tables
+	"""
+	schemas = TABLE_SCHEMAS.get(process, [])
+	return [normalize_table(json_normalize(table), schemas[i] if i < len(schemas) else None) for i, table in enumerate(json.loads(content.decode('utf-8')))]
+
+def bench_parser(fetch, target, repeat):
+	"""Compara el tiempo y el pico de memoria (tracemalloc) de parse_json_tables y de parse_json_normalize con las respuestas de
+	/perfil y /prediccion
+
+	Returns:
+		string: Informe en texto
+	"""
+	responses = [
+		('EDAR_Cartuja_Perfil_Out_JSON', fetch('EDAR_Cartuja_Perfil_Out_JSON')),
+		('EDAR_Cartuja_Prediccion_JSON', fetch('EDAR_Cartuja_Prediccion_JSON', {'Objetivo': target, 'Discretizacion': MODEL_DISCRETISE, 'Numero_Atributos': MODEL_NUM_ATTRIBUTES}))
+	]
+	lines = [f"{'proceso':<32}{'parser':<20}{'p50 (ms)':>12}{'pico (MB)':>12}"]
+	for process, content in responses:
+		for name, func in (('json_normalize', parse_json_normalize), ('parse_json_tables', parse)):
+			timings = []
+			for _ in range(repeat):
+				start = time.perf_counter()
+				func(process, content)
+				timings.append((time.perf_counter()-start)*1000)
+			# El pico se mide en una ejecución aparte, tracemalloc ralentiza la ejecución
+			tracemalloc.start()
+			func(process, content)
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+			lines.append(f'{process:<32}{name:<20}{np.percentile(timings, 50):>12.1f}{peak/1e6:>12.1f}')
+	return '\n'.join(lines)
+
+def serialize_document(root):
+	"""Serializa un documento con el layout dado y devuelve su tamaño en bytes
+	"""
+	doc = Document()
+	doc.add_root(root)
+	return len(doc.to_json_string().encode('utf-8'))
+
+def bench_perfil(fetch, timer):
+	"""Construye una vez el documento de /perfil midiendo cada etapa
+	"""
+	start = time.perf_counter()
+	content = timer.run('fetch', fetch, 'EDAR_Cartuja_Perfil_Out_JSON')
+	df_perfil = timer.run('parse', parse, 'EDAR_Cartuja_Perfil_Out_JSON', content)
+	perfil_data = timer.run('clean', clean_perfil_dataframes, df_perfil)
+	perfil_layout = timer.run('figures', create_perfil_layout, perfil_data)
+	timer.sizes.append(timer.run('to_json', serialize_document, perfil_layout))
+	timer.timings['total'].append((time.perf_counter()-start)*1000)
+
+def bench_prediccion(fetch, timer, target):
+	"""Construye una vez el documento de /prediccion (perfil y un modelo) midiendo cada etapa
+	"""
+	parameters = {'Objetivo': target, 'Discretizacion': MODEL_DISCRETISE, 'Numero_Atributos': MODEL_NUM_ATTRIBUTES}
+	start = time.perf_counter()
+	perfil_content, prediction_content = timer.run('fetch', lambda: (fetch('EDAR_Cartuja_Perfil_Out_JSON'), fetch('EDAR_Cartuja_Prediccion_JSON', parameters)))
+	df_perfil, df_prediction = timer.run('parse', lambda: (parse('EDAR_Cartuja_Perfil_Out_JSON', perfil_content), parse('EDAR_Cartuja_Prediccion_JSON', prediction_content)))
+	prediction_bundle = timer.run('clean', clean_prediction_dataframes, df_prediction, list(df_prediction[1].columns), target)
+	prediction_layout = timer.run('figures', lambda: column([create_prediction_plot(df_perfil[3]), create_outlier_plot(df_perfil[4]), create_model_layout(target, prediction_bundle)]))
+	timer.sizes.append(timer.run('to_json', serialize_document, prediction_layout))
+	timer.timings['total'].append((time.perf_counter()-start)*1000)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark de construcción de los documentos de /perfil y /prediccion')
+	parser.add_argument('--dir', default=RAPIDMINER_RECORD_DIR or 'recordings', help='Directorio de grabaciones de RapidMiner')
+	parser.add_argument('--url', default=None, help='URL base de RapidMiner o del servidor de sustitución (por defecto se leen las grabaciones)')
+	parser.add_argument('--repeat', type=int, default=10, help='Número de repeticiones')
+	parser.add_argument('--target', default='Calidad_Agua', help='Variable objetivo del modelo de /prediccion')
+	parser.add_argument('--json', default=None, help='Fichero donde guardar los resultados para comparar entre versiones')
+	parser.add_argument('--parser', action='store_true', help='Compara también parse_json_tables con json_normalize')
+	args = parser.parse_args()
+
+	fetch = make_fetcher(args.dir, args.url)
+	perfil_timer = StageTimer()
+	prediccion_timer = StageTimer()
+	for _ in range(args.repeat):
+		bench_perfil(fetch, perfil_timer)
+		bench_prediccion(fetch, prediccion_timer, args.target)
+
+	print(perfil_timer.report(f'/perfil ({args.repeat} repeticiones)'))
+	print()
+	print(prediccion_timer.report(f'/prediccion - {args.target} ({args.repeat} repeticiones)'))
+	if args.parser:
+		print()
+		print(bench_parser(fetch, args.target, args.repeat))
+
+	if args.json is not None:
+		with open(args.json, 'w') as results_file:
+			json.dump({'perfil': perfil_timer.to_dict(), 'prediccion': prediccion_timer.to_dict()}, results_file, indent=2)
@@ -1,9 +1,13 @@
 from bokeh_edar40.visualizations.treemap import normalize_sizes, squarify
-from utils.rapidminer_proxy import call_webservice 
+from utils.rapidminer_proxy import get_webservice_dataframes_async
+from utils.snapshot_store import get_snapshot_time
+from utils.server_config import RAPIDMINER_URL
 import utils.bokeh_utils as bokeh_utils
+import utils.metrics as metrics
 
+from bokeh.document import without_document_lock
 from bokeh.layouts import column, row, widgetbox, grid,layout
-from bokeh.models import ColumnDataSource, Div, DateRangeSlider, DatePicker, Button, DataTable, TableColumn, LabelSet, Span, Label
+from bokeh.models import ColumnDataSource, Div, DateRangeSlider, DatePicker, Button, DataTable, TableColumn, NumberFormatter, LabelSet, Span, Label
 from bokeh.models.markers import Circle
 from bokeh.plotting import figure, curdoc, show
 from bokeh.models.formatters import DatetimeTickFormatter
@@ -13,181 +17,94 @@ from bokeh.models.tools import HoverTool
 from bokeh.models.widgets import Tabs, Panel
 
 import pandas as pd
-from pandas.io.json import json_normalize
 import numpy as np
 import xml.etree.ElementTree as et
+from functools import partial
+import logging
 
-def create_treemap(df):
-	"""Crea la gráfica de rectángulos
-
-	Parameters:
-		df (Dataframe): Dataframe de datos
-	"""
-
-	def sum_indicador_values(indicador, df):
-		"""Suma los valores de un indicador o variable concreta
-
-		Parameters:
-			df (Dataframe): Dataframe de datos
-			indicador (String): Nombre del indicador del cual se deben sumar todos los valores
-
-		Returns:
-			float: Suma total de los valores del indicador
-		"""
-		df = df.loc[df['Indicador'].isin([indicador])]
-		sum_valor = pd.to_numeric(pd.Series(df['valor'].values)).sum()
-		return sum_valor
-
-	def create_treemap_data(key_names, key_values, color_values):
-		"""Crea el ColumnDataSource correcto con los datos para el gráfico de rectángulos
-
-		Parameters:
-			key_name (list): Lista de nombres de los indicadores o variables
-			key_values (list): Lista de suma de valores totales de cada indicador
-			color_values (list): Lista de colores en hexadecimal para aplicar a cada rectángulo
-
-		Returns:
-			ColumnDataSource: ColumnDataSource correcto con los datos para el gráfico de rectángulos
-		"""
-		source = ColumnDataSource(
-			data = dict(
-				Indicadores = key_names,
-				Valor_Total = key_values,
-				Colores = color_values
-				)
-			)
-
-		return source
-	
-	def create_first_level_treemap_data(df):
-		"""Crea el ColumnDataSource correcto para los rectángulos del primer nivel (mostrando las variables significativas)
-
-		Parameters:
-			df (Dataframe): Dataframe de datos
-
-		Returns:
-			ColumnDataSource: ColumnDataSource correcto para los rectángulos del primer nivel
-		"""
-		sum_total_values = []
-		indicator_values = []
-		indicators = df.drop_duplicates(subset='Indicador')
-		color_values = ['#396ab1', '#da7c30', '#3e9651', '#cc2529']
-		for indicator in indicators['Indicador']:
-			sum_value = sum_indicador_values(indicator, df)
-			if sum_value > 0:
-				sum_total_values.append(sum_value)
-				indicator_values.append(indicator)
-
-		source = create_treemap_data(indicator_values, sum_total_values, color_values)
-		return source
-
-	def create_low_level_treemap_data(df, indicator, color_value):
-		"""Crea el ColumnDataSource correcto para los rectángulos de niveles inferiores (mostrando tipos de calidad de agua construidos significativamente por esa variable)
-
-		Parameters:
-			df (Dataframe): Dataframe de datos
-			indicator (String): Nombre del indicador o variable
-			color_value (String): Color en hexadecimal para aplicar a cada rectángulo
-
-		Returns:
-			ColumnDataSource: ColumnDataSource correcto para los rectángulos de nivel inferior
-		"""
-		indicator_df = df.loc[df['Indicador'].isin([indicator])]
-		sum_value = sum_indicador_values(indicator, df)
-		if sum_value > 0:
-			# indicator_df['valor'] = pd.to_numeric(indicator_df['valor'])
-			indicator_df = indicator_df[indicator_df['valor'] > 0]
-			indicator_df = indicator_df.dropna(subset=['valor'])
-			source = create_treemap_data(list(indicator_df['cluster']), list(indicator_df['valor']), [color_value]*len(indicator_df))
-			return source
-
-	def create_treemap_rects(total_source, x, y, width, height, rects, treemap_figure):
-		"""Crea los rectángulos del gráfico de rectángulos
-
-		Parameters:
-			total_source (ColumnDataSource): ColumnDataSource con los datos a representar
-			x (float): Posición x de comienzo para dibujar los rectángulos (para rectángulos de nivel inferior)
-			y (float): Posición y de comienzo para dibujar los rectángulos (para rectángulos de nivel inferior)
-			width (float): Anchura de espacio para dibujar los rectángulos
-			height (float): Altura de espacio para dibujar los rectángulos
-			rects (dict): Diccionario de rectángulos con toda la información necesaria para dibujarlos
-			treemap_figure (Figure): Figura de Bokeh para visualizar el gráfico de rectángulos
-
-		Returns:
-			dict: Diccionario con la figura de Bokeh para visualizar el gráfico de rectángulos y un segundo diccionario con los rectángulos creados
-		"""
-		
-		values = total_source.data['Valor_Total']
-		values.sort(reverse=True)
-		values = normalize_sizes(total_source.data['Valor_Total'], width, height)
-		rects = squarify(values, x, y, width, height)
-
-		X = [rect['x'] for rect in rects]
-		Y = [rect['y'] for rect in rects]
-		dX = [rect['dx'] for rect in rects]
-		dY = [ rect['dy'] for rect in rects]
+logger = logging.getLogger(__name__)
 
-		XdX = []
-		YdY = []
+def create_treemap_data(df, levels=('Indicador', 'cluster'), value='valor'):
+	"""Agrega los valores en una jerarquía de cualquier profundidad (por ejemplo indicador → cluster → periodo) con una sola
+	agrupación del DataFrame y calcula los rectángulos y textos de todos los niveles
 
-		for i in range(len(X)):
-		    XdX.append(X[i]+dX[i])
-		    YdY.append(Y[i]+dY[i])
+	Los nodos intermedios suman todos sus valores (también los negativos) y solo se dibujan si la suma es positiva. Las hojas
+	solo se dibujan con valores positivos. Los nodos del primer nivel usan LINE_COLORS_PALETTE y sus descendientes el color
+	correspondiente de BAR_COLORS_PALETTE
 
-		# text_Y = [y - 0.06 for y in YdY]
-		# text_X = [x + 0.01 for x in X]
-
-		treemap_figure.quad(top=YdY, bottom=Y, left=X, right=XdX, color=total_source.data['Colores'], line_color='black')
-		
-		return {'treemap': treemap_figure, 'rects': rects}
-
-	def create_first_level_rect_text_data(rects, source):
-		"""Crea el texto a mostrar (nombre de indicador o variable) en cada rectángulo del primer nivel
-
-		Parameters:
-			rects (dict): Diccionario de rectángulos con toda la información necesaria para dibujarlos
-			source (ColumnDataSource): ColumnDataSource con los datos a representar
-
-		Returns:
-			dict: Diccionario con las coordenadas X e Y y el texto a mostrar en cada rectángulo del primer nivel
-		"""
-		x = []
-		y = []
-		text = []
-		for rect in rects:
-			x.append(rect['x']+0.01)
-			y.append((rect['y'] + rect['dy'])-0.06)
-		for indicador in source.data['Indicadores']:
-			text.append(indicador)
-
-		return {'x': x, 'y': y, 'text': text}
-
-	def create_low_level_rect_text_data(rects, source, x, y, text):
-		"""Crea el texto a mostrar (nombre de indicador o variable) en cada rectángulo de nivel inferior
-
-		Parameters:
-			rects (dict): Diccionario de rectángulos con toda la información necesaria para dibujarlos
-			source (ColumnDataSource): ColumnDataSource con los datos a representar
-			x (list): Lista de valores de coordenadas X para cada texto a mostrar
-			y (list): Lista de valores de coordenadas Y para cada texto a mostrar
-			text (list): Lista de valores de texto a mostrar
-
-
-		Returns:
-			dict: Diccionario con las coordenadas X e Y y el texto a mostrar en cada rectángulo del niveles inferiores
-		"""
-		
-		# Vamos insertando los valores en las listas ya creadas en el primer nivel, debido a que el texto debe ser lo último al 
-		# dibujar, si no, al dibujar rectángulos de nivel inferior el texto del primer nivel desaparece
-		for rect in rects:
-			x.append(((rect['x']+(rect['x']+rect['dx']))/2)-0.04)
-			y.append(((rect['y']+(rect['y']+rect['dy']))/2)-0.02)
-		for indicator in source.data['Indicadores']:
-			text.append(indicator)
+	Parameters:
+		df (Dataframe): Dataframe de datos
+		levels (tuple): Columnas que definen los niveles de la jerarquía, de mayor a menor
+		value (string): Columna con los valores a sumar
 
-		return {'x': x, 'y': y, 'text': text}
+	Returns:
+		dict: Columnas left, right, top, bottom, color, level, label, label_x, label_y y value con una fila por rectángulo
+	"""
+	levels = list(levels)
+	values = pd.to_numeric(df[value], errors='coerce')
+	leaves = values.groupby([df[level] for level in levels], sort=False, observed=True).sum()
+
+	data = {column: [] for column in ('left', 'right', 'top', 'bottom', 'color', 'level', 'label', 'label_x', 'label_y', 'value')}
+	# Rectángulo (x, y, dx, dy) e índice de color de cada nodo del nivel anterior, el nodo raíz ocupa todo el espacio
+	nodes = {(): (0., 0., 1., 1., None)}
+	for depth in range(len(levels)):
+		is_leaf = depth == len(levels)-1
+		aggregate = leaves if is_leaf else leaves.groupby(level=list(range(depth+1)), sort=False, observed=True).sum()
+
+		children = {}
+		for key, total in aggregate.items():
+			key = key if isinstance(key, tuple) else (key,)
+			if total > 0 and key[:-1] in nodes:
+				children.setdefault(key[:-1], []).append((key, total))
+
+		new_nodes = {}
+		for parent, items in children.items():
+			items.sort(key=lambda item: item[1], reverse=True)
+			sizes = np.array([total for _, total in items])
+			x, y, dx, dy, color_index = nodes[parent]
+			rect_x, rect_y, rect_dx, rect_dy = squarify(normalize_sizes(sizes, dx, dy), x, y, dx, dy)
+
+			if depth == 0:
+				color_indexes = list(range(len(items)))
+				colors = [bokeh_utils.LINE_COLORS_PALETTE[i % len(bokeh_utils.LINE_COLORS_PALETTE)] for i in color_indexes]
+			else:
+				color_indexes = [color_index]*len(items)
+				colors = [bokeh_utils.BAR_COLORS_PALETTE[color_index % len(bokeh_utils.BAR_COLORS_PALETTE)]]*len(items)
+
+			data['left'].extend(rect_x)
+			data['right'].extend(rect_x+rect_dx)
+			data['bottom'].extend(rect_y)
+			data['top'].extend(rect_y+rect_dy)
+			data['color'].extend(colors)
+			data['level'].extend([depth]*len(items))
+			data['label'].extend(str(key[-1]) for key, _ in items)
+			data['value'].extend(sizes)
+			# Las hojas se etiquetan en el centro y los niveles superiores en la esquina superior izquierda
+			if is_leaf:
+				data['label_x'].extend((rect_x+rect_dx/2)-0.04)
+				data['label_y'].extend((rect_y+rect_dy/2)-0.02)
+			else:
+				data['label_x'].extend(rect_x+0.01)
+				data['label_y'].extend((rect_y+rect_dy)-0.06)
+
+			for i, (key, _) in enumerate(items):
+				new_nodes[key] = (rect_x[i], rect_y[i], rect_dx[i], rect_dy[i], color_indexes[i])
+		nodes = new_nodes
+
+	return data
+
+@metrics.timed
+def create_treemap(df, levels=('Indicador', 'cluster'), value='valor'):
+	"""Crea la gráfica de rectángulos
 
+	Parameters:
+		df (Dataframe): Dataframe de datos
+		levels (tuple): Columnas que definen los niveles de la jerarquía, de mayor a menor
+		value (string): Columna con los valores a sumar
 
+	Returns:
+		Figure: Gráfica de rectángulos
+	"""
 	treemap_figure = figure(plot_height=400, sizing_mode='stretch_width', toolbar_location=None)
 	treemap_figure.axis.visible = False
 	treemap_figure.xgrid.grid_line_color = None
@@ -195,36 +112,11 @@ def create_treemap(df):
 	treemap_figure.x_range.range_padding = 0
 	treemap_figure.y_range.range_padding = 0
 
-	first_level_source = create_first_level_treemap_data(df)
-	# Comenzamos a crear los rectángulos teniendo todo el espacio libre
-	treemap_info = create_treemap_rects(first_level_source, 0., 0., 1, 1, [], treemap_figure)
-	rects = treemap_info['rects']
-	treemap_figure = treemap_info['treemap']
-	colores = bokeh_utils.BAR_COLORS_PALETTE[:len(df['Indicador'].values)]
-	
-	i = 0
-
-	rect_text = create_first_level_rect_text_data(rects, first_level_source)
-	new_rects_text = dict(
-		x = [],
-		y = [],
-		text = []
-		)
-
-	indicadores = df.drop_duplicates(subset='Indicador')
-	for indicador in indicadores['Indicador']:
-		low_level_source = create_low_level_treemap_data(df, indicador, colores[i])
-		if low_level_source != None:
-			# Creamos los rectángulos de nivel inferior teniendo en cuenta el espacio disponible por el rectángulo del nivel superior
-			treemap_info = create_treemap_rects(low_level_source, rects[i]['x'], rects[i]['y'], rects[i]['dx'],rects[i]['dy'], rects, treemap_info['treemap'])
-			new_rects = treemap_info['rects']
-			new_rects_text = create_low_level_rect_text_data(new_rects, low_level_source, new_rects_text['x'], new_rects_text['y'], new_rects_text['text'])
-			treemap_figure = treemap_info['treemap']
-			i = i + 1
-	
-	# Creamos el texto para cada rectángulo y luego lo mostramos, primero nivel superior y después inferiores
-	treemap_figure.text(rect_text['x'], rect_text['y'], text=rect_text['text'], text_font_size={'value': '11pt'})
-	treemap_figure.text(new_rects_text['x'], new_rects_text['y'], text=new_rects_text['text'], text_font_size={'value': '11pt'})
+	# Todos los niveles comparten una única fuente de datos. Los textos se dibujan después de todos los rectángulos para que
+	# los rectángulos de nivel inferior no los tapen
+	source = ColumnDataSource(bokeh_utils.binary_columns(create_treemap_data(df, levels, value)))
+	treemap_figure.quad(top='top', bottom='bottom', left='left', right='right', color='color', line_color='black', source=source)
+	treemap_figure.text(x='label_x', y='label_y', text='label', text_font_size={'value': '11pt'}, source=source)
 
 	treemap_figure.title.text = 'Mapa de arbol de indicadores influentes'
 	treemap_figure.title.text_color = bokeh_utils.TITLE_FONT_COLOR
@@ -240,23 +132,7 @@ def create_treemap(df):
 
 	return treemap_figure
 
-def create_data_source_from_dataframe(df, group_value_name, group_value):
-	"""Crea ColumnDataSource desde DataFrame agrupando los valores de una columna concreta según un valor
-	
-	Parameters:
-		df (Dataframe): Dataframe de datos
-		group_value_name (string): Nombre de columna donde buscar los valores a agrupar
-		group_value (string): Valor para agrupar los datos
-	
-	Returns:
-		ColumnDataSource: ColumnDataSource con los datos correctamente agrupados
-	"""
-
-	df = df.loc[df[group_value_name].isin([group_value])]
-	source = ColumnDataSource(df)
-	return source
-
-
+@metrics.timed
 def create_normalize_plot(df):
 	"""Crea gráfica de variables afectando en cada tipo de calidad de agua con valores normalizados
 	
@@ -267,24 +143,22 @@ def create_normalize_plot(df):
 		Figure: Gráfica de variables afectando en cada tipo de calidad de agua con valores normalizados
 	"""
 
-	NUM_CLUSTERS = df.cluster.nunique()	# Extraer numero clusters
-	
-	# source_cluster_0 = create_data_source_from_dataframe(df, 'cluster', 'cluster_0')
-	# source_cluster_1 = create_data_source_from_dataframe(df, 'cluster', 'cluster_1')
-	# source_cluster_2 = create_data_source_from_dataframe(df, 'cluster', 'cluster_2')
-	# source_cluster_3 = create_data_source_from_dataframe(df, 'cluster', 'cluster_3')
-	source_cluster = []
-	for i in range(NUM_CLUSTERS):
-		source_cluster.append(create_data_source_from_dataframe(df, 'cluster', f'cluster_{i}'))
-		# print(source_cluster[i].data)
+	clusters = bokeh_utils.get_groups(df, 'cluster')
+	# Los indicadores del eje X siguen el orden en el que aparecen en el primer cluster
+	factors = df.loc[df['cluster'] == clusters[0], 'Indicador'].astype(str).tolist() if clusters else []
+
+	# Una única fuente de datos para los puntos de todos los clusters, cada cluster se dibuja con su vista. Los glyphs line no admiten
+	# vistas, las líneas usan una tabla con una columna de valores por cluster
+	source = ColumnDataSource(bokeh_utils.binary_columns(df))
+	views = bokeh_utils.create_group_views(source, 'cluster', clusters)
+	lines_source = ColumnDataSource(bokeh_utils.binary_columns(bokeh_utils.pivot_groups(df, 'Indicador', 'cluster', 'valor').reindex(factors)))
 
 	TOOLTIPS = [
 		('Indicador', '@Indicador'),
 		('Valor', '@valor')
 	]
 
-	normalize_plot = figure(plot_height=350, toolbar_location=None, sizing_mode='stretch_width',
-							x_range=FactorRange(factors=source_cluster[0].data['Indicador']), tooltips=TOOLTIPS)
+	normalize_plot = figure(plot_height=350, toolbar_location=None, sizing_mode='stretch_width', x_range=FactorRange(factors=factors))
 	# Linea horizontal de anotación sobre nivel máximo de 0 a 1
 	hline = Span(location=1, dimension='width', line_color='red', line_alpha=0.6, line_dash='dotted', line_width=2)
 	
@@ -294,9 +168,12 @@ def create_normalize_plot(df):
 	hlabel = Label(x=8.7, y=1, text='Max', text_color='red', text_alpha=0.6, text_font_size='14px')
 	normalize_plot.add_layout(hlabel)
 
-	for i in range(NUM_CLUSTERS):
-		normalize_plot.line(x='Indicador', y='valor', source=source_cluster[i], line_dash='dashed', line_width=2, line_color=bokeh_utils.LINE_COLORS_PALETTE[i], legend_label=f'Cluster {i}')
-		normalize_plot.circle(x='Indicador', y='valor', source=source_cluster[i], size=8, line_color=bokeh_utils.LINE_COLORS_PALETTE[i],fill_color='white', legend_label=f'Cluster {i}')
+	circles = []
+	for i, cluster in enumerate(clusters):
+		color = bokeh_utils.LINE_COLORS_PALETTE[i % len(bokeh_utils.LINE_COLORS_PALETTE)]
+		normalize_plot.line(x='Indicador', y=cluster, source=lines_source, line_dash='dashed', line_width=2, line_color=color, legend_label=f'Cluster {i}')
+		circles.append(normalize_plot.circle(x='Indicador', y='valor', source=source, view=views[cluster], size=8, line_color=color, fill_color='white', legend_label=f'Cluster {i}'))
+	normalize_plot.add_tools(HoverTool(renderers=circles, tooltips=TOOLTIPS))
 
 	normalize_plot.border_fill_color = bokeh_utils.BACKGROUND_COLOR
 	normalize_plot.xaxis.major_label_orientation = np.pi/4
@@ -328,6 +205,7 @@ def create_normalize_plot(df):
 	return normalize_plot
 
 
+@metrics.timed
 def create_radar_plot(df):
 	"""Crea gráfica de radar afectando en cada tipo de calidad de agua con valores normalizados
 	
@@ -381,13 +259,13 @@ def create_radar_plot(df):
 		x.append([v[0] for v in verts])
 		y.append([v[1] for v in verts])
 		if i==0:
-			source = ColumnDataSource({'x':x[i]+ [CENTER],'y':y[i]+ [(GRID_STEPS-i)*0.5/GRID_STEPS+CENTER],'text':text+ ['']})
+			source = ColumnDataSource(bokeh_utils.binary_columns({'x':x[i]+ [CENTER],'y':y[i]+ [(GRID_STEPS-i)*0.5/GRID_STEPS+CENTER],'text':text+ ['']}))
 			# source_test = ColumnDataSource({'x':x_var_label + [CENTER],'y':y[i]+ [(GRID_STEPS-i)*0.5/GRID_STEPS+CENTER],'text':text+ ['']})
 			var_labels = LabelSet(x="x",y="y",text="text",source=source, text_color=bokeh_utils.LABEL_FONT_COLOR, text_font_size='15px') # Position variable labels
 			nor_rad_pl.add_layout(var_labels) # Add variable labels
 			color='black'
 		else:
-			source = ColumnDataSource({'x':x[i]+ [CENTER],'y':y[i]+ [(GRID_STEPS-i)*0.5/GRID_STEPS+CENTER]}) #radius*i/GRID_STEPS+CENTER
+			source = ColumnDataSource(bokeh_utils.binary_columns({'x':x[i]+ [CENTER],'y':y[i]+ [(GRID_STEPS-i)*0.5/GRID_STEPS+CENTER]})) #radius*i/GRID_STEPS+CENTER
 			color='gainsboro'
 		nor_rad_pl.line(x="x", y="y", source=source, line_color=color) # Create poligons
 		y_ticks.append(y[i][0]) # Store y-vertices grid ticks positions
@@ -397,7 +275,7 @@ def create_radar_plot(df):
 
 	y_ticks.reverse()
 	text_labels_ticks = np.around(list(np.linspace(0, 1, GRID_STEPS, endpoint=False)), decimals=2) # Create text for grid ticks
-	source_labels_ticks = ColumnDataSource({'x':x_ticks,'y':y_ticks[:-1],'text':text_labels_ticks[1:]})
+	source_labels_ticks = ColumnDataSource(bokeh_utils.binary_columns({'x':x_ticks,'y':y_ticks[:-1],'text':text_labels_ticks[1:]}, keep=('text',)))
 	tick_labels = LabelSet(x="x",y="y",text="text",source=source_labels_ticks, text_color=bokeh_utils.LABEL_FONT_COLOR, text_font_size='14px') # Position grid tick labels
 	nor_rad_pl.add_layout(tick_labels) # Add grid tick labels
 
@@ -406,12 +284,25 @@ def create_radar_plot(df):
 	DATA_MIN = -2
 	DATA_MAX = 3
 
-	for i, cluster in enumerate(df.cluster.unique()):
-		clist.append(df[df['cluster'] == cluster])
-		xt, yt = radar_patch((clist[i].valor-DATA_MIN)/(DATA_MAX-DATA_MIN) * 0.5, theta, CENTER)
-		clist[i]=clist[i].assign(**{'xt':xt, 'yt':yt, 'valor_map':(clist[i].valor-DATA_MIN)/(DATA_MAX-DATA_MIN)})
-		nor_rad_pl.patch(x='xt', y='yt', fill_alpha=0.15, fill_color=colors[i], line_color=colors[i], legend_label=f'Cluster {i}', source=ColumnDataSource(clist[i]))
-		nor_rad_pl.circle(x='xt', y='yt', size=15, fill_color=None, line_color=None ,source=ColumnDataSource(clist[i]), name='radar_plt')
+	clusters = bokeh_utils.get_groups(df, 'cluster')
+	for cluster in clusters:
+		cluster_df = df[df['cluster'] == cluster]
+		xt, yt = radar_patch((cluster_df.valor-DATA_MIN)/(DATA_MAX-DATA_MIN) * 0.5, theta, CENTER)
+		clist.append(cluster_df.assign(**{'xt':xt, 'yt':yt, 'valor_map':(cluster_df.valor-DATA_MIN)/(DATA_MAX-DATA_MIN)}))
+
+	# Los polígonos se dibujan con un único glyph patches, con una fila por cluster (los glyphs conectados como patch no admiten vistas).
+	# Los puntos de todos los clusters comparten una fuente de datos y cada cluster usa su vista
+	patches_source = ColumnDataSource(data=dict(
+		xs=[bokeh_utils.to_binary_array(cluster_df['xt'].values) for cluster_df in clist],
+		ys=[bokeh_utils.to_binary_array(cluster_df['yt'].values) for cluster_df in clist],
+		color=[colors[i % len(colors)] for i in range(len(clusters))],
+		label=[f'Cluster {i}' for i in range(len(clusters))]))
+	nor_rad_pl.patches(xs='xs', ys='ys', fill_alpha=0.15, fill_color='color', line_color='color', legend_field='label', source=patches_source)
+
+	source = ColumnDataSource(bokeh_utils.binary_columns(pd.concat(clist, ignore_index=True)) if clist else {})
+	views = bokeh_utils.create_group_views(source, 'cluster', clusters)
+	for cluster in clusters:
+		nor_rad_pl.circle(x='xt', y='yt', size=15, fill_color=None, line_color=None, source=source, view=views[cluster], name='radar_plt')
 
 	nor_rad_pl.legend.location = 'bottom_left'
 	nor_rad_pl.legend.orientation = 'vertical'
@@ -429,6 +320,7 @@ def create_radar_plot(df):
 	return nor_rad_pl
 
 
+@metrics.timed
 def create_not_normalize_plot(df):
 	"""Crea tabla de variables afectando en cada tipo de calidad de agua con valores sin normalizar
 	
@@ -439,11 +331,12 @@ def create_not_normalize_plot(df):
 		DataTable: Tabla de variables afectando en cada tipo de calidad de agua con valores sin normalizar
 	"""
 	units = 4*["tuni1","tuni2","tuni3","tuni4","tuni5","tuni6","tuni7","tuni8","tuni9","tuni10"]
-	source = ColumnDataSource(df.assign(Units=units))
+	source = ColumnDataSource(bokeh_utils.binary_columns(df.assign(Units=units)))
 	columns = [
 		TableColumn(field='cluster', title='Cluster', width=20),
 		TableColumn(field='Indicador', title='Indicador (promedio)', width=72),
-		TableColumn(field='valor', title='Valor', width=30),
+		# Los valores son float32, sin formato la tabla mostraría los decimales de la conversión a double del navegador
+		TableColumn(field='valor', title='Valor', width=30, formatter=NumberFormatter(format='0[.][000]')),
 		TableColumn(field='Units', title='Unidad', width=30)
 	]
 
@@ -451,6 +344,7 @@ def create_not_normalize_plot(df):
 
 	return data_table
 
+@metrics.timed
 def create_weight_plot(df):
 	"""Crea gráfico de importancia de variables sobre calidad del agua
 	
@@ -461,7 +355,7 @@ def create_weight_plot(df):
 		DataTable: Gráfico de importancia de variables sobre calidad del agua
 	"""
 
-	source = ColumnDataSource(df)
+	source = ColumnDataSource(bokeh_utils.binary_columns(df))
 
 	TOOLTIPS = [
 		('Atributo', '@Attribute'),
@@ -515,39 +409,40 @@ def create_title(text):
 	title = Div(text=text, style={'font-weight': 'bold', 'font-size': '16px', 'color': bokeh_utils.TITLE_FONT_COLOR, 'margin-bottom': '2px', 'font-family': 'inherit'}, width=470, height=16)
 	return title
 
-def modify_first_descriptive(doc):
-	args = doc.session_context.request.arguments
-	try:
-		periodo = int(args.get('periodo')[0])
-	except:
-		periodo = 0
-	print(f'periodo: {periodo}')
-	# desc = create_description()
-	# Llamada al webservice de RapidMiner
-	json_document = call_webservice('http://rapidminer.vicomtech.org/api/rest/process/EDAR_Cartuja_Perfil_Out_JSON?', 'rapidminer', 'rapidminer', out_json=True)
-	df_perfil = [json_normalize(data) for data in json_document]
-	
+def clean_perfil_dataframes(df_perfil):
+	"""Prepara las tablas del servicio web para crear los gráficos del dashboard de perfil. Las tablas ya llegan limpias y con sus tipos
+	desde la caché (ver utils/table_schemas.py), no se copian ni se modifican porque se comparten entre sesiones
+
+	Parameters:
+		df_perfil (list): Lista de DataFrames devueltos por el proceso EDAR_Cartuja_Perfil_Out_JSON
+
+	Returns:
+		dict: DataFrames normalizados, sin normalizar y de pesos de los indicadores
+	"""
+	return {
+		'normalize': df_perfil[0],
+		'not_normalize': df_perfil[1],
+		'weight': df_perfil[2]
+	}
+
+def create_perfil_layout(perfil_data):
+	"""Crea todos los gráficos del dashboard de perfil
+
+	Parameters:
+		perfil_data (dict): DataFrames preparados con clean_perfil_dataframes
+
+	Returns:
+		GridBox: Distribución de los gráficos del dashboard
+	"""
 	# Extracción de los dataframe en valores absolutos
-	normalize_df = df_perfil[0]
-	not_normalize_df = df_perfil[1]
-	weight_df = df_perfil[2]
+	normalize_df = perfil_data['normalize']
+	not_normalize_df = perfil_data['not_normalize']
+	weight_df = perfil_data['weight']
 
 	# Extracción de los dataframe en valores de rendimientos
-	normalize_rend_df = df_perfil[0]
-	not_normalize_rend_df = df_perfil[1]
-	weight_rend_df = df_perfil[2]
-
-	# Eliminamos texto repetido average() de los indicadores
-	normalize_df['Indicador']=normalize_df['Indicador'].replace(regex=[r'\(', r'\)', 'average'],value='')	
-	not_normalize_df['Indicador']=not_normalize_df['Indicador'].replace(regex=[r'\(', r'\)', 'average'],value='')
-	normalize_rend_df['Indicador']=normalize_rend_df['Indicador'].replace(regex=[r'\(', r'\)', 'average'],value='')	
-	not_normalize_rend_df['Indicador']=not_normalize_rend_df['Indicador'].replace(regex=[r'\(', r'\)', 'average'],value='')	
-
-	# Convertimos las columnas numericas a flotante
-	normalize_df['valor'] = normalize_df['valor'].astype('float')
-	not_normalize_df['valor'] = not_normalize_df['valor'].astype('float')
-	normalize_rend_df['valor'] = normalize_rend_df['valor'].astype('float')
-	not_normalize_rend_df['valor'] = not_normalize_rend_df['valor'].astype('float')
+	normalize_rend_df = perfil_data['normalize']
+	not_normalize_rend_df = perfil_data['not_normalize']
+	weight_rend_df = perfil_data['weight']
 
 	# Creación de los gráficos
 	## Gráfico de perfil y araña normalizado-absolutos
@@ -583,10 +478,46 @@ def modify_first_descriptive(doc):
 	weight_plot_rend = create_weight_plot(weight_rend_df)
 
 	# Distribución de los gráficos con una grid de bokeh
-	l = grid([
+	perfil_layout = grid([
 		[profile_widget_box, profile_widget_box_rend],
 		[not_normalize_widget_box, not_normalize_widget_box_rend],
 		[weight_plot, weight_plot_rend]],
 		sizing_mode='stretch_both')
 
+	return perfil_layout
+
+def modify_first_descriptive(doc):
+	metrics.track_session(doc, 'perfil')
+	args = doc.session_context.request.arguments
+	try:
+		periodo = int(args.get('periodo')[0])
+	except:
+		periodo = 0
+	print(f'periodo: {periodo}')
+	# desc = create_description()
+
+	# La llamada al webservice se hace en un callback sin bloqueo del documento para no parar el IOLoop del resto de sesiones
+	@without_document_lock
+	async def load_perfil_data():
+		# Llamada al webservice de RapidMiner (compartida entre sesiones a través de la caché)
+		try:
+			df_perfil = await get_webservice_dataframes_async(f'{RAPIDMINER_URL}/EDAR_Cartuja_Perfil_Out_JSON?', 'rapidminer', 'rapidminer')
+		except Exception:
+			logger.exception('Error obteniendo los datos del perfil')
+			doc.add_next_tick_callback(show_load_error)
+			return
+		doc.add_next_tick_callback(partial(show_perfil_layout, df_perfil))
+
+	def show_perfil_layout(df_perfil):
+		# Si RapidMiner no responde los datos son los de la última instantánea local
+		snapshot_banner = bokeh_utils.create_snapshot_banner()
+		bokeh_utils.show_snapshot_banner(snapshot_banner, get_snapshot_time(df_perfil))
+		l.children = [snapshot_banner, create_perfil_layout(clean_perfil_dataframes(df_perfil))]
+		bokeh_utils.report_payload(doc, 'perfil', 'inicial')
+
+	def show_load_error():
+		l.children = [create_title('No se han podido obtener los datos de RapidMiner, inténtalo de nuevo más tarde')]
+
+	l = column([create_title('Cargando datos...')], sizing_mode='stretch_both')
 	doc.add_root(l)
+	doc.add_next_tick_callback(load_perfil_data)
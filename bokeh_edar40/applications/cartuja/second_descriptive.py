@@ -1,40 +1,60 @@
-from utils.rapidminer_proxy import call_webservice
-from bokeh_edar40.visualizations.decision_tree import Node, Tree
+from utils.rapidminer_proxy import call_webservice_tables, get_webservice_dataframes_async, run_webservice_task, WebserviceCache
+from utils.live_feed import get_new_rows
+from utils.snapshot_store import snapshot_store, get_snapshot_time
+from utils.server_config import RAPIDMINER_URL, RAPIDMINER_DATE_PARAMETERS, CACHE_MAX_BYTES, PREDICTION_CACHE_TTL, PREDICTION_CACHE_MAX_MODELS, MAX_SESSION_MODELS, SINGLE_MODEL_VIEW, STREAMING_INTERVAL, STREAMING_ROLLOVER, DAILY_PRED_MAX_POINTS
+from bokeh_edar40.visualizations.decision_tree import Tree
+from bokeh_edar40.visualizations.downsampling import downsample
 import utils.bokeh_utils as bokeh_utils
+import utils.metrics as metrics
 
 from bokeh.core.properties import value
-from bokeh.models import ColumnDataSource, Div, HoverTool, GraphRenderer, StaticLayoutProvider, Rect, MultiLine, LinearAxis, Grid, Legend, LegendItem, Span, Label, BasicTicker, ColorBar, LinearColorMapper, PrintfTickFormatter, MonthsTicker, LinearAxis, Range1d
+from bokeh.document import without_document_lock
+from bokeh.models import ColumnDataSource, Div, HoverTool, GlyphRenderer, GraphRenderer, StaticLayoutProvider, Rect, MultiLine, LinearAxis, Grid, Legend, LegendItem, Span, Label, BasicTicker, ColorBar, LinearColorMapper, PrintfTickFormatter, MonthsTicker, LinearAxis, Range1d
 from bokeh.models.ranges import FactorRange
-from bokeh.models.widgets import Select, Button, TableColumn, DataTable, CheckboxButtonGroup
+from bokeh.models.widgets import Select, Button, TableColumn, DataTable, CheckboxButtonGroup, RadioButtonGroup, DateRangeSlider
 from bokeh.plotting import figure
 from bokeh.layouts import layout, widgetbox, column, row, gridplot
 from bokeh.models.formatters import DatetimeTickFormatter
-from bokeh.models.tickers import FixedTicker
 from bokeh.transform import jitter, factor_cmap, dodge, transform
 
 import xml.etree.ElementTree as et
 import pandas as pd
 import numpy as np
-from pandas.io.json import json_normalize
 from collections import OrderedDict
+from functools import partial
+import weakref
 from datetime import datetime as dt
 import time
+import logging
 
+logger = logging.getLogger(__name__)
 
-def create_data_source_from_dataframe(df, group_value_name, group_value):
-	"""Crea ColumnDataSource desde DataFrame agrupando los valores de una columna concreta según un valor
+MODEL_DISCRETISE = 5
+MODEL_NUM_ATTRIBUTES = 4
+CORRECTS_BAR_WIDTH = 0.1
+DECISION_TREE_X_RANGE = (-1.1, 1.1)
+# Periodo inicial de las predicciones diarias y primera fecha que se puede elegir en el control de periodo
+DAILY_PRED_WINDOW = ('2018-01-01', '2019-01-31')
+DAILY_PRED_HISTORY_START = '2017-01-01'
+
+# Modelos de predicción compartidos por todas las sesiones, se eliminan los menos usados y los más antiguos
+prediction_cache = WebserviceCache('prediction', ttl=PREDICTION_CACHE_TTL, stale_ttl=0, max_bytes=CACHE_MAX_BYTES, max_entries=PREDICTION_CACHE_MAX_MODELS)
+# Serie completa de cada gráfica de predicciones diarias, al navegador solo se envía la parte visible reducida
+daily_pred_series = weakref.WeakKeyDictionary()
+
+def stream_dataframe(source, df, rollover=None):
+	"""Añade al final de un ColumnDataSource las filas de un DataFrame, enviando al navegador solo las filas nuevas
 	Parameters:
-		df (Dataframe): Dataframe de datos
-		group_value_name (string): Nombre de columna donde buscar los valores a agrupar
-		goup_value (string): Valor para agrupar los datos
-	
-	Returns:
-		ColumnDataSource: ColumnDataSource con los datos correctamente agrupados
+		source (ColumnDataSource): ColumnDataSource creado a partir de un DataFrame con las mismas columnas
+		df (Dataframe): Filas nuevas
+		rollover (int): Filas que se mantienen como máximo en source (None para no limitarlas)
 	"""
-	df = df.loc[df[group_value_name].isin([group_value])]
-	source = ColumnDataSource(df)
-
-	return source
+	if df.empty:
+		return
+	df = bokeh_utils.plain_columns(df.reset_index())
+	# Las columnas que no vienen en las filas nuevas se rellenan con NaN, stream necesita todas las columnas de source
+	new_data = {column: df[column].values if column in df else np.full(len(df), np.nan) for column in source.data}
+	source.stream(bokeh_utils.binary_columns(new_data), rollover)
 
 def calc_xoffset_corrects_plot(num_vals, bar_width):
     """Calcula el x offset de las barras según su ancho
@@ -65,29 +85,32 @@ def calc_xoffset_corrects_plot(num_vals, bar_width):
 
     return x_pos
 
-def create_corrects_plot(df, target):
+def create_corrects_plot(df, target, num_bars=None):
 	"""Crea gráfica de aciertos
 	Parameters:
 		df: Dataframe con los datos de la matriz de confusión
+		target (string): Variable objetivo del modelo
+		num_bars (int): Número de barras por grupo (None para una por clase de df). Si la gráfica se va a reutilizar con
+			update_corrects_plot debe ser el número máximo de clases de los modelos
 
 	Returns:
-		DataTable: Tabla de matriz de confusión
+		Figure: Gráfica de aciertos
 	"""
-	xlabels = list(df.keys())
-	source = ColumnDataSource(df)
+	num_bars = len(df.keys()) if num_bars is None else num_bars
+	source = ColumnDataSource(data=dict(Actual=[]))
 
-	corrects_plot = figure(x_range=xlabels, plot_height=400, toolbar_location=None, sizing_mode='stretch_width')
+	corrects_plot = figure(x_range=FactorRange(), plot_height=400, toolbar_location=None, sizing_mode='stretch_width', name='corrects_plot')
 
-	bar_width = 0.1
-	xloc = calc_xoffset_corrects_plot(num_vals=len(xlabels), bar_width=bar_width)
-	for i, label in enumerate(xlabels):
-		r = corrects_plot.vbar(x=dodge('Actual', xloc[i], range=corrects_plot.x_range), top=label, width=bar_width, source=source,
-				color=bokeh_utils.BAR_COLORS_PALETTE[i], legend_label=label, name=xlabels[i])
+	# Las barras se crean vacías, update_corrects_plot les asigna la columna, la posición y el nombre de cada clase
+	for i in range(num_bars):
+		r = corrects_plot.vbar(x=dodge('Actual', 0, range=corrects_plot.x_range), top=0, width=CORRECTS_BAR_WIDTH, source=source,
+				color=bokeh_utils.BAR_COLORS_PALETTE[i % len(bokeh_utils.BAR_COLORS_PALETTE)])
 		hover = HoverTool(tooltips=[
 			("Predicción", "$name"),
 			("Aciertos", "@$name")
 		], renderers=[r])
 		corrects_plot.add_tools(hover)
+	corrects_plot.add_layout(Legend(items=[]))
 	corrects_plot.x_range.range_padding = 0.1
 	corrects_plot.xgrid.grid_line_color = None
 	corrects_plot.y_range.start = 0
@@ -100,15 +123,43 @@ def create_corrects_plot(df, target):
 	corrects_plot.xaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
 	corrects_plot.yaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
 
-	corrects_plot.title.text = f'Gráfica de aciertos - {target}'
 	corrects_plot.title.text_color = bokeh_utils.TITLE_FONT_COLOR
 	corrects_plot.title.align = 'left'
 	corrects_plot.title.text_font_size = '16px'
 	corrects_plot.border_fill_color = bokeh_utils.BACKGROUND_COLOR
 	corrects_plot.min_border_right = 15
 
+	update_corrects_plot(corrects_plot, df, target)
 	return corrects_plot
 
+@metrics.timed
+def update_corrects_plot(corrects_plot, df, target):
+	"""Sustituye los datos de la gráfica de aciertos por los de otro modelo. Las barras que sobran se ocultan
+	Parameters:
+		corrects_plot (Figure): Gráfica de aciertos creada con create_corrects_plot
+		df: Dataframe con los datos de la matriz de confusión
+		target (string): Variable objetivo del modelo
+	"""
+	xlabels = list(df.keys())
+	bars = [renderer for renderer in corrects_plot.renderers if isinstance(renderer, GlyphRenderer)]
+	xloc = calc_xoffset_corrects_plot(num_vals=len(xlabels), bar_width=CORRECTS_BAR_WIDTH)
+
+	corrects_plot.x_range.factors = xlabels
+	bars[0].data_source.data = bokeh_utils.binary_columns(df)
+	legend_items = []
+	for i, r in enumerate(bars):
+		if i < len(xlabels):
+			r.glyph.x = dodge('Actual', xloc[i], range=corrects_plot.x_range)
+			r.glyph.top = xlabels[i]
+			r.name = xlabels[i]
+			r.visible = True
+			legend_items.append(LegendItem(label=value(xlabels[i]), renderers=[r]))
+		else:
+			r.glyph.top = 0
+			r.visible = False
+	corrects_plot.legend[0].items = legend_items
+	corrects_plot.title.text = f'Gráfica de aciertos - {target}'
+
 def create_attribute_weight_plot(df, target):
 	"""Crea gráfica de importancia de predictores
 	Parameters:
@@ -117,10 +168,7 @@ def create_attribute_weight_plot(df, target):
 	Returns:
 		Figure: Gráfica de importancia de predictores
 	"""
-
-	df['colors'] = bokeh_utils.BAR_COLORS_PALETTE[:len(df['Attribute'].values)]
-
-	source = ColumnDataSource(df)
+	source = ColumnDataSource(data=dict(Attribute=[], Weight=[], colors=[]))
 	
 	hover_tool = HoverTool(
 		tooltips = [
@@ -128,9 +176,9 @@ def create_attribute_weight_plot(df, target):
 		]
 		)
 
-	weight_plot = figure(plot_height=400, toolbar_location=None, sizing_mode='stretch_width', x_range=df['Attribute'].values)
+	weight_plot = figure(plot_height=400, toolbar_location=None, sizing_mode='stretch_width', x_range=FactorRange(), name='weight_plot')
 
-	weight_plot.vbar(x='Attribute', top='Weight', source=source, width=0.9, line_color='white', fill_color='colors')
+	weight_plot.vbar(x='Attribute', top='Weight', source=source, width=0.9, line_color='white', fill_color='colors', name='weights')
 
 	weight_plot.xaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
 
@@ -138,7 +186,6 @@ def create_attribute_weight_plot(df, target):
 
 	weight_plot.y_range.start = 0
 
-	weight_plot.title.text = f'Importancia de los predictores - {target}'
 	weight_plot.title.text_color = bokeh_utils.TITLE_FONT_COLOR
 	weight_plot.title.align = 'left'
 	weight_plot.title.text_font_size = '16px'
@@ -146,8 +193,23 @@ def create_attribute_weight_plot(df, target):
 
 	weight_plot.add_tools(hover_tool)
 
+	update_attribute_weight_plot(weight_plot, df, target)
 	return weight_plot
 
+@metrics.timed
+def update_attribute_weight_plot(weight_plot, df, target):
+	"""Sustituye los datos de la gráfica de importancia de predictores por los de otro modelo
+	Parameters:
+		weight_plot (Figure): Gráfica creada con create_attribute_weight_plot
+		df (Dataframe): Dataframe con los datos a mostrar en la visualización
+		target (string): Variable objetivo del modelo
+	"""
+	df = df.assign(colors=bokeh_utils.BAR_COLORS_PALETTE[:len(df['Attribute'].values)])
+
+	weight_plot.x_range.factors = list(df['Attribute'].values)
+	weight_plot.select_one({'name': 'weights'}).data_source.data = bokeh_utils.binary_columns(df)
+	weight_plot.title.text = f'Importancia de los predictores - {target}'
+
 def create_confusion_matrix(df):
 	"""Crea tabla de matriz de confusión
 	Parameters:
@@ -156,42 +218,42 @@ def create_confusion_matrix(df):
 	Returns:
 		Figure: Gráfica de importancia de predictores
 	"""
-	# Tranformar el DataFrame en un stack
-	data_dict = df.stack().rename("value").reset_index()
-
 	# Paleta de colores
 	# colors = ['#f7fbff','#deebf7','#c6dbef','#9ecae1','#6baed6','#4292c6','#2171b5','#08519c','#08306b']
 	colors = ['#f7fbff','#deebf7','#c6dbef','#9ecae1','#6baed6','#4292c6','#2171b5','#08519c']
 
 	# Had a specific mapper to map color with value
-	mapper = LinearColorMapper(palette=colors, low=data_dict.value.min(), high=data_dict.value.max())
+	mapper = LinearColorMapper(palette=colors, low=0, high=1)
 
 	# Define a figure
 	p = figure(
 		plot_height=270,
-		x_range=list(data_dict.Actual.drop_duplicates()),
-		y_range=list(reversed(data_dict.Prediction.drop_duplicates())),
+		x_range=FactorRange(),
+		y_range=FactorRange(),
 		toolbar_location=None,
 		tools="",
 		x_axis_location="above",
 		x_axis_label="Actual Label",
 		y_axis_label="Predicted Label",
-		sizing_mode='stretch_width')
+		sizing_mode='stretch_width',
+		name='confusion_matrix')
 	p.xaxis.axis_line_color = None
 	p.yaxis.axis_line_color = None
 	p.xaxis.major_label_orientation = np.pi/4
 	
 	# Create rectangle for heatmap
+	source = ColumnDataSource(data=dict(Actual=[], Prediction=[], value=[]))
 	p.rect(
 		x="Actual",
 		y="Prediction",
 		width=1,
 		height=1,
-		source=ColumnDataSource(data_dict),
+		source=source,
 		line_color=None,
-		fill_color=transform('value', mapper))
+		fill_color=transform('value', mapper),
+		name='confusion_cells')
 	p.text(x="Actual",
-		y="Prediction", text='value', text_align="center", text_baseline="middle", source=ColumnDataSource(data_dict))
+		y="Prediction", text='value', text_align="center", text_baseline="middle", source=source)
 	
 	p.border_fill_color = bokeh_utils.BACKGROUND_COLOR	
 	p.background_fill_color = bokeh_utils.BACKGROUND_COLOR
@@ -205,8 +267,38 @@ def create_confusion_matrix(df):
 
 	p.add_layout(color_bar, 'right')
 
+	update_confusion_matrix(p, df)
 	return p
 
+@metrics.timed
+def update_confusion_matrix(p, df):
+	"""Sustituye los datos de la matriz de confusión por los de otro modelo
+	Parameters:
+		p (Figure): Matriz de confusión creada con create_confusion_matrix
+		df (Dataframe): Dataframe con los datos de la matriz de confusión
+	"""
+	# Tranformar el DataFrame en un stack
+	data_dict = df.stack().rename("value").reset_index()
+
+	p.x_range.factors = list(data_dict.Actual.drop_duplicates())
+	p.y_range.factors = list(reversed(data_dict.Prediction.drop_duplicates()))
+	mapper = p.select_one({'type': LinearColorMapper})
+	mapper.low = data_dict.value.min()
+	mapper.high = data_dict.value.max()
+	# Los valores se muestran como texto en las celdas, se envían sin reducir a float32
+	p.select_one({'name': 'confusion_cells'}).data_source.data = bokeh_utils.binary_columns(data_dict, keep=('value',))
+
+def read_model_variables():
+	"""Lee las variables objetivo disponibles para la modelización
+
+	Returns:
+		list: Variables objetivo del fichero resources/model_variables.txt
+	"""
+	with open('resources/model_variables.txt', 'r') as variables_file:
+		variables_file_lines = variables_file.readlines()
+
+	return [line.rstrip('\n') for line in variables_file_lines]
+
 def create_model_menu():
 	"""Crea menú de selección de variables para modelización del árbol de decisión
 
@@ -215,10 +307,7 @@ def create_model_menu():
 		Select: Panel de selección de variable del menú de selección
 	"""
 
-	variables_file = open('resources/model_variables.txt', 'r')
-	variables_file_lines = variables_file.readlines()
-
-	option_values = [line.rstrip('\n') for line in variables_file_lines]
+	option_values = read_model_variables()
 	
 	option_values.sort(key=lambda option_value:(option_value[:2]!='O_', option_value))
 
@@ -231,77 +320,66 @@ def create_model_menu():
 	return title, button, select
 
 
-def create_decision_tree_graph_renderer(plot, tree):
-	"""Crea el renderizador del gráfico del árbol de decisión. Para ello se deben especificar configuraciones como: indices o identificadores
-	de los nodos, colores de los nodos, tipos de figura de los nodos, tipos de figura de relación entre nodo y las relaciones entre los nodos (inicio y final)
+def create_decision_tree_plot(tree):
+	"""Crea la figura para visualizar el árbol de decisión, con el renderizador del grafo y los textos (nombre del nodo y
+	condición de relación). Los datos se asignan con update_decision_tree_plot
 	Parameters:
-		plot (Figure): Figura Bokeh donde se muestra el árbol de decisión
 		tree (Tree): Estructura del árbol de decisión a mostrar
 
 	Returns:
-		GraphRenderer: Renderizador del gráfico del árbol de decisión
+		Figure: Gráfica del árbol de decisión
 	"""
-	
-	node_indices = [node.id for node in tree.node_list]
-	node_colors = [node.color for node in tree.node_list]
+	plot = figure(x_range=DECISION_TREE_X_RANGE, y_range=(0,1.1), toolbar_location=None, plot_height=500, sizing_mode='stretch_width', name='decision_tree_plot')
 
-	start, end = tree.get_nodes_relations()
-	x, y = tree.get_layout_node_positions(plot)
-	graph_layout = dict(zip(node_indices, zip(x,y)))
-
-	graph = GraphRenderer()
+	plot.axis.visible = False
+	plot.xgrid.grid_line_color = None
+	plot.ygrid.grid_line_color = None
+	plot.border_fill_color = bokeh_utils.BACKGROUND_COLOR	
+	plot.background_fill_color = bokeh_utils.BACKGROUND_COLOR
+	plot.outline_line_color = None
 
-	graph.node_renderer.data_source.add(node_indices, 'index')
-	graph.node_renderer.data_source.add(node_colors, 'color')
+	graph = GraphRenderer(name='decision_tree_graph')
 	graph.node_renderer.glyph = Rect(height=0.15, width=0.2, fill_color='color')
 	graph.edge_renderer.glyph = MultiLine(line_color='#b5b8bc', line_alpha=0.8, line_width=5)
+	graph.layout_provider = StaticLayoutProvider(graph_layout={})
+	plot.renderers.append(graph)
 
-	graph.edge_renderer.data_source.data = dict(
-    	start=start,
-    	end=end)
-
-	graph.layout_provider = StaticLayoutProvider(graph_layout=graph_layout)
+	# Los textos se dibujan después del grafo para que queden por encima
+	plot.text(x='x', y='y', text='text', source=ColumnDataSource(data=dict(x=[], y=[], text=[])), text_font_size={'value': '10pt'}, text_align='center', name='node_labels')
+	plot.text(x='x', y='y', text='text', source=ColumnDataSource(data=dict(x=[], y=[], text=[])), text_font_size={'value': '11pt'}, text_align='center', name='link_labels')
 
-	return graph
+	update_decision_tree_plot(plot, tree)
+	return plot
 
-def append_labels_to_decision_tree(plot, graph, tree):
-	"""Añade los textos necesarios (nombre del nodo y condición de relación) al gráfico del árbol de visualización
+@metrics.timed
+def update_decision_tree_plot(plot, tree):
+	"""Sustituye el árbol de decisión mostrado. Para ello se asignan los indices o identificadores de los nodos, colores de
+	los nodos, las relaciones entre los nodos (inicio y final), la posición de los nodos y los textos
 	Parameters:
-		plot (Figure): Figura Bokeh donde se muestra el árbol de decisión
-		graph (GraphRenderer): Renderizador del gráfico del árbol de decisión
+		plot (Figure): Figura creada con create_decision_tree_plot
 		tree (Tree): Estructura del árbol de decisión a mostrar
-
-	Returns:
-		Figure: Gráfica del árbol de decisión
 	"""
-	plot.renderers = []
-	plot.renderers.append(graph)
-	
-	node_text_x, node_text_y, node_text = tree.get_node_text_positions()
-	plot.text(node_text_x, node_text_y, text=node_text, text_font_size={'value': '10pt'}, text_align='center')
-
-	middle_x, middle_y, middle_text = tree.get_line_text_positions()
-	plot.text(middle_x, middle_y, text=middle_text, text_font_size={'value': '11pt'}, text_align='center')
-	return plot
-
+	# La distribución de los nodos amplía el rango X si el árbol no cabe, se parte siempre del rango inicial
+	plot.x_range.start, plot.x_range.end = DECISION_TREE_X_RANGE
 
-def create_decision_tree_plot():
-	"""Crea la figura para visualizar el árbol de decisión
+	node_indices = np.arange(len(tree), dtype=np.int32)
+	start, end = tree.get_nodes_relations()
+	x, y = tree.get_layout_node_positions(plot)
+	# Las posiciones de graph_layout se envían como JSON, se redondean para no enviar todos los decimales de float64
+	graph_layout = dict(zip(node_indices.tolist(), zip(np.round(x, 4).tolist(), np.round(y, 4).tolist())))
 
-	Returns:
-		Figure: Gráfica del árbol de decisión
-	"""
-	plot = figure(x_range=(-1.1,1.1), y_range=(0,1.1), toolbar_location=None, plot_height=500, sizing_mode='stretch_width')
+	graph = plot.select_one({'name': 'decision_tree_graph'})
+	graph.node_renderer.data_source.data = bokeh_utils.binary_columns(dict(index=node_indices, color=tree.get_node_colors()))
+	graph.edge_renderer.data_source.data = bokeh_utils.binary_columns(dict(start=start, end=end))
+	graph.layout_provider.graph_layout = graph_layout
 
-	plot.axis.visible = False
-	plot.xgrid.grid_line_color = None
-	plot.ygrid.grid_line_color = None
-	plot.border_fill_color = bokeh_utils.BACKGROUND_COLOR	
-	plot.background_fill_color = bokeh_utils.BACKGROUND_COLOR
-	plot.outline_line_color = None
+	node_text_x, node_text_y, node_text = tree.get_node_text_positions()
+	plot.select_one({'name': 'node_labels'}).data_source.data = bokeh_utils.binary_columns(dict(x=node_text_x, y=node_text_y, text=node_text))
 
-	return plot
+	middle_x, middle_y, middle_text = tree.get_line_text_positions()
+	plot.select_one({'name': 'link_labels'}).data_source.data = bokeh_utils.binary_columns(dict(x=middle_x, y=middle_y, text=middle_text))
 
+@metrics.timed
 def create_outlier_plot(df):
 	"""Crea gráfica de outliers
 	Parameters:
@@ -324,18 +402,14 @@ def create_outlier_plot(df):
 
 	outlier_plot = figure(plot_height=400, toolbar_location=None, sizing_mode='stretch_width', x_axis_type='datetime')
 
-	df['timestamp'] = pd.to_datetime(df['timestamp'])
-	df['outlier'] = pd.to_numeric(pd.Series(df['outlier'].values))
-
-	source_cluster_0 = create_data_source_from_dataframe(df, 'cluster', 'cluster_0')
-	source_cluster_1 = create_data_source_from_dataframe(df, 'cluster', 'cluster_1')
-	source_cluster_2 = create_data_source_from_dataframe(df, 'cluster', 'cluster_2')
-	source_cluster_3 = create_data_source_from_dataframe(df, 'cluster', 'cluster_3')
-
-	outlier_plot.circle(x='timestamp', y='outlier', source=source_cluster_0, color=bokeh_utils.LINE_COLORS_PALETTE[0], size=6, legend_label='Cluster 0')
-	outlier_plot.circle(x='timestamp', y='outlier', source=source_cluster_1, color=bokeh_utils.LINE_COLORS_PALETTE[1], size=6, legend_label='Cluster 1')
-	outlier_plot.circle(x='timestamp', y='outlier', source=source_cluster_2, color=bokeh_utils.LINE_COLORS_PALETTE[2], size=6, legend_label='Cluster 2')
-	outlier_plot.circle(x='timestamp', y='outlier', source=source_cluster_3, color=bokeh_utils.LINE_COLORS_PALETTE[3], size=6, legend_label='Cluster 3')
+	# Una única fuente de datos para todos los clusters, cada cluster se dibuja con su vista. El índice no se reduce porque recibe
+	# las filas nuevas del modo en directo
+	source = ColumnDataSource(bokeh_utils.binary_columns(df, keep=('index',)), name='outliers')
+	clusters = bokeh_utils.get_groups(df, 'cluster')
+	views = bokeh_utils.create_group_views(source, 'cluster', clusters)
+	for i, cluster in enumerate(clusters):
+		color = bokeh_utils.LINE_COLORS_PALETTE[i % len(bokeh_utils.LINE_COLORS_PALETTE)]
+		outlier_plot.circle(x='timestamp', y='outlier', source=source, view=views[cluster], color=color, size=6, legend_label=f'Cluster {i}', name=cluster)
 
 	outlier_plot.xaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
 	outlier_plot.yaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
@@ -357,6 +431,21 @@ def create_outlier_plot(df):
 
 	return outlier_plot
 
+@metrics.timed
+def stream_outlier_plot(outlier_plot, df, rollover=None):
+	"""Añade filas nuevas a la gráfica de outliers
+	Parameters:
+		outlier_plot (Figure): Gráfica creada con create_outlier_plot
+		df (Dataframe): Filas nuevas de la tabla de outliers
+		rollover (int): Puntos que se mantienen como máximo por cluster, de media (None para no limitarlos)
+	"""
+	if df.empty:
+		return
+	# Todos los clusters comparten la fuente de datos, las vistas se recalculan en el navegador al recibir las filas
+	num_clusters = max(len(outlier_plot.select({'type': GlyphRenderer})), 1)
+	stream_dataframe(outlier_plot.select_one({'name': 'outliers'}), df, rollover*num_clusters if rollover is not None else None)
+
+@metrics.timed
 def create_prediction_plot(df):
 	"""Crea gráfica de predicción a futuro
 	Parameters:
@@ -369,7 +458,7 @@ def create_prediction_plot(df):
 	hover_tool = HoverTool(
 		tooltips = [
 			('Fecha', '$x{%b %Y}'),
-			('Predicción', '@Prediction')
+			('Predicción', '@$name')
 		],
 		formatters = {
 			'$x': 'datetime',
@@ -377,23 +466,16 @@ def create_prediction_plot(df):
 		mode = 'mouse'
 		)
 
-	# Estructuración de los tipos de datos del dataframe
-	df['añomes'] = pd.to_datetime(df['añomes'], format='%m/%d/%y %I:%M %p')
-	df['Prediction'] = pd.to_numeric(pd.Series(df['Prediction'].values))
-
 	prediction_plot = figure(plot_height=400, toolbar_location=None, sizing_mode='stretch_width', x_axis_type='datetime')
-	
-	source_cluster_0 = create_data_source_from_dataframe(df, 'cluster', 'cluster_0')
-	source_cluster_1 = create_data_source_from_dataframe(df, 'cluster', 'cluster_1')
-	source_cluster_2 = create_data_source_from_dataframe(df, 'cluster', 'cluster_2')
-	source_cluster_3 = create_data_source_from_dataframe(df, 'cluster', 'cluster_3')
 
-	x_axis_tick_vals = source_cluster_0.data['añomes'].astype(int) / 10**6
+	# Una única fuente de datos con una columna de predicciones por cluster (los glyphs line no admiten vistas). El nombre de cada
+	# línea es su columna, así la herramienta hover la encuentra con @$name
+	source = ColumnDataSource(bokeh_utils.binary_columns(bokeh_utils.pivot_groups(df, 'añomes', 'cluster', 'Prediction')), name='predictions')
+	clusters = bokeh_utils.get_groups(df, 'cluster')
 
-	prediction_plot.line(x='añomes', y='Prediction', source=source_cluster_0, line_width=2, line_color=bokeh_utils.LINE_COLORS_PALETTE[0], legend_label='Cluster 0')
-	prediction_plot.line(x='añomes', y='Prediction', source=source_cluster_1, line_width=2, line_color=bokeh_utils.LINE_COLORS_PALETTE[1], legend_label='Cluster 1')
-	prediction_plot.line(x='añomes', y='Prediction', source=source_cluster_2, line_width=2, line_color=bokeh_utils.LINE_COLORS_PALETTE[2], legend_label='Cluster 2')
-	prediction_plot.line(x='añomes', y='Prediction', source=source_cluster_3, line_width=2, line_color=bokeh_utils.LINE_COLORS_PALETTE[3], legend_label='Cluster 3')
+	for i, cluster in enumerate(clusters):
+		color = bokeh_utils.LINE_COLORS_PALETTE[i % len(bokeh_utils.LINE_COLORS_PALETTE)]
+		prediction_plot.line(x='añomes', y=cluster, source=source, line_width=2, line_color=color, legend_label=f'Cluster {i}', name=cluster)
 
 	prediction_plot.xaxis.major_label_orientation = np.pi/4
 	prediction_plot.xaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
@@ -405,7 +487,8 @@ def create_prediction_plot(df):
 	prediction_plot.legend.click_policy = 'hide'
 	prediction_plot.legend.label_text_color = bokeh_utils.LABEL_FONT_COLOR
 	prediction_plot.xaxis[0].formatter = DatetimeTickFormatter(months=['%b %Y'])
-	prediction_plot.xaxis[0].ticker = FixedTicker(ticks=list(x_axis_tick_vals))
+	# Una marca por mes calculada en el navegador, así al añadir filas con stream no hay que enviar de nuevo las marcas
+	prediction_plot.xaxis[0].ticker = MonthsTicker(months=list(range(1,13)))
 	# Linea vertical para definir el horizonte de predicción
 	prediction_date = time.mktime(dt(2019, 2, 1, 0, 0, 0).timetuple())*1000
 	vline = Span(location=prediction_date, dimension='height', line_color='gray', line_alpha=0.6, line_dash='dotted', line_width=2)
@@ -424,6 +507,20 @@ def create_prediction_plot(df):
 
 	return prediction_plot
 
+@metrics.timed
+def stream_prediction_plot(prediction_plot, df, rollover=None):
+	"""Añade filas nuevas a la gráfica de predicción a futuro. Solo se envían al navegador las filas nuevas
+	Parameters:
+		prediction_plot (Figure): Gráfica creada con create_prediction_plot
+		df (Dataframe): Filas nuevas de la tabla de predicción
+		rollover (int): Puntos que se mantienen como máximo en cada cluster (None para no limitarlos)
+	"""
+	if df.empty:
+		return
+	# Las filas nuevas se pasan a una fila por fecha con una columna por cluster, igual que en create_prediction_plot
+	source = prediction_plot.select_one({'name': 'predictions'})
+	stream_dataframe(source, bokeh_utils.pivot_groups(df, 'añomes', 'cluster', 'Prediction'), rollover)
+
 def create_df_confusion(df_original):
 	"""Crea el dataframe para la matriz de confusion
 	Parameters:
@@ -447,6 +544,7 @@ def create_df_confusion(df_original):
 	df = df.apply(pd.to_numeric)
 	return df
 
+@metrics.timed
 def create_decision_tree_data(df, target='Calidad_Agua'):
 	"""Crea el Tree del decision tree
 	Parameters:
@@ -459,37 +557,140 @@ def create_decision_tree_data(df, target='Calidad_Agua'):
 	'range1': bokeh_utils.BAR_COLORS_PALETTE[0], 'range2': bokeh_utils.BAR_COLORS_PALETTE[1], 'range3': bokeh_utils.BAR_COLORS_PALETTE[2], 'range4': bokeh_utils.BAR_COLORS_PALETTE[3], 'range5': bokeh_utils.BAR_COLORS_PALETTE[4]}
 
 	tree = Tree()
-	count = 0
-	for j, elements in enumerate(df['Condition']):
-		leaf = elements.split(' & ')
-		# print(leaf)
-		for i in range(len(leaf)+1):
-			if i < len(leaf):
-				node = leaf[i].split(' ', 1)
-				# print(node)
-				node_name = node[0]
-				tree_node = Node(count+1, node_name, i, '#c2e8e0')
-				# print(f"tree_node = Node({count+1}, '{node_name}', {i}, '#c2e8e0')")
-				tree.order_nodes(tree_node, node[1])
-				# print(f"tree.order_nodes(tree_node, '{node[1]}')")
-			else:
-				if target == 'Calidad_Agua':
-					node_name = df['Prediction'][j]
-					color = color_palette[df['Prediction'][j]]
-				else:
-					range_split = df['Prediction'][j].split(' ', 1)
-					# print(f'range_split[0]:{range_split[0]}')
-					# print(f'range_split[1]:{range_split[1]}')
-					node_name = range_split[0] + '\n' + range_split[1]
-					color = color_palette[range_split[0]]
-				# print(f"tree_node = Node({count+1}, '{node_name}', {i}, '{color}')")
-				tree_node = Node(count+1, node_name, i, color)
-				tree.order_nodes(tree_node, node[1])
-				# print(f"tree.order_nodes(tree_node, '{node[1]}')")
-			count = count + 1
-
-	return tree
+	for condition, prediction in zip(df['Condition'], df['Prediction']):
+		conditions = [tuple(element.split(' ', 1)) for element in condition.split(' & ')]
+		if target == 'Calidad_Agua':
+			leaf_name = prediction
+			leaf_color = color_palette[prediction]
+		else:
+			range_split = prediction.split(' ', 1)
+			leaf_name = range_split[0] + '\n' + range_split[1]
+			leaf_color = color_palette[range_split[0]]
+		tree.add_rule(conditions, leaf_name, leaf_color)
+
+	return tree.compact()
+
+@metrics.timed
+def create_prediction_bundle(df_prediction, model_objective):
+	"""Crea las tablas de un modelo de predicción a partir de la respuesta del servicio web
+	Parameters:
+		df_prediction (list): DataFrames devueltos por el proceso EDAR_Cartuja_Prediccion_JSON (ver call_webservice_tables)
+		model_objective (string): Variable objetivo del modelo
+	
+	Returns:
+		dict: DataFrames del árbol de decisión, matriz de confusión, pesos de los atributos y predicciones diarias, y el instante de la
+			instantánea local de la que se han leído (snapshot_time, None si vienen de RapidMiner)
+	"""
+	# Las columnas de las tablas mantienen el orden de la respuesta
+	prediction_bundle = clean_prediction_dataframes(df_prediction, list(df_prediction[1].columns), model_objective)
+	prediction_bundle['snapshot_time'] = get_snapshot_time(df_prediction)
+	return prediction_bundle
+
+def clean_prediction_dataframes(df_prediction, confusion_columns, model_objective):
+	"""Prepara las tablas de un modelo de predicción para crear sus gráficos
+	Parameters:
+		df_prediction (list): Lista de DataFrames del proceso EDAR_Cartuja_Prediccion_JSON
+		confusion_columns (list): Columnas de la matriz de confusión en el orden de la respuesta
+		model_objective (string): Variable objetivo del modelo
+	
+	Returns:
+		dict: DataFrames del árbol de decisión, matriz de confusión, pesos de los atributos y predicciones diarias
+	"""
+	confusion_df_raw = df_prediction[1].reindex(columns=confusion_columns)
+	return {
+		'decision_tree': df_prediction[0],
+		'confusion': create_df_confusion(confusion_df_raw),
+		'weight': df_prediction[2],
+		'daily_pred': create_df_daily_pred(df_prediction[3], model_objective)
+	}
+
+def create_df_daily_pred(df_original, model_objective):
+	"""Crea el dataframe de las predicciones diarias, indexado por fecha (ordenado y sin fechas repetidas) para poder recortar
+	periodos con búsqueda binaria. Las clases se guardan como categorías con todas las del histórico, así al recortar un periodo
+	se siguen conociendo todas las clases del modelo
+	Parameters:
+		df_original (Dataframe): Tabla de predicciones diarias del proceso EDAR_Cartuja_Prediccion_JSON
+		model_objective (string): Variable objetivo del modelo
+
+	Returns:
+		Dataframe: Valores reales y predichos de cada día
+	"""
+	df = df_original[[model_objective, f'prediction({model_objective})']].set_index(df_original['timestamp'])
+	df = df.groupby(level=0).first()
+	return df.astype('category')
+
+def slice_prediction_bundle(prediction_bundle, start=None, end=None):
+	"""Recorta las predicciones diarias de un modelo a un periodo, el resto de tablas se comparten con el modelo original
+	Parameters:
+		prediction_bundle (dict): DataFrames del modelo (ver create_prediction_bundle)
+		start (string): Primer día del periodo (AAAA-MM-DD, None para no limitarlo)
+		end (string): Último día del periodo, incluido (AAAA-MM-DD, None para no limitarlo)
+
+	Returns:
+		dict: DataFrames del modelo con las predicciones diarias del periodo
+	"""
+	daily_pred = prediction_bundle['daily_pred']
+	first = daily_pred.index.searchsorted(pd.Timestamp(start)) if start is not None else 0
+	last = daily_pred.index.searchsorted(pd.Timestamp(end) + pd.Timedelta(days=1)) if end is not None else len(daily_pred)
+	return dict(prediction_bundle, daily_pred=daily_pred.iloc[first:last])
+
+def get_prediction_bundle(model_objective, model_discretise=MODEL_DISCRETISE, model_num_attributes=MODEL_NUM_ATTRIBUTES, reload=False, start=None, end=None):
+	"""Obtiene las tablas de un modelo de predicción a través de la caché compartida entre sesiones. Si se indica un periodo, se pide
+	a RapidMiner solo ese periodo, salvo que el histórico completo del modelo ya esté en la caché (por ejemplo por la precarga),
+	en cuyo caso se recorta sin llamar al servicio web
+	Parameters:
+		model_objective (string): Variable objetivo del modelo
+		model_discretise (int): Número de rangos en los que se discretiza el objetivo
+		model_num_attributes (int): Número de atributos del modelo
+		reload (bool): Si es True se vuelve a pedir el modelo aunque el cacheado esté actualizado
+		start (string): Primer día de las predicciones diarias (AAAA-MM-DD, None para no limitarlo)
+		end (string): Último día de las predicciones diarias (AAAA-MM-DD, None para no limitarlo)
+	
+	Returns:
+		dict: DataFrames del modelo (ver create_prediction_bundle). Son compartidos, no deben modificarse.
+	"""
+	parameters = {'Objetivo': model_objective, 'Discretizacion': model_discretise, 'Numero_Atributos': model_num_attributes}
+	key = (model_objective, model_discretise, model_num_attributes)
+	if start is not None or end is not None:
+		full_bundle = prediction_cache.peek(key) if not reload else None
+		if full_bundle is not None:
+			return slice_prediction_bundle(full_bundle, start, end)
+		parameters.update({name: value for name, value in zip(RAPIDMINER_DATE_PARAMETERS, (start, end)) if value is not None})
+		key = key + (start, end)
+
+	def load():
+		df_prediction = call_webservice_tables(f'{RAPIDMINER_URL}/EDAR_Cartuja_Prediccion_JSON?', 'rapidminer', 'rapidminer', parameters)
+		# Se recorta también aquí por si el proceso devuelve más días de los pedidos
+		return slice_prediction_bundle(create_prediction_bundle(df_prediction, model_objective), start, end)
+
+	if reload:
+		return prediction_cache.reload(key, load)
+	return prediction_cache.get(key, load)
+
+
+def load_prediction_snapshots():
+	"""Carga en la caché de modelos el último modelo guardado en las instantáneas locales para cada variable objetivo (histórico completo),
+	para servirlos en cuanto se pidan mientras se revalidan en segundo plano. Los periodos se recortan de estos modelos al pedirlos
 
+	Returns:
+		int: Número de modelos cargados
+	"""
+	if snapshot_store is None:
+		return 0
+	loaded = 0
+	for parameters, df_prediction in snapshot_store.load_all('EDAR_Cartuja_Prediccion_JSON'):
+		# Las instantáneas de un periodo son de versiones anteriores, ya no se guardan (ver save_snapshot)
+		if any(name in parameters for name in RAPIDMINER_DATE_PARAMETERS):
+			continue
+		try:
+			model_objective = parameters['Objetivo']
+			# Misma clave que en get_prediction_bundle
+			key = (model_objective, int(parameters['Discretizacion']), int(parameters['Numero_Atributos']))
+			prediction_cache.put(key, create_prediction_bundle(df_prediction, model_objective), revalidate_after=0)
+			loaded += 1
+		except Exception:
+			logger.exception(f'No se ha podido cargar la instantánea del modelo {parameters}')
+	return loaded
 
 def create_daily_pred_plot(df_original, target='Calidad_Agua'):
 	"""Crea gráfica de predicciones contra valores reales
@@ -499,22 +700,6 @@ def create_daily_pred_plot(df_original, target='Calidad_Agua'):
 	Returns:
 		Figure: Gráfica de predicciones contra valores reales
 	"""
-	df = df_original
-	df = df.rename(columns={target: 'real', f'prediction({target})': 'prediction'})
-	bins = list(df['real'].unique())
-	df['timestamp'] = pd.to_datetime(df['timestamp'], format='%m/%d/%y').sort_values()
-	df = df.set_index('timestamp')
-	df = df.groupby(df.index).first()
-	df = df['2018-01-01':'2019-01-31']
-
-	if target=='Calidad_Agua':
-		df.replace(regex=['cluster_'], value='', inplace=True)
-	else:
-		df.replace(regex=[r'\[.*\]', 'range'], value='', inplace=True)
-	
-	df[['real','prediction']] = df[['real','prediction']].astype(int)
-	df['error'] = abs(df['real']-df['prediction'])
-
 	TOOLTIPS = [
 		('Fecha', "@timestamp{%F}"),
 		('Real', '@real'),
@@ -522,33 +707,24 @@ def create_daily_pred_plot(df_original, target='Calidad_Agua'):
 	]
 	hover_tool = HoverTool(tooltips = TOOLTIPS, formatters={'timestamp': 'datetime'})
 
-	source = ColumnDataSource(df)
+	source = ColumnDataSource(data=dict(timestamp=[], real=[], prediction=[], error=[]))
 
 	daily_pred_plot = figure(plot_height=200, toolbar_location='right', sizing_mode='stretch_width', x_axis_type='datetime',
-							tools='pan, box_zoom, reset')
+							tools='pan, box_zoom, reset', x_range=Range1d(0, 1), y_range=Range1d(0, 1), name='daily_pred_plot')
 	daily_pred_plot.toolbar.logo = None
 	# Se añade un nuevo eje Y para el error
-	# daily_pred_plot.extra_y_ranges = {'y_error': Range1d(start=0, end=df['real'].max()-df['real'].min())}
-	daily_pred_plot.extra_y_ranges = {'y_error': Range1d(start=0, end=len(bins))}
-	daily_pred_plot.add_layout(LinearAxis(y_range_name='y_error', axis_label='Error', ticker=list(range(len(bins)))), 'right')
+	daily_pred_plot.extra_y_ranges = {'y_error': Range1d(start=0, end=1)}
+	daily_pred_plot.add_layout(LinearAxis(y_range_name='y_error', axis_label='Error', name='error_axis'), 'right')
 
-	daily_pred_plot.line(x='timestamp', y='real', source=source, line_width=2, line_color='#392FCC', line_alpha=0.8, legend_label='Real')
-	daily_pred_plot.line(x='timestamp', y='prediction', source=source, line_width=2, line_color='#CA574D', line_alpha=0.8, line_dash='dashed', legend_label='Predicción')
-	daily_pred_plot.line(x='timestamp', y='error', source=source, line_width=2, line_color='green', line_alpha=0.4, legend_label='Error', y_range_name='y_error')
+	daily_pred_plot.line(x='timestamp', y='real', source=source, line_width=2, line_color='#392FCC', line_alpha=0.8, legend_label='Real', name='real')
+	daily_pred_plot.line(x='timestamp', y='prediction', source=source, line_width=2, line_color='#CA574D', line_alpha=0.8, line_dash='dashed', legend_label='Predicción', name='prediction')
+	daily_pred_plot.line(x='timestamp', y='error', source=source, line_width=2, line_color='green', line_alpha=0.4, legend_label='Error', y_range_name='y_error', name='error')
 
 
 	daily_pred_plot.xaxis.major_label_orientation = np.pi/4
 	daily_pred_plot.xaxis.formatter = DatetimeTickFormatter(months=['%b %Y'])
 	daily_pred_plot.xaxis.ticker = MonthsTicker(months=list(range(1,13)))
 	
-	if target == 'Calidad_Agua':
-		daily_pred_plot.yaxis[0].ticker =  list(range(len(bins)))
-		daily_pred_plot.yaxis[0].formatter = PrintfTickFormatter(format="Cluster %u")
-	else:
-		daily_pred_plot.yaxis[0].ticker =  list(range(1,1+len(bins)))
-		daily_pred_plot.y_range=Range1d(0, len(bins)+1) # Manipulates y_range
-		daily_pred_plot.yaxis[0].formatter = PrintfTickFormatter(format="Range %u")
-	
 	daily_pred_plot.ygrid.minor_grid_line_color = None
 	daily_pred_plot.xaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
 	daily_pred_plot.yaxis.major_label_text_color = bokeh_utils.LABEL_FONT_COLOR
@@ -558,7 +734,6 @@ def create_daily_pred_plot(df_original, target='Calidad_Agua'):
 	daily_pred_plot.legend.click_policy = 'hide'
 	daily_pred_plot.legend.label_text_color = bokeh_utils.LABEL_FONT_COLOR
 
-	daily_pred_plot.title.text = f'Predicciones diarias - {target}'
 	daily_pred_plot.title.text_color = bokeh_utils.TITLE_FONT_COLOR
 	daily_pred_plot.title.align = 'left'
 	daily_pred_plot.title.text_font_size = '16px'
@@ -566,8 +741,153 @@ def create_daily_pred_plot(df_original, target='Calidad_Agua'):
 	daily_pred_plot.add_tools(hover_tool)
 	daily_pred_plot.min_border_right = 15
 
+	# Al desplazar o ampliar la gráfica se vuelven a pedir los puntos del nuevo periodo visible. Los cambios de start y end de un mismo
+	# movimiento se agrupan en un único refresco
+	def range_callback(attr, old, new):
+		series = daily_pred_series.get(daily_pred_plot)
+		if series is not None and not series['pending'] and daily_pred_plot.document is not None:
+			series['pending'] = True
+			daily_pred_plot.document.add_next_tick_callback(partial(refresh_daily_pred_plot, daily_pred_plot))
+	daily_pred_plot.x_range.on_change('start', range_callback)
+	daily_pred_plot.x_range.on_change('end', range_callback)
+
+	update_daily_pred_plot(daily_pred_plot, df_original, target)
 	return daily_pred_plot
 
+def get_daily_pred_window(df, start, end, max_points=DAILY_PRED_MAX_POINTS):
+	"""Obtiene los puntos de la gráfica de predicciones diarias para un periodo. Se incluye medio periodo más a cada lado para que al
+	desplazar la gráfica no aparezcan huecos mientras llegan los nuevos puntos, y si hay más de 2*max_points se reducen con LTTB
+	Parameters:
+		df (Dataframe): Serie completa con índice timestamp y columnas real, prediction y error
+		start (float): Inicio del periodo visible (milisegundos desde 1970)
+		end (float): Fin del periodo visible (milisegundos desde 1970)
+		max_points (int): Puntos que se envían como máximo en el periodo visible
+
+	Returns:
+		dict: Datos para el ColumnDataSource de la gráfica
+	"""
+	x = df.index.values.astype(np.int64) / 10**6
+	margin = (end-start)/2
+	first, last = np.searchsorted(x, [start-margin, end+margin])
+	# Se incluye un punto más a cada lado para que las líneas lleguen hasta el borde de la gráfica
+	first, last = max(first-1, 0), min(last+1, len(x))
+	columns = [df[column].values[first:last] for column in ('real', 'prediction', 'error')]
+	selected = downsample(x[first:last], columns, 2*max_points)
+	return bokeh_utils.binary_columns(dict(timestamp=df.index.values[first:last][selected], real=columns[0][selected], prediction=columns[1][selected], error=columns[2][selected]))
+
+def refresh_daily_pred_plot(daily_pred_plot):
+	"""Sustituye los puntos de la gráfica de predicciones diarias por los del periodo visible
+	Parameters:
+		daily_pred_plot (Figure): Gráfica creada con create_daily_pred_plot
+	"""
+	series = daily_pred_series[daily_pred_plot]
+	series['pending'] = False
+	x_range = daily_pred_plot.x_range
+	daily_pred_plot.select_one({'name': 'real'}).data_source.data = get_daily_pred_window(series['df'], x_range.start, x_range.end)
+
+@metrics.timed
+def update_daily_pred_plot(daily_pred_plot, df_original, target='Calidad_Agua'):
+	"""Sustituye los datos de la gráfica de predicciones contra valores reales por los de otro modelo, junto con los rangos
+	y los ejes Y que dependen del número de clases del modelo
+	Parameters:
+		daily_pred_plot (Figure): Gráfica creada con create_daily_pred_plot
+		df_original (Dataframe): Dataframe con los datos a mostrar en la visualización
+		target (string): Variable objetivo del modelo
+	"""
+	df = df_original.rename(columns={target: 'real', f'prediction({target})': 'prediction'})
+	bins = list(df['real'].cat.categories)
+
+	# Número de cada clase (cluster_2 -> 2, range3 [...] -> 3), se calcula sobre las categorías y no sobre cada día
+	pattern = 'cluster_' if target=='Calidad_Agua' else r'\[.*\]|range'
+	df = pd.DataFrame({column: df[column].cat.rename_categories(df[column].cat.categories.str.replace(pattern, '').astype(int)).astype(int)
+		for column in ('real', 'prediction')}, index=df.index)
+	df.index.name = 'timestamp'
+	df['error'] = abs(df['real']-df['prediction'])
+
+	# Se muestran todos los días recibidos, el periodo ya se ha recortado al pedir el modelo (ver slice_prediction_bundle)
+	start, end = [pd.Timestamp(date).value / 10**6 for date in DAILY_PRED_WINDOW]
+	if len(df):
+		start, end = df.index[0].value / 10**6, df.index[-1].value / 10**6
+	# Con un solo día se muestra un día completo para que el rango no tenga ancho cero
+	end = max(end, start + 24*60*60*1000)
+	# Mientras se cambia el periodo no se programa el refresco de range_callback, se refresca una sola vez al final
+	daily_pred_series[daily_pred_plot] = dict(df=df, pending=True)
+	x_range = daily_pred_plot.x_range
+	x_range.start, x_range.end, x_range.reset_start, x_range.reset_end = start, end, start, end
+	refresh_daily_pred_plot(daily_pred_plot)
+
+	# Se usa siempre Range1d para poder cambiar sus límites al cambiar de modelo
+	if target == 'Calidad_Agua':
+		# Mismo margen que aplicaría DataRange1d (5% a cada lado de los datos)
+		low = min(df['real'].min(), df['prediction'].min()) if len(df) else 0
+		high = max(df['real'].max(), df['prediction'].max()) if len(df) else len(bins)
+		padding = (high-low)*0.05 if high > low else 0.5
+		daily_pred_plot.y_range.start, daily_pred_plot.y_range.end = low-padding, high+padding
+		daily_pred_plot.yaxis[0].ticker = list(range(len(bins)))
+		daily_pred_plot.yaxis[0].formatter = PrintfTickFormatter(format="Cluster %u")
+	else:
+		daily_pred_plot.y_range.start, daily_pred_plot.y_range.end = 0, len(bins)+1
+		daily_pred_plot.yaxis[0].ticker = list(range(1,1+len(bins)))
+		daily_pred_plot.yaxis[0].formatter = PrintfTickFormatter(format="Range %u")
+	daily_pred_plot.extra_y_ranges['y_error'].end = len(bins)
+	daily_pred_plot.select_one({'name': 'error_axis'}).ticker = list(range(len(bins)))
+
+	daily_pred_plot.title.text = f'Predicciones diarias - {target}'
+
+def create_model_layout(model_objective, prediction_bundle, corrects_bars=None):
+	"""Crea los gráficos de un modelo de predicción
+	Parameters:
+		model_objective (string): Variable objetivo del modelo
+		prediction_bundle (dict): DataFrames del modelo (ver create_prediction_bundle)
+		corrects_bars (int): Número de barras de la gráfica de aciertos (None para las del modelo), ver create_corrects_plot
+	
+	Returns:
+		Column: Layout con los gráficos del modelo, con el nombre de la variable objetivo
+	"""
+	# Obtener datos
+	decision_tree_df = prediction_bundle['decision_tree']
+	confusion_df = prediction_bundle['confusion']
+	weight_df = prediction_bundle['weight']
+	daily_pred_df = prediction_bundle['daily_pred']
+	decision_tree_data = create_decision_tree_data(decision_tree_df, model_objective)
+	
+	# Crear nuevos gráficos
+	daily_pred_plot = create_daily_pred_plot(daily_pred_df, model_objective)
+	decision_tree_plot = create_decision_tree_plot(decision_tree_data)
+	confusion_matrix = create_confusion_matrix(confusion_df)
+	weight_plot = create_attribute_weight_plot(weight_df, model_objective)
+	corrects_plot = create_corrects_plot(confusion_df, model_objective, num_bars=corrects_bars)
+	confusion_title = create_div_title(f'Matriz de confusión - {model_objective}')
+	confusion_title.name = 'confusion_title'
+	decision_tree_title = create_div_title(f'Arbol de decisión - {model_objective}')
+	decision_tree_title.name = 'decision_tree_title'
+	new_plots = layout([
+		[daily_pred_plot],
+		[column([confusion_title, confusion_matrix], sizing_mode='stretch_width'), weight_plot, corrects_plot],
+		[decision_tree_title],
+		[decision_tree_plot]
+	], name=model_objective, sizing_mode='stretch_width')
+	return new_plots
+
+def update_model_layout(model_layout, model_objective, prediction_bundle):
+	"""Muestra otro modelo de predicción en un layout creado con create_model_layout. Solo se sustituyen los datos, rangos y
+	títulos de los gráficos, el navegador recibe esos cambios en lugar de un layout nuevo
+	Parameters:
+		model_layout (Column): Layout creado con create_model_layout
+		model_objective (string): Variable objetivo del modelo
+		prediction_bundle (dict): DataFrames del modelo (ver create_prediction_bundle)
+	"""
+	decision_tree_data = create_decision_tree_data(prediction_bundle['decision_tree'], model_objective)
+
+	update_daily_pred_plot(model_layout.select_one({'name': 'daily_pred_plot'}), prediction_bundle['daily_pred'], model_objective)
+	update_decision_tree_plot(model_layout.select_one({'name': 'decision_tree_plot'}), decision_tree_data)
+	update_confusion_matrix(model_layout.select_one({'name': 'confusion_matrix'}), prediction_bundle['confusion'])
+	update_attribute_weight_plot(model_layout.select_one({'name': 'weight_plot'}), prediction_bundle['weight'], model_objective)
+	update_corrects_plot(model_layout.select_one({'name': 'corrects_plot'}), prediction_bundle['confusion'], model_objective)
+	model_layout.select_one({'name': 'confusion_title'}).text = f'Matriz de confusión - {model_objective}'
+	model_layout.select_one({'name': 'decision_tree_title'}).text = f'Arbol de decisión - {model_objective}'
+	model_layout.name = model_objective
+
 def create_div_title(title = ''):
 	"""Crea el título para un objeto de la interfaz bokeh
 	Parameters:
@@ -591,107 +911,265 @@ def create_div_title(title = ''):
 	return div_title
 
 def modify_second_descriptive(doc):
+	metrics.track_session(doc, 'prediccion')
+	# Datos de cada modelo obtenido y layout de los modelos que se han mostrado alguna vez (se crea al marcarlo por primera vez)
 	models = OrderedDict([])
-	
-	# Llamada al webservice de RapidMiner
-	json_perfil_document = call_webservice('http://rapidminer.vicomtech.org/api/rest/process/EDAR_Cartuja_Perfil_Out_JSON?', 'rapidminer', 'rapidminer', out_json=True)
-	
-	# Extracción de los datos web
-	df_perfil = [json_normalize(data) for data in json_perfil_document]
-	
-	# Asignación de los datos web a su variable correspondiente
-	prediction_df = df_perfil[3]
-	outlier_df = df_perfil[4]
+	model_layouts = {}
+	# Modelos ordenados del usado hace más tiempo al último usado, para cerrar los más antiguos al superar MAX_SESSION_MODELS
+	recently_used = OrderedDict([])
+	# Modelos que se están obteniendo de RapidMiner, para no pedir dos veces el mismo
+	loading_models = set()
+	destroyed = False
+	# Fecha de la última fila mostrada de cada tabla en directo y consulta de filas nuevas en curso
+	last_times = {}
+	polling = False
+	# Layout compartido por todos los modelos en modo SINGLE_MODEL_VIEW
+	model_view = None
+	# Periodo (inicio, fin) de las predicciones diarias que se pide a RapidMiner
+	date_window = DAILY_PRED_WINDOW
 
 	# Creación de los gráficos y widgets permanentes en la interfaz
-	prediction_plot = create_prediction_plot(prediction_df)
-	outlier_plot = create_outlier_plot(outlier_df)
 	simulation_title = create_div_title('Simulación')
 	model_title, add_model_button, model_select_menu = create_model_menu()
 	model_select_wb = widgetbox([model_title, model_select_menu , add_model_button], max_width=200, sizing_mode='stretch_width')
 	created_models_title = create_div_title('Modelos creados')
-	created_models_checkbox = CheckboxButtonGroup(labels=list(models.keys()), height=35)
-	created_models_checkbox.active = [0]
+	# En modo SINGLE_MODEL_VIEW solo se puede seleccionar un modelo
+	if SINGLE_MODEL_VIEW:
+		created_models_checkbox = RadioButtonGroup(labels=list(models.keys()), height=35, active=None)
+	else:
+		created_models_checkbox = CheckboxButtonGroup(labels=list(models.keys()), height=35)
+		created_models_checkbox.active = [0]
 	delete_model_button = Button(label='Eliminar', button_type='danger', height=45, max_width=200)
+	# El periodo se aplica al soltar el control (value_throttled), no en cada paso mientras se arrastra
+	date_range_slider = DateRangeSlider(title='Periodo de las predicciones diarias', start=pd.Timestamp(DAILY_PRED_HISTORY_START).date(), end=dt.today().date(),
+		value=tuple(pd.Timestamp(date).date() for date in DAILY_PRED_WINDOW), step=1, format='%d %b %Y', callback_policy='mouseup', sizing_mode='stretch_width')
 	created_models_wb = widgetbox([created_models_title, created_models_checkbox], max_width=900, sizing_mode='stretch_width')
+	# Aviso de error al obtener un modelo, oculto hasta que falle alguna llamada
+	model_error_title = create_div_title()
+	model_error_title.visible = False
+
+	# Las llamadas al webservice se hacen en callbacks sin bloqueo del documento para no parar el IOLoop del resto de sesiones,
+	# los gráficos se crean después en un callback con bloqueo añadido con add_next_tick_callback
+	@without_document_lock
+	async def load_perfil_data():
+		# Llamada al webservice de RapidMiner (compartida entre sesiones a través de la caché)
+		try:
+			df_perfil = await get_webservice_dataframes_async(f'{RAPIDMINER_URL}/EDAR_Cartuja_Perfil_Out_JSON?', 'rapidminer', 'rapidminer')
+		except Exception:
+			logger.exception('Error obteniendo los datos del perfil')
+			if not destroyed:
+				doc.add_next_tick_callback(show_load_error)
+			return
+		if not destroyed:
+			doc.add_next_tick_callback(partial(show_perfil_plots, df_perfil))
+
+	def show_load_error():
+		perfil_plots.children = [create_div_title('No se han podido obtener los datos de RapidMiner, inténtalo de nuevo más tarde')]
+
+	def show_perfil_plots(df_perfil):
+		# Si RapidMiner no responde los datos son los de la última instantánea local
+		bokeh_utils.show_snapshot_banner(snapshot_banner, get_snapshot_time(df_perfil))
+		# Asignación de los datos web a su variable correspondiente
+		prediction_df = df_perfil[3]
+		outlier_df = df_perfil[4]
+
+		prediction_plot = create_prediction_plot(prediction_df)
+		outlier_plot = create_outlier_plot(outlier_df)
+		perfil_plots.children = [prediction_plot, outlier_plot]
+		bokeh_utils.report_payload(doc, 'prediccion', 'inicial')
+
+		# Modo en directo: se consultan periódicamente las filas posteriores a la última mostrada
+		if STREAMING_INTERVAL is not None:
+			last_times['prediction'] = prediction_df['añomes'].max()
+			last_times['outlier'] = outlier_df['timestamp'].max()
+			doc.add_periodic_callback(partial(poll_live_data, prediction_plot, outlier_plot), STREAMING_INTERVAL)
+
+	@without_document_lock
+	async def poll_live_data(prediction_plot, outlier_plot):
+		nonlocal polling
+		# Se omite la consulta si la anterior no ha terminado
+		if polling or destroyed:
+			return
+		polling = True
+		try:
+			new_prediction = await run_webservice_task(get_new_rows, 3, 'añomes', last_times['prediction'])
+			new_outlier = await run_webservice_task(get_new_rows, 4, 'timestamp', last_times['outlier'])
+		finally:
+			polling = False
+		if not new_prediction.empty:
+			last_times['prediction'] = new_prediction['añomes'].max()
+		if not new_outlier.empty:
+			last_times['outlier'] = new_outlier['timestamp'].max()
+		if not destroyed and (not new_prediction.empty or not new_outlier.empty):
+			doc.add_next_tick_callback(partial(stream_perfil_plots, prediction_plot, outlier_plot, new_prediction, new_outlier))
+
+	def stream_perfil_plots(prediction_plot, outlier_plot, new_prediction, new_outlier):
+		# Solo se envían al navegador las filas nuevas, las más antiguas se descartan al superar STREAMING_ROLLOVER
+		stream_prediction_plot(prediction_plot, new_prediction, STREAMING_ROLLOVER)
+		stream_outlier_plot(outlier_plot, new_outlier, STREAMING_ROLLOVER)
+
+	async def load_model_data(model_objective):
+		# Llamar al servicio web EDAR_Cartuja_Prediccion con los nuevos parámetros (o reutilizar el modelo de otra sesión)
+		window = date_window
+		try:
+			prediction_bundle = await run_webservice_task(partial(get_prediction_bundle, model_objective, start=window[0], end=window[1]))
+		except Exception:
+			logger.exception(f'Error obteniendo el modelo {model_objective}')
+			loading_models.discard(model_objective)
+			if not destroyed:
+				doc.add_next_tick_callback(partial(show_model_error, model_objective))
+			return
+		if not destroyed:
+			doc.add_next_tick_callback(partial(add_model, model_objective, prediction_bundle, window))
+
+	def show_model_error(model_objective):
+		model_error_title.text = f'No se ha podido obtener el modelo {model_objective} de RapidMiner, inténtalo de nuevo más tarde'
+		model_error_title.visible = True
+
+	def request_model(model_objective):
+		if model_objective not in loading_models:
+			loading_models.add(model_objective)
+			doc.add_next_tick_callback(without_document_lock(partial(load_model_data, model_objective)))
 
 	# Callbacks para los widgets de la interfaz
 	def prediction_callback():
-		# Llamar al servicio web EDAR_Cartuja_Prediccion con los nuevos parámetros
 		model_objective = model_select_menu.value
-		model_discretise = 5
 		
 		# Verificar que el modelo no ha sido creado antes
-		if model_objective not in models:		
-			json_prediction_document = call_webservice('http://rapidminer.vicomtech.org/api/rest/process/EDAR_Cartuja_Prediccion_JSON?',
-														'rapidminer', 'rapidminer', {'Objetivo': model_objective, 'Discretizacion': model_discretise, 'Numero_Atributos': 4},
-														out_json=True)	
-			
-			# Obtener datos
-			df_prediction = [json_normalize(data) for data in json_prediction_document]
-
-			decision_tree_df = df_prediction[0]
-			confusion_df_raw = df_prediction[1].reindex(columns=list(json_prediction_document[1][0].keys()))
-			confusion_df = create_df_confusion(confusion_df_raw)
-			weight_df = df_prediction[2]
-			daily_pred_df = df_prediction[3][['timestamp', model_objective, f'prediction({model_objective})']]
-			decision_tree_data = create_decision_tree_data(decision_tree_df, model_objective)
-			
-			# Crear nuevos gráficos
-			daily_pred_plot = create_daily_pred_plot(daily_pred_df, model_objective)
-			decision_tree_plot = create_decision_tree_plot()
-			decision_tree_graph = create_decision_tree_graph_renderer(decision_tree_plot, decision_tree_data)
-			decision_tree_plot = append_labels_to_decision_tree(decision_tree_plot, decision_tree_graph, decision_tree_data)
-			confusion_matrix = create_confusion_matrix(confusion_df)
-			weight_plot = create_attribute_weight_plot(weight_df, model_objective)
-			corrects_plot = create_corrects_plot(confusion_df, model_objective)
-			confusion_title = create_div_title(f'Matriz de confusión - {model_objective}')
-			decision_tree_title = create_div_title(f'Arbol de decisión - {model_objective}')
-			new_plots = layout([
-				[daily_pred_plot],
-				[column([confusion_title, confusion_matrix], sizing_mode='stretch_width'), weight_plot, corrects_plot],
-				[decision_tree_title],
-				[decision_tree_plot]
-			], name=model_objective, sizing_mode='stretch_width')
-			model_plots.children.append(new_plots)
-			models.update({model_objective: new_plots})
-			models.move_to_end(model_objective, last=False)
-			created_models_checkbox.labels = list(models.keys())
-			created_models_checkbox.active = list(range(len(models.keys())))
+		if model_objective not in models:
+			request_model(model_objective)
 	add_model_button.on_click(prediction_callback)
 
+	def date_range_handler(attr, old, new):
+		nonlocal date_window
+		date_window = tuple(date.strftime('%Y-%m-%d') for date in date_range_slider.value_as_date)
+		# Los modelos abiertos se vuelven a pedir con el nuevo periodo, sus gráficos se actualizan al llegar los datos
+		for model_objective in models:
+			request_model(model_objective)
+	date_range_slider.on_change('value_throttled', date_range_handler)
+
+	def add_model(model_objective, prediction_bundle, window):
+		loading_models.discard(model_objective)
+		model_error_title.visible = False
+		bokeh_utils.show_snapshot_banner(snapshot_banner, prediction_bundle['snapshot_time'])
+		# Si el periodo ha cambiado mientras se obtenía el modelo se vuelve a pedir
+		if window != date_window:
+			request_model(model_objective)
+
+		# Modelo ya abierto con los datos de otro periodo: se actualizan sus gráficos si ya se han creado
+		if model_objective in models:
+			models[model_objective] = prediction_bundle
+			if SINGLE_MODEL_VIEW and model_view is not None and model_view.name == model_objective:
+				update_model_layout(model_view, model_objective, prediction_bundle)
+			elif model_objective in model_layouts:
+				update_model_layout(model_layouts[model_objective], model_objective, prediction_bundle)
+			return
+
+		# Solo se guardan los datos, los gráficos se crean al mostrar el modelo
+		shown_labels = get_shown_labels()
+		models.update({model_objective: prediction_bundle})
+		models.move_to_end(model_objective, last=False)
+		recently_used[model_objective] = True
+		# Cerrar los modelos usados hace más tiempo para limitar la memoria de la sesión
+		while len(models) > max(MAX_SESSION_MODELS, 1):
+			remove_model(next(iter(recently_used)))
+		# Mostrar el nuevo modelo junto con los que ya estaban visibles (solo el nuevo en modo SINGLE_MODEL_VIEW)
+		created_models_checkbox.labels = list(models.keys())
+		set_shown_labels([model_objective] if SINGLE_MODEL_VIEW else [model_objective] + shown_labels)
+
+	def get_shown_labels():
+		labels = created_models_checkbox.labels
+		if SINGLE_MODEL_VIEW:
+			active = created_models_checkbox.active
+			return [labels[active]] if active is not None and active < len(labels) else []
+		return [labels[element] for element in created_models_checkbox.active if element < len(labels)]
+
+	def set_shown_labels(shown_labels):
+		labels = created_models_checkbox.labels
+		active = [i for i, label in enumerate(labels) if label in shown_labels]
+		if SINGLE_MODEL_VIEW:
+			active = active[0] if active else None
+		# Si active no cambia no se lanza show_hide_plots, pero las etiquetas sí pueden haber cambiado
+		if created_models_checkbox.active == active:
+			show_hide_plots()
+		else:
+			created_models_checkbox.active = active
+
+	def get_model_layout(model_objective):
+		nonlocal model_view
+		if SINGLE_MODEL_VIEW:
+			# Los gráficos se crean una vez con barras suficientes para cualquier modelo, después solo cambian sus datos
+			if model_view is None:
+				model_view = create_model_layout(model_objective, models[model_objective], corrects_bars=len(bokeh_utils.BAR_COLORS_PALETTE))
+			elif model_view.name != model_objective:
+				update_model_layout(model_view, model_objective, models[model_objective])
+			return model_view
+		if model_objective not in model_layouts:
+			model_layouts[model_objective] = create_model_layout(model_objective, models[model_objective])
+		return model_layouts[model_objective]
+
+	def remove_model(model_objective):
+		models.pop(model_objective)
+		recently_used.pop(model_objective, None)
+		model_layout = model_layouts.pop(model_objective, None)
+		if model_layout is not None and model_layout in model_plots.children:
+			model_plots.children.remove(model_layout)
+		# Si se vuelve a añadir el modelo se tienen que cargar sus datos otra vez en los gráficos compartidos
+		if model_view is not None and model_view.name == model_objective:
+			model_view.name = None
+
 	def remove_options_handler(new):
-		selected_labels = [created_models_checkbox.labels[elements] for elements in created_models_checkbox.active]
+		selected_labels = get_shown_labels()
 		try:
 			for element in selected_labels:
-				models.pop(element)
-				model_plots.children.remove(doc.get_model_by_name(element))
+				remove_model(element)
 		except:
 			for element in selected_labels:
 				print(f"El modelo {element} no existe")
 		created_models_checkbox.labels = list(models.keys())
-		created_models_checkbox.active = list(range(len(models.keys())))
+		set_shown_labels(list(models.keys())[:1] if SINGLE_MODEL_VIEW else list(models.keys()))
 	delete_model_button.on_click(remove_options_handler)
 
-	def show_hide_plots(new):
-		selected_labels = [created_models_checkbox.labels[elements] for elements in new]
+	def show_hide_plots():
+		selected_labels = get_shown_labels()
 		# model_plots.children = []
 		children = []
 		for element in selected_labels:
-			children.append(models[element])
+			# Los modelos que se vuelven a mostrar pasan a ser los últimos usados
+			shown_layout = model_view if SINGLE_MODEL_VIEW and model_view is not None and model_view.name == element else model_layouts.get(element)
+			if shown_layout not in model_plots.children:
+				recently_used.move_to_end(element)
+			children.append(get_model_layout(element))
 		model_plots.children = children
-	created_models_checkbox.on_click(show_hide_plots)
+	created_models_checkbox.on_change('active', lambda attr, old, new: show_hide_plots())
+
+	def session_destroyed(session_context):
+		# Liberar los modelos de la sesión al cerrarla. El documento no se puede modificar aquí (no se tiene su bloqueo),
+		# las llamadas a RapidMiner en curso ven destroyed y no añaden nuevos callbacks
+		nonlocal destroyed, model_view
+		destroyed = True
+		model_view = None
+		loading_models.clear()
+		recently_used.clear()
+		model_layouts.clear()
+		models.clear()
+	doc.on_session_destroyed(session_destroyed)
 
 	# Creación del layout dinámico de la interfaz
+	snapshot_banner = bokeh_utils.create_snapshot_banner()
+	perfil_plots = column([create_div_title('Cargando datos...')], sizing_mode='stretch_width')
 	model_plots = column([])
+	doc.add_next_tick_callback(load_perfil_data)
 	prediction_callback()
 
 	# Creación del layout estático de la interfaz
 	l = layout([
-		[prediction_plot],
-		[outlier_plot],
+		[snapshot_banner],
+		[perfil_plots],
 		[simulation_title],
 		[model_select_wb, column(created_models_wb, delete_model_button, sizing_mode='stretch_width')],		
+		[date_range_slider],
+		[model_error_title],
 		[model_plots]
 	], sizing_mode='stretch_both')
 
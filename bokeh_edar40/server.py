@@ -1,14 +1,148 @@
 from bokeh.server.server import Server
 from tornado.ioloop import IOLoop
+from tornado.process import task_id
+from tornado.web import Application, RequestHandler
 
-from utils.server_config import SERVER_IP
+from utils.server_config import SERVER_IP, RAPIDMINER_URL, WARMUP_WORKERS, WARMUP_INTERVAL, WARMUP_ALL_PROCS, BOKEH_PORT, BOKEH_NUM_PROCS, BOKEH_METRICS_PORT
+from utils.rapidminer_proxy import get_webservice_dataframes, load_webservice_snapshots
+import utils.metrics as metrics
 from bokeh_edar40.applications.cartuja.first_descriptive import modify_first_descriptive
-from bokeh_edar40.applications.cartuja.second_descriptive import modify_second_descriptive
+from bokeh_edar40.applications.cartuja.second_descriptive import modify_second_descriptive, read_model_variables, get_prediction_bundle, load_prediction_snapshots
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event, Thread
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Se activa cuando termina la primera precarga de datos y modelos
+warm_up_ready = Event()
+warm_up_ready_gauge = metrics.registry.register(metrics.Gauge('edar_warmup_ready', 'Vale 1 cuando el proceso ha terminado la primera precarga de datos y modelos (0 en los procesos que no precargan, ver WARMUP_ALL_PROCS)'))
+metrics.registry.add_collector(lambda: warm_up_ready_gauge.set(int(warm_up_ready.is_set())))
+
+def warm_up_caches(reload=False):
+	"""Obtiene el perfil y los modelos de todas las variables objetivo para dejarlos en las cachés compartidas, así el primer usuario
+	no espera a RapidMiner. Las llamadas se reparten en un pool de WARMUP_WORKERS hilos.
+
+	Parameters:
+		reload (bool): Si es True se vuelven a pedir aunque ya estén en la caché
+	"""
+	targets = read_model_variables()
+	tasks = {'perfil': lambda: get_webservice_dataframes(f'{RAPIDMINER_URL}/EDAR_Cartuja_Perfil_Out_JSON?', 'rapidminer', 'rapidminer', reload=reload)}
+	for target in targets:
+		tasks[f'modelo {target}'] = lambda target=target: get_prediction_bundle(target, reload=reload)
+
+	start = time.time()
+	errors = 0
+	with ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix='warmup') as executor:
+		futures = {executor.submit(task): name for name, task in tasks.items()}
+		for i, future in enumerate(as_completed(futures), 1):
+			name = futures[future]
+			try:
+				future.result()
+				logger.info(f'Precarga {i}/{len(futures)}: {name} ({time.time()-start:.1f}s)')
+			except Exception:
+				errors += 1
+				logger.exception(f'Precarga {i}/{len(futures)}: error obteniendo {name}')
+	logger.info(f'Precarga terminada en {time.time()-start:.1f}s con {errors} errores')
+
+def load_snapshots():
+	"""Carga en las cachés las últimas instantáneas locales del perfil y de los modelos (ver SNAPSHOT_DIR). Se sirven desde el primer
+	momento y se revalidan con RapidMiner en segundo plano en cuanto se piden, así el servidor arranca con datos aunque RapidMiner no responda
+	"""
+	start = time.time()
+	try:
+		num_perfil = load_webservice_snapshots(f'{RAPIDMINER_URL}/EDAR_Cartuja_Perfil_Out_JSON?')
+		num_models = load_prediction_snapshots()
+	except Exception:
+		logger.exception('Error cargando las instantáneas locales')
+		return
+	if num_perfil or num_models:
+		logger.info(f'Instantáneas cargadas en {time.time()-start:.2f}s: {num_perfil} del perfil y {num_models} modelos')
+
+def warm_up_worker():
+	"""Carga las instantáneas locales y precarga las cachés al arrancar y, si WARMUP_INTERVAL no es None, las refresca periódicamente para
+	que los modelos no caduquen
+	"""
+	load_snapshots()
+	while True:
+		try:
+			warm_up_caches(reload=warm_up_ready.is_set())
+		except Exception:
+			logger.exception('Error en la precarga de datos')
+		warm_up_ready.set()
+		if WARMUP_INTERVAL is None:
+			break
+		time.sleep(WARMUP_INTERVAL)
+
+class MetricsHandler(RequestHandler):
+	"""Publica las métricas del proceso del servidor de Bokeh en formato Prometheus. Con varios procesos cada proceso las publica en
+	su propio puerto (ver start_metrics_server), así cada scrape de Prometheus obtiene siempre las del mismo proceso
+	"""
+
+	def get(self):
+		self.set_header('Content-Type', 'text/plain; version=0.0.4')
+		self.write(metrics.registry.render())
 
 #Usamos localhost porque estamos probando la aplicación localmente, una vez ejecutando la aplicación sobre el servidor cambiamos la IP a la adecuada.
-def bk_worker():
+def create_server(num_procs=1, io_loop=None):
+	"""Crea el servidor de Bokeh con las aplicaciones de la EDAR. Si num_procs es distinto de 1, el proceso se divide en num_procs procesos
+	que comparten el puerto al crear el servidor, por lo que no se puede indicar io_loop ni haber hilos arrancados antes de llamar a esta función
+
+	Con un solo proceso las métricas se publican en /metrics del mismo puerto. Con varios procesos el puerto compartido no permite
+	elegir el proceso que responde, cada proceso las publica en su puerto con start_metrics_server
+
+	Parameters:
+		num_procs (int): Número de procesos del servidor (0 para uno por núcleo)
+		io_loop (IOLoop): Bucle de eventos del servidor (None para usar el del proceso)
+
+	Returns:
+		Server: Servidor de Bokeh
+	"""
 	# server = Server({'/cartuja/perfil': modify_first_descriptive, '/cartuja/prediccion': modify_second_descriptive}, io_loop=IOLoop(), allow_websocket_origin=['127.0.0.1:9995','127.0.0.1:9090','localhost:9995','10.0.20.30:9995', '192.168.10.130:9995', '192.168.10.130:9090', '10.0.20.30:9090', '3.10.15.221:9090', '3.10.15.221:9995','edar.vicomtech.org'], port=9090)
-	server = Server({'/perfil': modify_first_descriptive, '/prediccion': modify_second_descriptive}, io_loop=IOLoop(), allow_websocket_origin=[f'{SERVER_IP}:9995', f'{SERVER_IP}:9090', 'bokeh.edar.vicomtech.org', 'edar.vicomtech.org'], port=9090)
 	# server = Server({'/perfil': modify_first_descriptive, '/prediccion': modify_second_descriptive}, io_loop=IOLoop(), allow_websocket_origin=['*'], port=9090)
+	return Server({'/perfil': modify_first_descriptive, '/prediccion': modify_second_descriptive}, io_loop=io_loop, num_procs=num_procs,
+		allow_websocket_origin=[f'{SERVER_IP}:9995', f'{SERVER_IP}:{BOKEH_PORT}', 'bokeh.edar.vicomtech.org', 'edar.vicomtech.org'], port=BOKEH_PORT,
+		extra_patterns=[('/metrics', MetricsHandler)] if num_procs == 1 else [])
+
+def start_metrics_server(process):
+	"""Publica las métricas de un proceso del servidor de Bokeh en /metrics del puerto BOKEH_METRICS_PORT + process. Se llama en cada
+	proceso después de dividirlo
+
+	Parameters:
+		process (int): Número del proceso (tornado.process.task_id)
+	"""
+	port = BOKEH_METRICS_PORT + process
+	Application([('/metrics', MetricsHandler)]).listen(port)
+	logger.info(f'Métricas del proceso {process} en el puerto {port}')
+
+def bk_worker():
+	"""Arranca el servidor de Bokeh en un único proceso dentro de un hilo de Flask (ver BOKEH_EMBEDDED)
+	"""
+	Thread(target=warm_up_worker, daemon=True).start()
+	server = create_server(io_loop=IOLoop())
 	server.start()
-	server.io_loop.start()
\ No newline at end of file
+	server.io_loop.start()
+
+def main():
+	"""Lanza el servidor de Bokeh independiente de Flask en BOKEH_NUM_PROCS procesos
+	"""
+	logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+	server = create_server(num_procs=BOKEH_NUM_PROCS)
+	# A partir de aquí cada proceso continúa por separado (task_id es None con un solo proceso). Los hilos no se heredan y cada proceso
+	# tiene sus propias cachés: todos cargan las instantáneas locales, pero solo el primero precarga los datos de RapidMiner salvo que
+	# se indique WARMUP_ALL_PROCS, para no multiplicar las llamadas por el número de procesos
+	process = task_id()
+	if process is not None:
+		start_metrics_server(process)
+	if WARMUP_ALL_PROCS or not process:
+		Thread(target=warm_up_worker, daemon=True).start()
+	else:
+		Thread(target=load_snapshots, daemon=True).start()
+	logger.info(f'Servidor de Bokeh escuchando en el puerto {server.port}')
+	server.start()
+	server.io_loop.start()
+
+if __name__ == '__main__':
+	main()
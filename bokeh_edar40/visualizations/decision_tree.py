@@ -1,251 +1,342 @@
+import numpy as np
 import re
 import math
 
+def tidy_tree_layout(children, root=0, distance=1.):
+	"""Calcula la posición de los nodos de un árbol con el algoritmo de Reingold-Tilford en la versión de tiempo lineal
+	de Buchheim, Jünger y Leipert. Los subárboles se colocan lo más juntos posible sin solaparse, cada padre queda centrado
+	sobre sus hijos y los subárboles iguales se dibujan iguales
+
+	Parameters:
+		children (list): Índices de los hijos de cada nodo, en orden de izquierda a derecha
+		root (int): Índice del nodo raíz
+		distance (float): Distancia horizontal mínima entre dos nodos del mismo nivel
+
+	Returns:
+		ndarray: Coordenada X de cada nodo, empezando en 0
+		ndarray: Nivel de profundidad de cada nodo
+	"""
+	num_nodes = len(children)
+	parent = [-1]*num_nodes
+	number = [0]*num_nodes
+	for v, node_children in enumerate(children):
+		for i, w in enumerate(node_children):
+			parent[w] = v
+			number[w] = i
+
+	prelim = [0.]*num_nodes
+	mod = [0.]*num_nodes
+	shift = [0.]*num_nodes
+	change = [0.]*num_nodes
+	thread = [-1]*num_nodes
+	ancestor = list(range(num_nodes))
+
+	def next_left(v):
+		return thread[v] if thread[v] >= 0 else (children[v][0] if children[v] else -1)
+
+	def next_right(v):
+		return thread[v] if thread[v] >= 0 else (children[v][-1] if children[v] else -1)
+
+	def left_sibling(v):
+		return children[parent[v]][number[v]-1] if parent[v] >= 0 and number[v] > 0 else -1
+
+	def place(v):
+		# Posición preliminar del nodo respecto a su hermano izquierdo, con sus hijos ya colocados
+		sibling = left_sibling(v)
+		if not children[v]:
+			prelim[v] = prelim[sibling] + distance if sibling >= 0 else 0.
+		else:
+			midpoint = (prelim[children[v][0]] + prelim[children[v][-1]]) / 2
+			if sibling >= 0:
+				prelim[v] = prelim[sibling] + distance
+				mod[v] = prelim[v] - midpoint
+			else:
+				prelim[v] = midpoint
+
+	def move_subtree(left, right, subtree_shift):
+		subtrees = number[right] - number[left]
+		change[right] -= subtree_shift / subtrees
+		shift[right] += subtree_shift
+		change[left] += subtree_shift / subtrees
+		prelim[right] += subtree_shift
+		mod[right] += subtree_shift
+
+	def apportion(v, default_ancestor):
+		# Separa el subárbol de v de los subárboles de sus hermanos izquierdos recorriendo los contornos enfrentados
+		sibling = left_sibling(v)
+		if sibling < 0:
+			return default_ancestor
+		inner_right = outer_right = v
+		inner_left = sibling
+		outer_left = children[parent[v]][0]
+		sum_inner_right = sum_outer_right = mod[v]
+		sum_inner_left = mod[inner_left]
+		sum_outer_left = mod[outer_left]
+		while next_right(inner_left) >= 0 and next_left(inner_right) >= 0:
+			inner_left = next_right(inner_left)
+			inner_right = next_left(inner_right)
+			outer_left = next_left(outer_left)
+			outer_right = next_right(outer_right)
+			ancestor[outer_right] = v
+			subtree_shift = (prelim[inner_left] + sum_inner_left) - (prelim[inner_right] + sum_inner_right) + distance
+			if subtree_shift > 0:
+				left = ancestor[inner_left] if parent[ancestor[inner_left]] == parent[v] else default_ancestor
+				move_subtree(left, v, subtree_shift)
+				sum_inner_right += subtree_shift
+				sum_outer_right += subtree_shift
+			sum_inner_left += mod[inner_left]
+			sum_inner_right += mod[inner_right]
+			sum_outer_left += mod[outer_left]
+			sum_outer_right += mod[outer_right]
+		if next_right(inner_left) >= 0 and next_right(outer_right) < 0:
+			thread[outer_right] = next_right(inner_left)
+			mod[outer_right] += sum_inner_left - sum_outer_right
+		else:
+			if next_left(inner_right) >= 0 and next_left(outer_left) < 0:
+				thread[outer_left] = next_left(inner_right)
+				mod[outer_left] += sum_inner_right - sum_outer_left
+			default_ancestor = v
+		return default_ancestor
+
+	def execute_shifts(v):
+		total_shift = total_change = 0.
+		for w in reversed(children[v]):
+			prelim[w] += total_shift
+			mod[w] += total_shift
+			total_change += change[w]
+			total_shift += shift[w] + total_change
+
+	# Primer recorrido en postorden (los hijos antes que el padre), sin recursión para no depender de la profundidad del árbol
+	preorder = []
+	stack = [root]
+	while stack:
+		v = stack.pop()
+		preorder.append(v)
+		stack.extend(children[v])
+	for v in reversed(preorder):
+		if children[v]:
+			default_ancestor = children[v][0]
+			for w in children[v]:
+				place(w)
+				default_ancestor = apportion(w, default_ancestor)
+			execute_shifts(v)
+	place(root)
+
+	# Segundo recorrido en preorden sumando los desplazamientos de los antecesores
+	x = np.zeros(num_nodes)
+	depth = np.zeros(num_nodes, dtype=int)
+	stack = [(root, 0., 0)]
+	while stack:
+		v, modifier, level = stack.pop()
+		x[v] = prelim[v] + modifier
+		depth[v] = level
+		stack.extend((w, modifier + mod[v], level+1) for w in children[v])
+	return x - x.min(), depth
+
 class Tree:
 	"""Clase Tree para representar la estructura del árbol de decisión
 	
-	Esta clase es utilizada para representar el árbol de decisión con una lista de nodo ordenados según los hijos y el padre de cada nodo
+	El árbol se guarda como estructura de arrays: cada nodo es una posición en los arrays parent, level, name_id, color_id
+	y edge_id, y los hijos de cada nodo se guardan en formato CSR (children[child_offsets[i]:child_offsets[i+1]] son los
+	hijos del nodo i, en orden de izquierda a derecha). Los nombres, colores y condiciones se guardan una sola vez en tablas.
+	Mientras se construye con add_rule los arrays son listas, compact los convierte en arrays de NumPy
 	
 	Attributes:
-		node_list: Lista de nodos
+		parent: Índice del nodo padre de cada nodo (-1 para el nodo raíz)
+		level: Nivel de profundidad de cada nodo
+		name_id: Índice en names del nombre de cada nodo
+		color_id: Índice en colors del color de cada nodo
+		edge_id: Índice en edges de la condición de la relación con el nodo padre (-1 para el nodo raíz)
+		names: Tabla de nombres de nodo
+		colors: Tabla de colores de nodo
+		edges: Tabla de condiciones de relación
+		children: Índices de los hijos de todos los nodos, agrupados por padre
+		child_offsets: Posición en children de los hijos de cada nodo
+		x: Coordenadas X de los nodos en el plano
+		y: Coordenadas Y de los nodos en el plano
 	"""
 
 	NODE_WIDTH = 0.2
 	NODE_HEIGHT = 0.15
+	# Distancia mínima entre los centros de dos nodos del mismo nivel
+	MIN_NODE_GAP = 0.3
 
 	def __init__(self):
-		self.node_list = []
-
-
-	def add_node(self, node):
-		"""Añade nodo a la lista y en caso de estar vacía se incializa
+		self.parent = []
+		self.level = []
+		self.name_id = []
+		self.color_id = []
+		self.edge_id = []
+		self.names = []
+		self.colors = []
+		self.edges = []
+		self.children = None
+		self.child_offsets = None
+		self.x = None
+		self.y = None
+		# Índices para construir el árbol: nodos por (nivel, nombre, padre, condición) y posición de cada texto en su tabla
+		self._node_index = {}
+		self._table_index = {'names': {}, 'colors': {}, 'edges': {}}
+
+	def __len__(self):
+		return len(self.parent)
+
+	def add_rule(self, conditions, leaf_name, leaf_color, node_color='#c2e8e0'):
+		"""Añade al árbol la rama de una regla del árbol de decisión. Cada nodo se busca en un índice por (nivel, nombre, camino),
+		siendo el camino el nodo padre y la condición de la relación que lleva hasta él, de forma que los nodos repetidos se
+		reutilizan en tiempo constante y el árbol completo se construye en tiempo lineal
 
 		Attributes:
-			node (Node): Nodo para añadir a la lista
+			conditions (list): Pares (nombre, condición) de los nodos de la regla, desde la raíz
+			leaf_name (string): Nombre del nodo hoja (la predicción de la regla)
+			leaf_color (string): Color del nodo hoja
+			node_color (string): Color de los nodos intermedios
 		"""
-		if self.node_list == 0:
-			self.node_list = []
+		parent = -1
+		edge = None
+		for level, (name, condition) in enumerate(conditions):
+			parent = self.add_path_node(parent, edge, level, name, node_color)
+			edge = condition
+		self.add_path_node(parent, edge, len(conditions), leaf_name, leaf_color)
 
-		self.node_list.append(node)
+	def add_path_node(self, parent, edge, level, name, color):
+		"""Devuelve el índice del nodo del camino indicado, añadiéndolo al árbol si no existe
 
-	def get_nodes_by_level(self):
-		"""Obtiene el número de nodos en cada nivel de profundidad del árbol en forma de diccionario
+		Attributes:
+			parent (int): Índice del nodo padre (-1 para el nodo raíz)
+			edge (string): Condición de la relación entre el nodo padre y el nodo
+			level (int): Nivel de profundidad del nodo
+			name (string): Nombre del nodo
+			color (string): Color del nodo
 
 		Returns:
-			dict: Número de nodos en cada nivel de profundidad
+			int: Índice del nodo
 		"""
-		levels = [node.level for node in self.node_list]
-		nodes_in_levels = {level: levels.count(level) for level in levels}
-		for nodes_in_levels_key, nodes_in_levels_value in nodes_in_levels.items():
-			if nodes_in_levels_key-1 in nodes_in_levels and nodes_in_levels_value < nodes_in_levels[nodes_in_levels_key-1]*2:
-				nodes_in_levels[nodes_in_levels_key] = nodes_in_levels[nodes_in_levels_key-1]*2
-		return nodes_in_levels
+		key = (level, name, parent, edge)
+		node = self._node_index.get(key)
+		if node is None:
+			node = len(self.parent)
+			self._node_index[key] = node
+			self.parent.append(parent)
+			self.level.append(level)
+			self.name_id.append(self.get_table_id('names', name))
+			self.color_id.append(self.get_table_id('colors', color))
+			self.edge_id.append(self.get_table_id('edges', edge) if edge is not None else -1)
+		return node
+
+	def get_table_id(self, table_name, value):
+		"""Devuelve la posición de un texto en una de las tablas del árbol, añadiéndolo si no existe
 
-	def get_nodes_relations(self):
-		"""Recoorre la lista de nodos y obtiene la relación de cada nodo
+		Attributes:
+			table_name (string): Nombre de la tabla (names, colors o edges)
+			value (string): Texto a buscar
 
 		Returns:
-			list: Lista de nodos de inicio
-			list: Lista de nodos finales
+			int: Posición del texto en la tabla
 		"""
-		start = []
-		end = []
-		for node in self.node_list:
-			start, end = node.get_start_and_end(start, end)
-
-		return start, end
-
-	def get_node_text_positions(self):
-		"""Recorre la lista de nodos y obtiene la posición para mostrar el texto del nombre de cada nodo
+		table_index = self._table_index[table_name]
+		table_id = table_index.get(value)
+		if table_id is None:
+			table_id = len(table_index)
+			table_index[value] = table_id
+			getattr(self, table_name).append(value)
+		return table_id
+
+	def compact(self):
+		"""Convierte las listas del árbol en arrays de NumPy, calcula los hijos de cada nodo en formato CSR y libera los
+		índices de construcción. Después de compact el árbol no admite nuevas reglas
 
 		Returns:
-			list: Coordenadas X de posición
-			list: Coordenadas Y de posición
-			list: Texto para mostrar como nombre en cada nodo
+			Tree: El propio árbol
 		"""
-		x = []
-		y = []
-		text = []
-		for node in self.node_list:	
-			x.append(node.x) 
-			y.append(node.y-(self.NODE_HEIGHT/2)+0.04)
-			text.append(node.name)
-		return x, y, text
-			
+		num_nodes = len(self.parent)
+		self.parent = np.array(self.parent, dtype=np.int32)
+		self.level = np.array(self.level, dtype=np.int32)
+		self.name_id = np.array(self.name_id, dtype=np.int32)
+		self.color_id = np.array(self.color_id, dtype=np.int32)
+		self.edge_id = np.array(self.edge_id, dtype=np.int32)
+		self.names = np.array(self.names, dtype=object)
+		self.colors = np.array(self.colors, dtype=object)
+		self.edges = np.array(self.edges, dtype=object)
+
+		# Los nodos se añaden en orden, así que una ordenación estable por padre mantiene el orden de los hijos
+		child_nodes = np.flatnonzero(self.parent >= 0).astype(np.int32)
+		self.children = child_nodes[np.argsort(self.parent[child_nodes], kind='stable')]
+		self.child_offsets = np.zeros(num_nodes+1, dtype=np.int32)
+		np.cumsum(np.bincount(self.parent[child_nodes], minlength=num_nodes), out=self.child_offsets[1:])
+
+		self._node_index = None
+		self._table_index = None
+		return self
 
-	def get_layout_node_positions(self, tree_plot):
-		"""Recorre la lista de nodos para obtener la posición de cada nodo en el plano 
-		El tamaño del plano depende del tamaño de la figura Bokeh creada para mostrar el árbol
-
-		Attributes:
-			tree_plot (Figure): Figura Bokeh donde se dibuja el árbol de decisión
+	def get_nodes_relations(self):
+		"""Obtiene la relación de cada nodo con sus hijos
 
 		Returns:
-			list: Coordenadas X de los nodos
-			list: Coordenada Y de los nodos
+			ndarray: Índices de los nodos de inicio
+			ndarray: Índices de los nodos finales
 		"""
-		nodes_in_levels = self.get_nodes_by_level()
-		num_levels = len(nodes_in_levels.keys())
-		x_range = tree_plot.x_range.end - tree_plot.x_range.start - (0.1*2)
-		x = []
-		y = []
-		for node in self.node_list:
-			node.get_layout_position(nodes_in_levels, num_levels, x_range)
-			x.append(node.x)
-			y.append(node.y)
-		return x, y
+		start = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.child_offsets))
+		return start, self.children
 
-	def get_line_text_positions(self):
-		""" Recorre la lista de nodos para obtener la posición del texto y el texto de condición a dibujar sobre las relaciones entre los nodos 
+	def get_node_text_positions(self):
+		"""Obtiene la posición para mostrar el texto del nombre de cada nodo a partir de la distribución de los nodos
+		(ver get_layout_node_positions)
 
 		Returns:
-			list: Coordenadas X de posición
-			list: Coordenadas Y de posición
-			list: Textos de condición a dibujar
+			ndarray: Coordenadas X de posición
+			ndarray: Coordenadas Y de posición
+			ndarray: Texto para mostrar como nombre en cada nodo
 		"""
-		middle_x = []
-		middle_y =  []
-		middle_text = []
-		for node in self.node_list:
-			if node.childrens is not None:
-				for i in range(len(node.childrens)):
-					x = (node.childrens[i].x + node.x)/2
-					y = (node.childrens[i].y + node.y)/2 - 0.02
-					middle_x.append(x)
-					middle_y.append(y)
-					middle_text.append(node.link_text[i])
-
-		return middle_x, middle_y, middle_text
-
-	def order_nodes(self, tree_node, node_link_text):
-		"""Ordena la lista de nodos. Para ello, recorre los nodos, busca el primer nodo de un
-		nivel superior al nuevo nodo a insertar y cambia los parámetros childrens y parent de ambos nodos.
-		Como el árbol en el fichero XML se obtiene de forma ordenada esto es correcto.
+		return self.x, self.y-(self.NODE_HEIGHT/2)+0.04, self.names[self.name_id]
 
-		"""
-		add = True
-		for node in reversed(self.node_list):
-			# Si la lista ya contiene un nodo de mismo nombre y nivel de profundidad, puede que el nodo esté repetido
-			if node.level == tree_node.level and node.name == tree_node.name:
-				# Si existe un nodo con el mismo link_text que el que estamos analizando, será un nodo repetido. Tenemos que ignorarlo.
-				if node_link_text in node.link_text:
-					add = False
-					break
-				# Si el nodo padre tiene asignadas más condiciones de relación que número de hijos, el nodo no está repetido. Existe un nodo de mismo nombre y nivel de profundidad que debemos añadir a la lista
-				if node.parent is not None and (len(node.parent.link_text) > len(node.parent.childrens)):
-						add = True
-						tree_node.parent = node.parent
-						node.parent.add_children(tree_node)
-						break
-				
-				tree_node.id = node.id
-				node.add_link_text(node_link_text)
-				add = False
-
-			if node.level < tree_node.level:
-				if add:
-					tree_node.parent = node
-					node.add_children(tree_node)
-					break
-		if add:
-			tree_node.add_link_text(node_link_text)
-			self.node_list.append(tree_node)
-
-class Node:
-
-	"""Clase Node para representar un nodo en el árbol de decisión
-	
-	Attributes:
-		id (int): Id del nodo
-		name (string): Nombre del nodo
-		level (int): Nivel de profundida del nodo en el árbol
-		color (string): Color con cual pintar el nodo en la figura
-		link_text (string): Relaciones de condición del nodo para los nodos hijos
-		childrens (list): Lista de nodos hijos del nodo
-		parent (Node): Nodo padre
-		x (float): Valor de posición coordenada X en el plano
-		y (float): Valor de posición coordenada Y en el plano
-	"""
-
-	def __init__(self, id, name, level, color, link_text=None, childrens=None, parent=None, x=None, y=None):
-		self.id = id
-		self.name = name
-		self.level = level
-		self.color = color
-		self.link_text = link_text
-		self.childrens = childrens
-		self.parent = parent
-		self.x = x
-		self.y = y
+	def get_node_colors(self):
+		"""Obtiene el color de cada nodo
 
-
-	def add_children(self, children):
-		"""Añade un nodo hijo
-
-		Attributes:
-			children (Node): Nodo hijo
+		Returns:
+			ndarray: Color en hexadecimal de cada nodo
 		"""
-		if self.childrens == None:
-			self.childrens = []
-		self.childrens.append(children)
+		return self.colors[self.color_id]
 
-	def get_start_and_end(self, start, end):
-		"""Obtiene relaciones de cada nodo.
+	def get_layout_node_positions(self, tree_plot):
+		"""Distribuye los nodos en el plano con tidy_tree_layout, de forma que ningún nodo se solape con otro.
+		Los nodos se reparten en el rango X de la figura Bokeh creada para mostrar el árbol y, si el árbol es demasiado
+		ancho para mantener una distancia mínima entre nodos, se amplía el rango X de la figura
 
 		Attributes:
-			start (list): Lista de ID-s del nodo de inicio de cada relación
-			end (list): Lista de ID-s del nodo final de cada relación
-
-		Returns:
-			list: List of start relations.
-			list: List of end relations.
-		"""
-		if self.childrens is not None:
-			for children in self.childrens:
-				start.append(self.id)
-				end.append(children.id)
-		return start, end
-
-	def get_text_position(self):
-		"""Obtiene posición del texto de nombre del nodo en el plano
+			tree_plot (Figure): Figura Bokeh donde se dibuja el árbol de decisión
 
 		Returns:
-			float: Valor coordenada X en el plano
-			float: Valor coordenada Y en el plano
+			ndarray: Coordenadas X de los nodos
+			ndarray: Coordenada Y de los nodos
 		"""
+		children = self.children.tolist()
+		offsets = self.child_offsets.tolist()
+		x, _ = tidy_tree_layout([children[offsets[i]:offsets[i+1]] for i in range(len(self))])
 
-		x = self.x - 0.02
-		y = self.y  - 0.01
-		return x, y
+		num_levels = self.level.max() + 1
+		width = x.max()
+		x_range = tree_plot.x_range.end - tree_plot.x_range.start - (0.1*2)
+		x_gap = max(self.MIN_NODE_GAP, x_range/width) if width > 0 else 0
+		self.x = (x - width/2) * x_gap
+		self.y = 1 - (self.level/num_levels)
 
-	def add_link_text(self, text_link):
-		"""Añade una relación de condición al nodo
-		"""
-		if self.link_text == None:
-			self.link_text = []
-		self.link_text.append(text_link)
+		x_limit = width*x_gap/2 + 0.1
+		if x_limit > tree_plot.x_range.end:
+			tree_plot.x_range.start = -x_limit
+			tree_plot.x_range.end = x_limit
+		return self.x, self.y
 
-	def get_layout_position(self, nodes_in_levels, num_levels, x_range):
-		"""Obtiene posición del nodo en el plano
+	def get_line_text_positions(self):
+		""" Obtiene la posición del texto y el texto de condición a dibujar sobre las relaciones entre los nodos a partir de
+		la distribución de los nodos (ver get_layout_node_positions)
 
-		Attributes:
-			nodes_in_levels (dict): Diccionario conteniendo los niveles de profundidad que tiene el árbol como clave, y el número de nodos en cada nivel como valor
-			num_levels (int): El número de niveles de profundidad que tiene el árbol (TODO: Esto puede conseguirse del diccionario anterior, no hace falta pasarlo)
-			x_range (float): El rango del plano en el eje X, esto es, la anchura de la figura
+		Returns:
+			ndarray: Coordenadas X de posición
+			ndarray: Coordenadas Y de posición
+			ndarray: Textos de condición a dibujar
 		"""
-		y_pos = 1 - (self.level/num_levels) # Dividimos el rango en el eje Y del plano por el número de niveles de profundidad del árbol. Así encontramos el valor de coordenada Y de los nodos de cada nivel de profundidad del árbol
-		if self.parent is None: # Si se trata del nodo raíz, el valor de la coordenada X es el 0, suponiendo que el valor 0 es el cetro del rango X.
-			x_pos = 0
-			self.x = x_pos
-			self.y = y_pos
-
-		# Para el valor de coordenada X, si el nodo es un nodo intermedio, debemos dividir el espacio disponible en el rango X por el número de nodos a dibujar en ese nivel de profundidad
-		# Para el valor de coordenada Y, como en el caso anterior, dividimos el rango en el eje Y del plano por el número de niveles de profundidad del árbol y así encontramos la coordenada Y de los nodos en ese nivel
-		if self.childrens is not None: 
-			num_childs_in_level = nodes_in_levels[self.childrens[0].level]
-			x_gap = (x_range/2) / num_childs_in_level
-			y_pos = 1 - (self.childrens[0].level/num_levels)
-			for i in range(len(self.childrens)):
-				x_pos = self.childrens[i].parent.x + (x_gap*(i+1)) - (x_gap*(len(self.childrens)-i))
-				self.childrens[i].x = x_pos
-				self.childrens[i].y = y_pos
+		start, end = self.get_nodes_relations()
+		middle_x = (self.x[start] + self.x[end])/2
+		middle_y = (self.y[start] + self.y[end])/2 - 0.02
+		return middle_x, middle_y, self.edges[self.edge_id[end]]
@@ -0,0 +1,60 @@
+import numpy as np
+
+def lttb(x, y, threshold):
+	"""Selecciona los puntos de una serie con el algoritmo Largest-Triangle-Three-Buckets. Se mantienen el primer y el último punto y,
+	de cada uno de los threshold-2 intervalos intermedios, el punto que forma el triángulo de mayor área con el punto elegido en el
+	intervalo anterior y la media del siguiente. Así se conserva la forma de la serie (picos incluidos) con muchos menos puntos
+
+	Parameters:
+		x (array): Valores X de la serie, ordenados
+		y (array): Valores Y de la serie
+		threshold (int): Número de puntos a seleccionar
+
+	Returns:
+		array: Índices de los puntos seleccionados, ordenados
+	"""
+	n = len(x)
+	if threshold >= n:
+		return np.arange(n)
+	if threshold < 3:
+		return np.array([0, n-1][:max(threshold, 0)], dtype=np.int64)
+
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	# Límites de los intervalos intermedios (el primer y el último punto forman su propio intervalo)
+	edges = np.linspace(1, n-1, threshold-1).astype(np.int64)
+	# Media de cada intervalo, usada como tercer vértice del triángulo del intervalo anterior
+	sums_x = np.add.reduceat(x[1:n-1], edges[:-1]-1)
+	sums_y = np.add.reduceat(y[1:n-1], edges[:-1]-1)
+	counts = np.diff(edges)
+	avg_x = np.append(sums_x/counts, x[n-1])
+	avg_y = np.append(sums_y/counts, y[n-1])
+
+	selected = np.empty(threshold, dtype=np.int64)
+	selected[0] = 0
+	a = 0
+	for i in range(threshold-2):
+		start, end = edges[i], edges[i+1]
+		# El área es proporcional al valor absoluto del producto vectorial (no hace falta dividir entre 2)
+		areas = np.abs((x[a]-avg_x[i+1])*(y[start:end]-y[a]) - (x[a]-x[start:end])*(avg_y[i+1]-y[a]))
+		a = start + int(np.argmax(areas))
+		selected[i+1] = a
+	selected[threshold-1] = n-1
+	return selected
+
+def downsample(x, columns, threshold):
+	"""Reduce varias series con el mismo eje X a como mucho threshold puntos. Cada serie se reduce con LTTB a threshold//len(columns)
+	puntos y se mantiene la unión de los puntos elegidos, así todas las series conservan sus picos y siguen compartiendo el eje X
+
+	Parameters:
+		x (array): Valores X comunes, ordenados
+		columns (list): Valores Y de cada serie
+		threshold (int): Número máximo de puntos
+
+	Returns:
+		array: Índices de los puntos seleccionados, ordenados
+	"""
+	if len(x) <= threshold:
+		return np.arange(len(x))
+	series_threshold = max(threshold//max(len(columns), 1), 3)
+	return np.unique(np.concatenate([lttb(x, y, series_threshold) for y in columns]))
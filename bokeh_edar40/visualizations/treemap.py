@@ -1,66 +1,94 @@
+import numpy as np
 
 def normalize_sizes(sizes, dx, dy):
-    total_size = sum(sizes)
-    total_area = dx * dy
-    sizes = list(map(float, sizes))
-    sizes = list(map(lambda size: size * total_area / total_size, sizes))
-    return sizes
-   
-def layoutrow(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    width = covered_area / dy
-    rects = []
-    for size in sizes:
-        rects.append({'x': x, 'y': y, 'dx': width, 'dy': size / width})
-        y += size / width
-    return rects
+    """Escala los tamaños para que su suma sea el área del rectángulo dx*dy
 
-def layoutcol(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    height = covered_area / dx
-    rects = []
-    for size in sizes:
-        rects.append({'x': x, 'y': y, 'dx': size / height, 'dy': height})
-        x += size / height
-    return rects
+    Parameters:
+        sizes (list): Tamaños (valores) de los rectángulos
+        dx (float): Anchura del rectángulo disponible
+        dy (float): Altura del rectángulo disponible
 
-def layout(sizes, x, y, dx, dy):
-    return layoutrow(sizes, x, y, dx, dy) if dx >= dy else layoutcol(sizes, x, y, dx, dy)
+    Returns:
+        ndarray: Áreas de los rectángulos
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    return sizes * (dx * dy / sizes.sum())
 
-def leftoverrow(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    width = covered_area / dy
-    leftover_x = x + width
-    leftover_y = y
-    leftover_dx = dx - width
-    leftover_dy = dy
-    return (leftover_x, leftover_y, leftover_dx, leftover_dy)
+def worst_ratio(total, min_size, max_size, side):
+    """Peor relación de aspecto de una fila de rectángulos apilados a lo largo de un lado, calculada con la suma, el mínimo
+    y el máximo de sus áreas sin construir la fila
 
-def leftovercol(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    height = covered_area / dx
-    leftover_x = x
-    leftover_y = y + height
-    leftover_dx = dx
-    leftover_dy = dy - height
-    return (leftover_x, leftover_y, leftover_dx, leftover_dy)
+    Parameters:
+        total (float): Suma de las áreas de la fila
+        min_size (float): Área mínima de la fila
+        max_size (float): Área máxima de la fila
+        side (float): Longitud del lado sobre el que se apila la fila
 
-def leftover(sizes, x, y, dx, dy):
-    return leftoverrow(sizes, x, y, dx, dy) if dx >= dy else leftovercol(sizes, x, y, dx, dy)
-   
-def worst_ratio(sizes, x, y, dx, dy):
-    return max([max(rect['dx'] / rect['dy'], rect['dy'] / rect['dx']) for rect in layout(sizes, x, y, dx, dy)])
+    Returns:
+        float: Peor relación de aspecto (>= 1) de los rectángulos de la fila
+    """
+    if min_size <= 0:
+        return float('inf')
+    width_squared = (total / side) ** 2
+    return max(width_squared / min_size, max_size / width_squared)
 
 def squarify(sizes, x, y, dx, dy):
-    sizes = list(map(float, sizes))
-    if len(sizes) == 0:
-        return []
-    if len(sizes) == 1:
-        return layout(sizes, x, y, dx, dy)
-    i = 1
-    while i < len(sizes) and worst_ratio(sizes[:i], x, y, dx, dy) >= worst_ratio(sizes[:(i+1)], x, y, dx, dy):
-        i += 1
-    current = sizes[:i]
-    remaining = sizes[i:]
-    (leftover_x, leftover_y, leftover_dx, leftover_dy) = leftover(current, x, y, dx, dy)
-    return layout(current, x, y, dx, dy) + squarify(remaining, leftover_x, leftover_y, leftover_dx, leftover_dy)
\ No newline at end of file
+    """Distribuye los rectángulos con el algoritmo squarified treemap. Las filas se construyen de forma iterativa manteniendo
+    la suma, el mínimo y el máximo de las áreas, así cada candidato se evalúa en tiempo constante y el algoritmo es lineal.
+
+    Parameters:
+        sizes (list): Áreas de los rectángulos (ver normalize_sizes), normalmente ordenadas de mayor a menor
+        x (float): Posición x de comienzo del rectángulo disponible
+        y (float): Posición y de comienzo del rectángulo disponible
+        dx (float): Anchura del rectángulo disponible
+        dy (float): Altura del rectángulo disponible
+
+    Returns:
+        ndarray: Coordenadas x de cada rectángulo
+        ndarray: Coordenadas y de cada rectángulo
+        ndarray: Anchura de cada rectángulo
+        ndarray: Altura de cada rectángulo
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    num_sizes = len(sizes)
+    rect_x = np.empty(num_sizes)
+    rect_y = np.empty(num_sizes)
+    rect_dx = np.empty(num_sizes)
+    rect_dy = np.empty(num_sizes)
+
+    start = 0
+    while start < num_sizes:
+        # Las filas se apilan a lo largo del lado más corto del espacio libre
+        side = dy if dx >= dy else dx
+        total = min_size = max_size = sizes[start]
+        ratio = worst_ratio(total, min_size, max_size, side)
+        end = start + 1
+        while end < num_sizes:
+            size = sizes[end]
+            new_ratio = worst_ratio(total + size, min(min_size, size), max(max_size, size), side)
+            if ratio < new_ratio:
+                break
+            total, min_size, max_size, ratio = total + size, min(min_size, size), max(max_size, size), new_ratio
+            end += 1
+
+        row = sizes[start:end]
+        offsets = np.concatenate(([0.], np.cumsum(row)[:-1]))
+        if dx >= dy:
+            width = total / dy
+            rect_x[start:end] = x
+            rect_y[start:end] = y + offsets / width
+            rect_dx[start:end] = width
+            rect_dy[start:end] = row / width
+            x += width
+            dx -= width
+        else:
+            height = total / dx
+            rect_x[start:end] = x + offsets / height
+            rect_y[start:end] = y
+            rect_dx[start:end] = row / height
+            rect_dy[start:end] = height
+            y += height
+            dy -= height
+        start = end
+
+    return rect_x, rect_y, rect_dx, rect_dy
@@ -1,5 +1,6 @@
-from flask import Flask, render_template, session, redirect, url_for, request, flash
+from flask import Flask, render_template, session, redirect, url_for, request, flash, Response
 from utils.server_config import *
+import utils.metrics as metrics
 
 import logging
 # logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
@@ -47,7 +48,9 @@ if __name__ != '__main__':
 	app.logger.addHandler(tornado_application_logger.handlers)
 	app.logger.setLevel(logging.INFO)
 
-Thread(target=bk_worker).start()
+# El servidor de Bokeh se lanza aparte (python -m bokeh_edar40.server) salvo en modo BOKEH_EMBEDDED
+if BOKEH_EMBEDDED:
+	Thread(target=bk_worker).start()
 
 @app.route('/', methods=['GET'])
 def index():
@@ -88,7 +91,7 @@ def perfil():
 		username = str(session.get('username'))
 		if username == 'rapidminer':
 			# script = server_document(url=r'/cartuja', relative_urls=True)
-			script = server_document(f'http://{SERVER_IP}:9090/perfil', arguments={'periodo':1})
+			script = server_document(f'http://{SERVER_IP}:{BOKEH_PORT}/perfil', arguments={'periodo':1})
 			title = 'Calidad del Agua - Periodo 1'
 			return render_template('cartuja.html', script=script, active_page=active_page, title = title)
 	return redirect(url_for('login'))
@@ -100,7 +103,7 @@ def perfil_p2():
 		username = str(session.get('username'))
 		if username == 'rapidminer':
 			# script = server_document(url=r'/cartuja', relative_urls=True)	
-			script = server_document(f'http://{SERVER_IP}:9090/perfil', arguments={'periodo':2})
+			script = server_document(f'http://{SERVER_IP}:{BOKEH_PORT}/perfil', arguments={'periodo':2})
 			title = 'Calidad del Agua - Periodo 2'
 			return render_template('cartuja.html', script=script, active_page=active_page, title = title)
 	return redirect(url_for('login'))
@@ -112,7 +115,7 @@ def perfil_comp():
 		username = str(session.get('username'))
 		if username == 'rapidminer':
 			# script = server_document(url=r'/cartuja', relative_urls=True)
-			script = server_document(f'http://{SERVER_IP}:9090/perfil')
+			script = server_document(f'http://{SERVER_IP}:{BOKEH_PORT}/perfil')
 			title = 'Calidad del Agua - Comparativo Periodos'
 			return render_template('cartuja.html', script=script, active_page=active_page, title = title)
 	return redirect(url_for('login'))
@@ -126,7 +129,7 @@ def cartuja_prediction():
 		username = str(session.get('username'))
 		if username == 'rapidminer':
 			# script = server_document(url=r'/cartuja/prediccion', relative_urls=True)
-			script = server_document(f'http://{SERVER_IP}:9090/prediccion')
+			script = server_document(f'http://{SERVER_IP}:{BOKEH_PORT}/prediccion')
 			title = 'Predicción de Calidad del Agua - Periodo 1'
 			return render_template('cartuja.html', script=script, active_page=active_page, title = title)
 	return redirect(url_for('login'))
@@ -139,7 +142,7 @@ def cartuja_prediction_p2():
 		username = str(session.get('username'))
 		if username == 'rapidminer':
 			# script = server_document(url=r'/cartuja/prediccion', relative_urls=True)
-			script = server_document(f'http://{SERVER_IP}:9090/prediccion')							
+			script = server_document(f'http://{SERVER_IP}:{BOKEH_PORT}/prediccion')							
 			title = 'Predicción de Calidad del Agua - Periodo 2'
 			return render_template('cartuja.html', script=script, active_page=active_page, title = title)
 	return redirect(url_for('login'))
@@ -152,11 +155,18 @@ def cartuja_prediction_comp():
 		username = str(session.get('username'))
 		if username == 'rapidminer':
 			# script = server_document(url=r'/cartuja/prediccion', relative_urls=True)
-			script = server_document(f'http://{SERVER_IP}:9090/prediccion')
+			script = server_document(f'http://{SERVER_IP}:{BOKEH_PORT}/prediccion')
 			title = 'Predicción de Calidad del Agua - Comparativo Periodos'
 			return render_template('cartuja.html', script=script, active_page=active_page, title = title)
 	return redirect(url_for('login'))
 
+# Métricas de latencia por etapa, aciertos de las cachés y sesiones de Bokeh activas en formato Prometheus. Solo tienen datos si el
+# servidor de Bokeh se ejecuta en este proceso (BOKEH_EMBEDDED), si no las publica el propio servidor de Bokeh (ver bokeh_edar40/server.py)
+if BOKEH_EMBEDDED:
+	@app.route('/metrics', methods=['GET'])
+	def prometheus_metrics():
+		return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 #Configuración cuando ejecutamos unicamente Flask sin Gunicorn, en modo de prueba
 if __name__ == '__main__':
 	app.secret_key = '[]V\xf0\xed\r\x84L,p\xc59n\x98\xbc\x92'
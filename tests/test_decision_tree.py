@@ -0,0 +1,188 @@
+"""Pruebas de bokeh_edar40.visualizations.decision_tree: construcción del árbol a partir de las reglas de RapidMiner y distribución de
+sus nodos en el plano.
+
+	python -m unittest discover tests
+"""
+from bokeh_edar40.applications.cartuja.second_descriptive import create_decision_tree_data
+from bokeh_edar40.visualizations.decision_tree import Tree, tidy_tree_layout
+
+from types import SimpleNamespace
+import pandas as pd
+import random
+import unittest
+
+def build_tree(rules):
+	tree = Tree()
+	for conditions, leaf_name in rules:
+		tree.add_rule(conditions, leaf_name, '#ffffff')
+	return tree.compact()
+
+def get_children(tree, node):
+	return tree.children[tree.child_offsets[node]:tree.child_offsets[node+1]].tolist()
+
+def describe(tree):
+	"""Devuelve cada nodo como (nombre, índice del padre, condición de la relación con el padre)"""
+	return [(tree.names[tree.name_id[node]], int(tree.parent[node]), tree.edges[tree.edge_id[node]] if tree.edge_id[node] >= 0 else None)
+			for node in range(len(tree))]
+
+class TreeTest(unittest.TestCase):
+
+	def test_shared_prefixes(self):
+		# Las reglas con el mismo principio comparten sus nodos, los ids son consecutivos en orden de aparición
+		tree = build_tree([
+			([('A', '<= 5'), ('B', '> 2')], 'cluster_0'),
+			([('A', '<= 5'), ('B', '<= 2')], 'cluster_1'),
+			([('A', '> 5')], 'cluster_2'),
+			([('A', '<= 5'), ('B', '> 2')], 'cluster_0')
+		])
+		self.assertEqual(describe(tree), [
+			('A', -1, None),
+			('B', 0, '<= 5'),
+			('cluster_0', 1, '> 2'),
+			('cluster_1', 1, '<= 2'),
+			('cluster_2', 0, '> 5')
+		])
+		self.assertEqual(tree.level.tolist(), [0, 1, 2, 2, 1])
+		self.assertEqual(get_children(tree, 0), [1, 4])
+		self.assertEqual(get_children(tree, 1), [2, 3])
+		self.assertEqual(get_children(tree, 2), [])
+
+	def test_same_attribute_in_two_subtrees(self):
+		# El mismo atributo en el mismo nivel bajo ramas distintas son nodos distintos, cada uno con sus hojas
+		tree = build_tree([
+			([('A', '<= 5'), ('B', '> 2')], 'cluster_0'),
+			([('A', '> 5'), ('B', '> 2')], 'cluster_1'),
+			([('A', '> 5'), ('B', '<= 2')], 'cluster_0'),
+			([('A', '<= 5'), ('B', '<= 2')], 'cluster_1')
+		])
+		self.assertEqual(describe(tree), [
+			('A', -1, None),
+			('B', 0, '<= 5'),
+			('cluster_0', 1, '> 2'),
+			('B', 0, '> 5'),
+			('cluster_1', 3, '> 2'),
+			('cluster_0', 3, '<= 2'),
+			('cluster_1', 1, '<= 2')
+		])
+		self.assertEqual(get_children(tree, 1), [2, 6])
+		self.assertEqual(get_children(tree, 3), [4, 5])
+
+	def test_labels(self):
+		tree = Tree()
+		tree.add_rule([('A', '<= 5'), ('B', '> 2')], 'range1\n[0-1]', '#111111', node_color='#cccccc')
+		tree.add_rule([('A', '<= 5'), ('B', '<= 2')], 'range2\n[1-2]', '#222222', node_color='#cccccc')
+		tree.add_rule([('A', '> 5')], 'range1\n[0-1]', '#111111', node_color='#cccccc')
+		tree.compact()
+		tree.get_layout_node_positions(SimpleNamespace(x_range=SimpleNamespace(start=-1, end=1)))
+
+		_, _, names = tree.get_node_text_positions()
+		self.assertEqual(names.tolist(), ['A', 'B', 'range1\n[0-1]', 'range2\n[1-2]', 'range1\n[0-1]'])
+		self.assertEqual(tree.get_node_colors().tolist(), ['#cccccc', '#cccccc', '#111111', '#222222', '#111111'])
+		# Cada texto de condición va en el punto medio de su relación
+		start, end = tree.get_nodes_relations()
+		middle_x, middle_y, edge_texts = tree.get_line_text_positions()
+		self.assertEqual(list(zip(start.tolist(), end.tolist(), edge_texts.tolist())), [(0, 1, '<= 5'), (0, 4, '> 5'), (1, 2, '> 2'), (1, 3, '<= 2')])
+		self.assertEqual(middle_x.tolist(), ((tree.x[start] + tree.x[end])/2).tolist())
+		self.assertEqual(middle_y.tolist(), ((tree.y[start] + tree.y[end])/2 - 0.02).tolist())
+
+	def test_rapidminer_rules(self):
+		# Cada condición de RapidMiner es "atributo condición", separadas por " & ". En los modelos de rangos la hoja es "rango intervalo"
+		df = pd.DataFrame({'Condition': ['O_MV <= 5.5 & DQO > 2', 'O_MV <= 5.5 & DQO <= 2', 'O_MV > 5.5'],
+			'Prediction': ['range1 [0 - 1]', 'range2 [1 - 2]', 'range1 [0 - 1]']})
+		tree = create_decision_tree_data(df, 'Nitrogeno')
+		self.assertEqual(describe(tree), [
+			('O_MV', -1, None),
+			('DQO', 0, '<= 5.5'),
+			('range1\n[0 - 1]', 1, '> 2'),
+			('range2\n[1 - 2]', 1, '<= 2'),
+			('range1\n[0 - 1]', 0, '> 5.5')
+		])
+		tree = create_decision_tree_data(df.assign(Prediction=['cluster_0', 'cluster_1', 'cluster_0']))
+		self.assertEqual(tree.names[tree.name_id].tolist(), ['O_MV', 'DQO', 'cluster_0', 'cluster_1', 'cluster_0'])
+
+def chain(length):
+	return [[i+1] for i in range(length-1)] + [[]]
+
+def from_parents(parents):
+	children = [[] for _ in range(len(parents)+1)]
+	for node, parent in enumerate(parents, start=1):
+		children[parent].append(node)
+	return children
+
+def comb(teeth, left=True):
+	"""Árbol en el que cada nodo de la espina tiene como hijos una hoja y la continuación de la espina, a la izquierda o a la derecha"""
+	parents = []
+	for i in range(teeth):
+		parent = 0 if i == 0 else (2*i-1 if left else 2*i)
+		parents += [parent, parent]
+	return from_parents(parents)
+
+def random_tree(rng, num_nodes):
+	# Cada nodo cuelga de uno anterior, con preferencia por los últimos para que salgan ramas largas y desequilibradas
+	return from_parents([rng.randint(max(0, node-rng.choice([1, 3, node])), node-1) for node in range(1, num_nodes)])
+
+class TidyTreeLayoutTest(unittest.TestCase):
+
+	TREES = {
+		'hoja': [[]],
+		'cadena': chain(6),
+		'peine izquierdo': comb(5),
+		'peine derecho': comb(5, left=False),
+		# Subárboles pequeños entre dos grandes y un padre con muchos hijos hoja
+		'huecos': from_parents([0, 0, 0, 0, 1, 1, 5, 5, 5, 4, 4, 11, 11, 11, 2, 3]),
+		'abanico': from_parents([0]*8 + [8]*3 + [10, 10])
+	}
+
+	def assert_tidy(self, children, distance):
+		x, depth = tidy_tree_layout(children, distance=distance)
+		self.assertAlmostEqual(x.min(), 0)
+		# Nodos de cada nivel de izquierda a derecha (orden del recorrido en preorden)
+		levels = {}
+		stack = [0]
+		while stack:
+			node = stack.pop()
+			levels.setdefault(depth[node], []).append(node)
+			stack.extend(reversed(children[node]))
+		for level, nodes in levels.items():
+			for left, right in zip(nodes, nodes[1:]):
+				self.assertGreaterEqual(x[right] - x[left], distance - 1e-9, f'nivel {level}: nodos {left} y {right}')
+		for node, node_children in enumerate(children):
+			if node_children:
+				self.assertAlmostEqual(x[node], (x[node_children[0]] + x[node_children[-1]])/2, msg=f'nodo {node}')
+				self.assertTrue(all(depth[child] == depth[node]+1 for child in node_children))
+		return x
+
+	def test_unbalanced_trees(self):
+		for name, children in self.TREES.items():
+			for distance in (1., 0.3):
+				with self.subTest(tree=name, distance=distance):
+					self.assert_tidy(children, distance)
+
+	def test_random_trees(self):
+		rng = random.Random('tidy')
+		for i in range(200):
+			with self.subTest(tree=i):
+				self.assert_tidy(random_tree(rng, rng.randint(1, 60)), 1.)
+
+	def test_compact_layout(self):
+		# Una cadena queda vertical y dos hojas hermanas a la distancia mínima
+		self.assertEqual(tidy_tree_layout(chain(4))[0].tolist(), [0, 0, 0, 0])
+		self.assertEqual(tidy_tree_layout([[1, 2], [], []], distance=0.5)[0].tolist(), [0.25, 0, 0.5])
+
+	def test_even_spacing(self):
+		# Las hojas entre dos subárboles anchos se reparten a la misma distancia en el hueco que queda entre ellos
+		children = from_parents([0, 0, 0, 0, 1, 1, 1, 4, 4, 4, 5, 5, 5, 6, 6, 6, 7, 7, 7, 7, 8, 8, 8, 8, 8, 8])
+		x = self.assert_tidy(children, 1.)
+		gaps = [x[right] - x[left] for left, right in zip(children[0], children[0][1:])]
+		self.assertGreater(gaps[0], 1.)
+		for gap in gaps[1:]:
+			self.assertAlmostEqual(gap, gaps[0])
+
+	def test_deep_tree(self):
+		# El algoritmo es iterativo, un árbol más profundo que el límite de recursión de Python se distribuye igual
+		x, depth = tidy_tree_layout(chain(5000))
+		self.assertEqual(depth[-1], 4999)
+		self.assertEqual(x.max(), 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,143 @@
+"""Pruebas de utils.rapidminer_proxy.parse_json_tables: el resultado debe ser el mismo que decodificar el documento completo y aplanar
+cada tabla con json_normalize, sea cual sea el tamaño de los bloques en los que llega la respuesta.
+
+	python -m unittest discover tests
+"""
+from utils.rapidminer_proxy import JsonTablesParser, parse_json_tables
+from utils.table_schemas import TABLE_SCHEMAS, normalize_table
+
+from pandas.io.json import json_normalize
+from unittest import mock
+import pandas as pd
+import json
+import random
+import unittest
+
+# Tipos de las columnas de las tablas generadas. 'mixed' alterna objetos anidados y valores simples en la misma columna
+COLUMN_TYPES = ('int', 'float', 'str', 'bool', 'nested', 'mixed')
+TEXTS = ('cluster_0', 'average(O_MV)', 'ñandú', 'a "b" {c}', '}{', '', '[1, 2]', 'x\\y')
+
+def random_value(rng, column_type):
+	if column_type == 'int':
+		return rng.randint(-10**6, 10**6)
+	if column_type == 'float':
+		return rng.choice([rng.uniform(-1000, 1000), rng.random(), 1e-7, 12345678.5])
+	if column_type == 'str':
+		return rng.choice(TEXTS)
+	if column_type == 'bool':
+		return rng.random() < 0.5
+	if column_type == 'nested':
+		return {'p': rng.randint(0, 100), 'q': {'r': rng.choice(TEXTS)}}
+	return random_value(rng, 'nested') if rng.random() < 0.3 else rng.randint(0, 100)
+
+def random_table(rng, nesting):
+	column_types = ['int', 'float', 'str', 'bool'] + {'flat': [], 'nested': ['nested'], 'mixed': ['mixed']}[nesting]
+	columns = {f'c{i}': rng.choice(column_types) for i in range(rng.randint(1, 6))}
+	rows = []
+	for _ in range(rng.randint(0, 60)):
+		row = {}
+		for name, column_type in columns.items():
+			# Algunas filas no tienen todas las columnas
+			if rng.random() < 0.9:
+				row[name] = random_value(rng, column_type)
+		rows.append(row)
+	return rows
+
+def random_document(rng, nesting):
+	tables = [random_table(rng, nesting) for _ in range(rng.randint(0, 5))]
+	indent = rng.choice([None, 0, 2, '\t'])
+	separators = rng.choice([(',', ':'), (', ', ': '), (' , ', ' : ')])
+	return tables, json.dumps(tables, indent=indent, separators=separators, ensure_ascii=rng.random() < 0.5).encode('utf-8')
+
+def split_chunks(rng, data):
+	chunks = []
+	pos = 0
+	while pos < len(data):
+		size = rng.choice([1, 2, 7, 64, 1000, rng.randint(1, 200)])
+		chunks.append(data[pos:pos+size])
+		pos += size
+	return chunks
+
+def random_schema_document(rng):
+	"""Documento con las tablas de EDAR_Cartuja_Perfil_Out_JSON y la de predicciones diarias de EDAR_Cartuja_Prediccion_JSON. Algunas
+	columnas faltan en tramos enteros de filas, así hay lotes sin ningún valor en ellas
+	"""
+	def value(make, gaps):
+		return make() if rng.random() > gaps else None
+
+	def table(columns, gaps):
+		rows = []
+		for _ in range(rng.randint(0, 80)):
+			gaps = gaps if rng.random() > 0.1 else rng.choice([0, 1])
+			rows.append({name: cell for name, make in columns.items() for cell in [value(make, gaps)] if cell is not None})
+		return rows
+
+	clusters = lambda: rng.choice(['cluster_0', 'cluster_1', 'cluster_2', 'cluster_10'])
+	indicators = lambda: rng.choice(['average(O_MV)', 'average(O_MV b)', 'O_MV', 'average(DQO)', 'average(1)'])
+	numbers = lambda: rng.choice([str(rng.uniform(-10, 10)), rng.uniform(-10, 10), rng.randint(0, 9), '?', ''])
+	dates = lambda: rng.choice(['01/31/19', '12/01/18', '13/45/19', ''])
+	indicator_table = {'cluster': clusters, 'Indicador': indicators, 'valor': numbers}
+	tables = [
+		table(indicator_table, 0.05),
+		table(indicator_table, 0.3),
+		table({'Attribute': lambda: rng.choice(['A', 'B']), 'Weight': numbers}, 0.05),
+		table({'cluster': clusters, 'añomes': lambda: rng.choice(['1/1/19 12:00 AM', '2/1/19 12:00 AM', 'x']), 'Prediction': numbers}, 0.1),
+		table({'cluster': clusters, 'timestamp': lambda: rng.choice(['2019-01-01', '2019-02-01 10:00', 'nunca']), 'outlier': numbers}, 0.1)
+	]
+	daily_pred = table({'timestamp': dates, 'confidence': numbers, 'Calidad_Agua': lambda: rng.choice(['[0-1]', '[1-2]', '[2-3]']),
+		'prediction(Calidad_Agua)': lambda: rng.choice(['[0-1]', '[1-2]', '[3-4]'])}, 0.1)
+	return tables, daily_pred
+
+class JsonTablesParserTest(unittest.TestCase):
+
+	def assert_matches_json_normalize(self, nesting, documents=150):
+		rng = random.Random(nesting)
+		for i in range(documents):
+			tables, data = random_document(rng, nesting)
+			expected = [json_normalize(table) for table in tables]
+			# Lotes pequeños para que las tablas se dividan en varios DataFrames
+			with mock.patch.object(JsonTablesParser, 'BATCH_ROWS', rng.choice([1, 3, 10, 50000])):
+				result = parse_json_tables(split_chunks(rng, data))
+			self.assertEqual(len(result), len(expected))
+			for table, (df, expected_df) in enumerate(zip(result, expected)):
+				with self.subTest(document=i, table=table):
+					if expected_df.empty:
+						self.assertTrue(df.empty)
+					else:
+						pd.testing.assert_frame_equal(df, expected_df)
+
+	def test_flat_rows(self):
+		self.assert_matches_json_normalize('flat')
+
+	def test_nested_rows(self):
+		self.assert_matches_json_normalize('nested')
+
+	def test_mixed_nesting(self):
+		self.assert_matches_json_normalize('mixed')
+
+	def test_table_schemas(self):
+		# Las tablas se convierten por lotes, el resultado debe ser el mismo que convertir cada tabla entera
+		rng = random.Random('schemas')
+		perfil_schemas = TABLE_SCHEMAS['EDAR_Cartuja_Perfil_Out_JSON']
+		daily_pred_schema = TABLE_SCHEMAS['EDAR_Cartuja_Prediccion_JSON'][3]
+		for i in range(150):
+			tables, daily_pred = random_schema_document(rng)
+			documents = [(tables, perfil_schemas), ([daily_pred], [daily_pred_schema])]
+			for document, (tables, schemas) in enumerate(documents):
+				expected = [normalize_table(json_normalize(table), schema) for table, schema in zip(tables, schemas)]
+				with mock.patch.object(JsonTablesParser, 'BATCH_ROWS', rng.choice([1, 3, 10, 50000])):
+					result = parse_json_tables(split_chunks(rng, json.dumps(tables).encode('utf-8')), schemas)
+				for table, (df, expected_df) in enumerate(zip(result, expected)):
+					with self.subTest(document=i, schemas=document, table=table):
+						if expected_df.empty:
+							self.assertTrue(df.empty)
+						else:
+							pd.testing.assert_frame_equal(df, expected_df)
+
+	def test_invalid_documents(self):
+		for data in (b'[[1, 2]]', b'[[{"a": 1}', b'[[{"a": 1}], ]', b'{"a": 1}'):
+			with self.subTest(data=data), self.assertRaises(ValueError):
+				parse_json_tables([data])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,5 +1,165 @@
+from bokeh.models import ColumnDataSource, Div, CDSView, GroupFilter
+from utils.server_config import PAYLOAD_REPORT_RATE
+import utils.metrics as metrics
+
+import numpy as np
+import pandas as pd
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
 BAR_COLORS_PALETTE = ['#7293cb', '#e1974c', '#84ba5b', '#d35e60', '#808585', '#9067a7', '#ab6857', '#ccc210']
 LINE_COLORS_PALETTE = ['#396ab1', '#da7c30', '#3e9651', '#cc2529', '#535154', '#6b4c9a', '#922428', '#948b3d']
 TITLE_FONT_COLOR = '#3576be'
 LABEL_FONT_COLOR = '#858796'
-BACKGROUND_COLOR = '#f8f9fc'
\ No newline at end of file
+BACKGROUND_COLOR = '#f8f9fc'
+# Las columnas más cortas se envían como listas JSON, en binario la descripción del array ocupa más que los valores
+BINARY_MIN_LENGTH = 8
+
+def plain_columns(df):
+	"""Convierte las columnas de categorías (ver utils/table_schemas.py) a texto para crear un ColumnDataSource. Bokeh no permite
+	añadir filas con stream a una columna de categorías y las usa como factores de los ejes, así que se convierten al final, después
+	de filtrar
+
+	Parameters:
+		df (Dataframe): Dataframe con los datos
+
+	Returns:
+		Dataframe: Dataframe sin columnas de categorías
+	"""
+	categorical = {column: df[column].astype(object) for column in df.columns if pd.api.types.is_categorical_dtype(df[column])}
+	return df.assign(**categorical) if categorical else df
+
+def to_binary_array(values):
+	"""Convierte una columna numérica en un array contiguo float32 o en el entero más pequeño en el que caben sus valores (int8, int16 o
+	int32), tipos que Bokeh envía al navegador en binario (base64) en lugar de como una lista JSON de números (Bokeh 1.4 envía los int64
+	como listas). Las fechas no se modifican, Bokeh ya las envía en binario y en float32 perderían precisión
+
+	El navegador mantiene el tipo del array al recibir filas con stream, así que las columnas de enteros que vayan a recibir valores
+	mayores no deben convertirse (ver el parámetro keep de binary_columns)
+
+	Parameters:
+		values (list o array): Valores de la columna
+
+	Returns:
+		array: Columna convertida o los valores originales si no es numérica o es más corta que BINARY_MIN_LENGTH
+	"""
+	array = np.asarray(values)
+	if array.ndim != 1 or len(array) < BINARY_MIN_LENGTH:
+		return values
+	if array.dtype.kind == 'f':
+		return np.ascontiguousarray(array, dtype=np.float32)
+	if array.dtype.kind in 'iu':
+		for dtype in (np.int8, np.int16, np.int32):
+			if np.iinfo(dtype).min <= array.min() and array.max() <= np.iinfo(dtype).max:
+				return np.ascontiguousarray(array, dtype=dtype)
+	return values
+
+def binary_columns(data, keep=()):
+	"""Prepara los datos de un ColumnDataSource para enviarlos al navegador en binario, convirtiendo las columnas numéricas con
+	to_binary_array. Las columnas de texto no se modifican
+
+	Parameters:
+		data (dict o Dataframe): Columnas del ColumnDataSource (un Dataframe se convierte igual que en ColumnDataSource(df))
+		keep (tuple): Columnas que no se convierten, por ejemplo valores que se muestran como texto (en float32 tendrían más decimales)
+			o enteros que van a recibir filas con stream
+
+	Returns:
+		dict: Columnas del ColumnDataSource
+	"""
+	if isinstance(data, pd.DataFrame):
+		data = ColumnDataSource.from_df(plain_columns(data))
+	return {column: values if column in keep else to_binary_array(values) for column, values in data.items()}
+
+def report_payload(doc, app, stage):
+	"""Añade el tamaño del documento de una sesión (lo que se envía al navegador al mostrar sus gráficos) al histograma
+	edar_document_payload_bytes. Medirlo obliga a serializar otra vez el documento completo, por lo que solo se mide una proporción
+	PAYLOAD_REPORT_RATE de las sesiones, o todas con el nivel DEBUG, con el que se registran además las fuentes de datos que más ocupan
+
+	Parameters:
+		doc (Document): Documento de la sesión
+		app (string): Nombre de la aplicación
+		stage (string): Momento de la sesión en el que se mide el documento
+	"""
+	debug = logger.isEnabledFor(logging.DEBUG)
+	if not debug and random.random() >= PAYLOAD_REPORT_RATE:
+		return
+	with metrics.time_stage('payload'):
+		payload = len(doc.to_json_string().encode('utf-8'))
+	metrics.document_payload.observe(payload, app=app, stage=stage)
+	if debug:
+		sources = sorted(((len(source.to_json_string(include_defaults=False)), source.name or source.id) for source in doc.select({'type': ColumnDataSource})), reverse=True)
+		logger.debug(f'Documento {app}/{stage}: {payload} bytes, fuentes de datos más grandes: {sources[:5]}')
+
+def get_groups(df, column):
+	"""Obtiene los grupos (por ejemplo los clusters) que aparecen en una columna, en orden natural (cluster_2 antes que cluster_10)
+
+	Parameters:
+		df (Dataframe): Dataframe con los datos
+		column (string): Columna de los grupos
+
+	Returns:
+		list: Nombres de los grupos
+	"""
+	groups = {str(group) for group in df[column].dropna().unique()}
+	return sorted(groups, key=lambda group: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', group)])
+
+def create_group_views(source, column, groups):
+	"""Crea una vista (CDSView con GroupFilter) de un ColumnDataSource compartido para cada grupo, así todos los grupos se envían al
+	navegador en una única fuente de datos. En Bokeh 1.4 los glyphs line ignoran las vistas, para ellos se usa pivot_groups
+
+	Parameters:
+		source (ColumnDataSource): Fuente de datos con todos los grupos
+		column (string): Columna de los grupos
+		groups (list): Nombres de los grupos
+
+	Returns:
+		dict: Vista de cada grupo
+	"""
+	return {group: CDSView(source=source, filters=[GroupFilter(column_name=column, group=group)]) for group in groups}
+
+def pivot_groups(df, index, column, value):
+	"""Convierte una tabla larga (una fila por índice y grupo) en una tabla ancha con una columna de valores por grupo, para dibujar
+	todos los grupos con glyphs line desde una única fuente de datos. Los índices sin valor para un grupo quedan a NaN
+
+	Parameters:
+		df (Dataframe): Dataframe con los datos
+		index (string): Columna del eje X
+		column (string): Columna de los grupos
+		value (string): Columna de los valores
+
+	Returns:
+		Dataframe: Tabla indexada por index (ordenado) con una columna por grupo
+	"""
+	wide = df.groupby([index, column], observed=True)[value].first().unstack(column)
+	wide.columns = [str(group) for group in wide.columns]
+	wide.index = pd.Index(wide.index.astype(object) if pd.api.types.is_categorical_dtype(wide.index) else wide.index, name=index)
+	return wide
+
+def create_snapshot_banner():
+	"""Crea el aviso de datos antiguos, oculto hasta que se muestren datos leídos de una instantánea local (ver show_snapshot_banner)
+
+	Returns:
+		Div: Aviso de datos antiguos
+	"""
+	return Div(text='', visible=False, sizing_mode='stretch_width', style={'color': '#856404', 'background-color': '#fff3cd', 'border': '1px solid #ffeeba',
+		'border-radius': '4px', 'padding': '6px 12px', 'font-family': 'inherit'})
+
+def show_snapshot_banner(banner, snapshot_time):
+	"""Muestra el aviso de datos antiguos si los datos se han leído de una instantánea local. El aviso se mantiene durante toda la sesión,
+	con la fecha de la instantánea más antigua mostrada
+
+	Parameters:
+		banner (Div): Aviso creado con create_snapshot_banner
+		snapshot_time (float): Instante (time.time) de la instantánea o None si los datos vienen de RapidMiner
+	"""
+	if snapshot_time is None:
+		return
+	if banner.visible and banner.tags and banner.tags[0] <= snapshot_time:
+		return
+	banner.tags = [snapshot_time]
+	banner.text = f'RapidMiner no responde, se muestran los datos guardados el {time.strftime("%d/%m/%Y a las %H:%M", time.localtime(snapshot_time))}'
+	banner.visible = True
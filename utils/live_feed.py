@@ -0,0 +1,103 @@
+"""Filas nuevas de las tablas del perfil de la EDAR para las gráficas en directo.
+
+Las filas se obtienen de la respuesta de RapidMiner cacheada (get_webservice_dataframes) o, si STREAMING_FILE no es None, de un fichero
+JSON lines al que otro proceso añade filas, por ejemplo:
+
+	{"table": 4, "timestamp": "2019-02-01", "outlier": 0.12, "cluster": "cluster_1"}
+"""
+from utils.rapidminer_proxy import get_webservice_dataframes
+from utils.server_config import RAPIDMINER_URL, STREAMING_FILE, STREAMING_ROLLOVER
+from utils.table_schemas import get_table_schema, normalize_table
+
+import pandas as pd
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class FileFeed:
+	"""Clase FileFeed para leer las filas que se van añadiendo a un fichero JSON lines. El fichero se lee una única vez para todas
+	las sesiones, en cada consulta solo se leen las líneas añadidas desde la anterior. Las filas nuevas se convierten a los tipos del
+	esquema de su tabla en EDAR_Cartuja_Perfil_Out_JSON, igual que las respuestas de RapidMiner
+
+	Attributes:
+		path (string): Ruta del fichero
+		max_rows (int): Filas que se mantienen como máximo por tabla (None para no limitarlas)
+	"""
+
+	def __init__(self, path, max_rows=None):
+		self.path = path
+		self.max_rows = max_rows
+		self._offset = 0
+		self._tables = {}
+		self._lock = threading.Lock()
+
+	def read(self):
+		"""Lee las líneas completas añadidas al fichero desde la última lectura. Si el fichero se ha truncado o sustituido se vuelve a leer
+		desde el principio
+		"""
+		if not os.path.exists(self.path):
+			return
+		if os.path.getsize(self.path) < self._offset:
+			self._offset = 0
+			self._tables = {}
+		new_rows = {}
+		with open(self.path, 'rb') as feed_file:
+			feed_file.seek(self._offset)
+			for line in feed_file:
+				# Una línea sin salto final puede estar escribiéndose todavía
+				if not line.endswith(b'\n'):
+					break
+				self._offset += len(line)
+				try:
+					row = json.loads(line)
+					table = int(row.pop('table'))
+				except (ValueError, KeyError, TypeError):
+					logger.warning(f'Línea no válida en {self.path}: {line[:200]!r}')
+					continue
+				new_rows.setdefault(table, []).append(row)
+		for table, rows in new_rows.items():
+			new_df = normalize_table(pd.DataFrame(rows), get_table_schema('EDAR_Cartuja_Perfil_Out_JSON', table))
+			df = pd.concat([self._tables.get(table), new_df], ignore_index=True, sort=False)
+			if self.max_rows is not None:
+				df = df.iloc[-self.max_rows:]
+			self._tables[table] = df
+
+	def get_table(self, table):
+		"""Obtiene las filas leídas de una tabla, leyendo antes las líneas nuevas del fichero
+
+		Parameters:
+			table (int): Índice de la tabla del perfil
+
+		Returns:
+			DataFrame: Filas de la tabla (vacío si no hay ninguna). Es compartido, no debe modificarse.
+		"""
+		with self._lock:
+			self.read()
+			return self._tables.get(table, pd.DataFrame())
+
+_file_feed = FileFeed(STREAMING_FILE, max_rows=STREAMING_ROLLOVER) if STREAMING_FILE is not None else None
+
+def get_new_rows(table, time_column, since):
+	"""Obtiene las filas de una tabla del perfil posteriores a un instante. Es bloqueante, desde los callbacks de Bokeh se debe llamar con
+	run_webservice_task
+
+	Parameters:
+		table (int): Índice de la tabla en la respuesta de EDAR_Cartuja_Perfil_Out_JSON
+		time_column (string): Columna con la fecha (datetime) de cada fila
+		since (Timestamp): Fecha de la última fila mostrada (None para obtener todas)
+
+	Returns:
+		DataFrame: Filas posteriores a since ordenadas por fecha
+	"""
+	if _file_feed is not None:
+		df = _file_feed.get_table(table)
+	else:
+		df = get_webservice_dataframes(f'{RAPIDMINER_URL}/EDAR_Cartuja_Perfil_Out_JSON?', 'rapidminer', 'rapidminer')[table]
+	if time_column not in df:
+		return df.iloc[0:0]
+	times = df[time_column]
+	mask = times > since if since is not None else times.notna()
+	return df.loc[mask].sort_values(time_column)
@@ -0,0 +1,218 @@
+from contextlib import contextmanager
+from functools import wraps
+import bisect
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PAYLOAD_BUCKETS = (10**4, 2.5*10**4, 5*10**4, 10**5, 2.5*10**5, 5*10**5, 10**6, 2.5*10**6, 5*10**6)
+
+def format_labels(labels):
+	"""Convierte las etiquetas de una métrica al formato de texto de Prometheus
+
+	Parameters:
+		labels (tuple): Pares (nombre, valor) de las etiquetas
+
+	Returns:
+		string: Etiquetas en formato {nombre="valor",...} o cadena vacía si no hay etiquetas
+	"""
+	if not labels:
+		return ''
+	escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels]
+	return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def format_value(value):
+	"""Convierte el valor de una muestra al formato de texto de Prometheus
+	"""
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value))
+
+class Metric:
+	"""Clase Metric base para las métricas, con un valor por cada combinación de etiquetas
+
+	Attributes:
+		name (string): Nombre de la métrica en Prometheus
+		documentation (string): Descripción de la métrica
+	"""
+
+	TYPE = 'untyped'
+
+	def __init__(self, name, documentation):
+		self.name = name
+		self.documentation = documentation
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def samples(self):
+		"""Devuelve las muestras de la métrica
+
+		Returns:
+			list: Tuplas (sufijo, etiquetas, valor)
+		"""
+		with self._lock:
+			return [('', labels, value) for labels, value in self._values.items()]
+
+	def render(self):
+		"""Devuelve la métrica en el formato de texto de Prometheus
+		"""
+		lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+		for suffix, labels, value in self.samples():
+			lines.append(f'{self.name}{suffix}{format_labels(labels)} {format_value(value)}')
+		return '\n'.join(lines)
+
+class Counter(Metric):
+	"""Contador que solo puede incrementarse
+	"""
+
+	TYPE = 'counter'
+
+	def inc(self, amount=1, **labels):
+		"""Incrementa el contador con las etiquetas dadas
+		"""
+		key = tuple(sorted(labels.items()))
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def get(self, **labels):
+		"""Devuelve el valor del contador con las etiquetas dadas
+		"""
+		with self._lock:
+			return self._values.get(tuple(sorted(labels.items())), 0)
+
+class Gauge(Metric):
+	"""Valor que puede subir y bajar
+	"""
+
+	TYPE = 'gauge'
+
+	def set(self, value, **labels):
+		"""Fija el valor con las etiquetas dadas
+		"""
+		with self._lock:
+			self._values[tuple(sorted(labels.items()))] = value
+
+	def inc(self, amount=1, **labels):
+		"""Incrementa el valor con las etiquetas dadas
+		"""
+		key = tuple(sorted(labels.items()))
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def dec(self, amount=1, **labels):
+		"""Decrementa el valor con las etiquetas dadas
+		"""
+		self.inc(-amount, **labels)
+
+class Histogram(Metric):
+	"""Histograma acumulado de observaciones (por ejemplo duraciones en segundos)
+
+	Attributes:
+		buckets (tuple): Límites superiores de los intervalos del histograma
+	"""
+
+	TYPE = 'histogram'
+
+	def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+		super().__init__(name, documentation)
+		self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+	def observe(self, value, **labels):
+		"""Añade una observación al histograma con las etiquetas dadas
+		"""
+		key = tuple(sorted(labels.items()))
+		with self._lock:
+			counts, total = self._values.get(key, ([0]*len(self.buckets), 0.0))
+			counts[bisect.bisect_left(self.buckets, value)] += 1
+			self._values[key] = (counts, total + value)
+
+	def samples(self):
+		samples = []
+		with self._lock:
+			for labels, (counts, total) in self._values.items():
+				cumulative = 0
+				for bucket, count in zip(self.buckets, counts):
+					cumulative += count
+					samples.append(('_bucket', labels + (('le', format_value(bucket)),), cumulative))
+				samples.append(('_sum', labels, total))
+				samples.append(('_count', labels, cumulative))
+		return samples
+
+class Registry:
+	"""Registro de todas las métricas del proceso
+	"""
+
+	def __init__(self):
+		self._metrics = []
+		self._collectors = []
+
+	def register(self, metric):
+		"""Añade una métrica al registro y la devuelve
+		"""
+		self._metrics.append(metric)
+		return metric
+
+	def add_collector(self, collector):
+		"""Añade una función que se llama antes de generar el informe para actualizar métricas calculadas
+		"""
+		self._collectors.append(collector)
+
+	def render(self):
+		"""Devuelve todas las métricas en el formato de texto de Prometheus
+		"""
+		for collector in self._collectors:
+			collector()
+		return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+registry = Registry()
+
+stage_duration = registry.register(Histogram('edar_stage_duration_seconds', 'Duración de cada etapa de construcción de los dashboards'))
+cache_requests = registry.register(Counter('edar_cache_requests_total', 'Consultas a las cachés compartidas según el resultado (hit, stale o miss)'))
+cache_hit_ratio = registry.register(Gauge('edar_cache_hit_ratio', 'Proporción de consultas a las cachés compartidas servidas sin llamar a RapidMiner'))
+active_sessions = registry.register(Gauge('edar_bokeh_sessions', 'Sesiones de Bokeh activas por aplicación'))
+document_payload = registry.register(Histogram('edar_document_payload_bytes', 'Tamaño en bytes de los documentos de Bokeh enviados al navegador', buckets=PAYLOAD_BUCKETS))
+
+def collect_cache_hit_ratio():
+	"""Calcula la proporción de aciertos de cada caché a partir de los contadores
+	"""
+	totals = {}
+	for _, labels, value in cache_requests.samples():
+		labels = dict(labels)
+		hits, total = totals.get(labels['cache'], (0, 0))
+		totals[labels['cache']] = (hits + (value if labels['result'] != 'miss' else 0), total + value)
+	for cache, (hits, total) in totals.items():
+		cache_hit_ratio.set(hits/total if total else 0, cache=cache)
+
+registry.add_collector(collect_cache_hit_ratio)
+
+@contextmanager
+def time_stage(stage):
+	"""Mide la duración de un bloque de código y la añade al histograma de etapas
+
+	Parameters:
+		stage (string): Nombre de la etapa
+	"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		stage_duration.observe(time.perf_counter()-start, stage=stage)
+
+def timed(func):
+	"""Decorador que mide la duración de cada llamada a la función, usando su nombre como etapa
+	"""
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		with time_stage(func.__name__):
+			return func(*args, **kwargs)
+	return wrapper
+
+def track_session(doc, app):
+	"""Cuenta la sesión de Bokeh del documento como activa hasta que se destruya
+
+	Parameters:
+		doc (Document): Documento de la sesión
+		app (string): Nombre de la aplicación
+	"""
+	active_sessions.inc(app=app)
+	doc.on_session_destroyed(lambda session_context: active_sessions.dec(app=app))
@@ -1,11 +1,773 @@
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import json
+from pandas.io.json import json_normalize
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
+from tornado.ioloop import IOLoop
+from urllib.parse import urlencode
+import codecs
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import utils.metrics as metrics
+from utils.table_schemas import TABLE_SCHEMAS, normalize_batch, concat_batches, normalize_table
+from utils.snapshot_store import snapshot_store, get_snapshot_time
+from utils.server_config import CACHE_TTL, CACHE_STALE_TTL, CACHE_MAX_BYTES, RAPIDMINER_POOL_CONNECTIONS, RAPIDMINER_POOL_MAXSIZE, RAPIDMINER_CONNECT_TIMEOUT, RAPIDMINER_READ_TIMEOUT, RAPIDMINER_RECORD_DIR, RAPIDMINER_DATE_PARAMETERS, SNAPSHOT_RETRY_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+# Hilos donde se ejecutan las llamadas asíncronas, tantos como conexiones persistentes por host
+_webservice_executor = ThreadPoolExecutor(max_workers=RAPIDMINER_POOL_MAXSIZE, thread_name_prefix='rapidminer')
+
+snapshot_fallbacks = metrics.registry.register(metrics.Counter('edar_snapshot_fallbacks_total', 'Respuestas servidas desde las instantáneas locales porque RapidMiner no ha respondido'))
+
+# Tamaño de los bloques en los que se lee y decodifica el cuerpo de las respuestas
+RESPONSE_CHUNK_SIZE = 256*1024
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def get_http_session():
+	"""Obtiene la sesión HTTP compartida por todo el proceso. Mantiene un pool de conexiones persistentes (keep-alive) por host,
+	así las llamadas a RapidMiner no repiten la conexión TCP/TLS en cada petición. El pool de urllib3 es seguro entre hilos.
+
+	Returns:
+		Session: Sesión de requests con el pool de conexiones configurado
+	"""
+	global _http_session
+	if _http_session is None:
+		with _http_session_lock:
+			if _http_session is None:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=RAPIDMINER_POOL_CONNECTIONS, pool_maxsize=RAPIDMINER_POOL_MAXSIZE, pool_block=True)
+				session.mount('http://', adapter)
+				session.mount('https://', adapter)
+				_http_session = session
+	return _http_session
+
+def get_process_name(url):
+	"""Obtiene el nombre del proceso de RapidMiner a partir de la URL del servicio web
+
+	Parameters:
+		url (string): URL del servicio web (o nombre del proceso)
+
+	Returns:
+		string: Nombre del proceso
+	"""
+	return url.rstrip('?').rsplit('/', 1)[-1]
+
+def get_recording_key(parameters=None):
+	"""Obtiene el identificador de una grabación a partir de los parámetros del proceso, independiente de su orden
+
+	Parameters:
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		string: Identificador de la grabación
+	"""
+	if not parameters:
+		return 'default'
+	query = urlencode(sorted((name, str(value)) for name, value in parameters.items()))
+	return hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+
+def get_recording_path(record_dir, process, parameters=None):
+	"""Obtiene la ruta del fichero donde se graba la respuesta de un proceso para unos parámetros
+
+	Parameters:
+		record_dir (string): Directorio de grabaciones
+		process (string): Nombre del proceso de RapidMiner (o URL del servicio web)
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		string: Ruta del fichero de la grabación
+	"""
+	return os.path.join(record_dir, get_process_name(process), f'{get_recording_key(parameters)}.json')
+
+def record_response(record_dir, url, parameters, text):
+	"""Graba en disco la respuesta de un proceso para poder reproducirla después con utils/rapidminer_standin.py. Junto a la respuesta
+	se guardan los parámetros de la llamada (fichero .params.json)
+
+	Parameters:
+		record_dir (string): Directorio de grabaciones
+		url (string): URL del servicio web
+		parameters (dict): Parámetros del proceso
+		text (string): Cuerpo de la respuesta
+	"""
+	path = get_recording_path(record_dir, url, parameters)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	# Escribimos en un fichero temporal y lo renombramos para no dejar grabaciones a medias si varias llamadas coinciden
+	tmp_path = f'{path}.{threading.get_ident()}.tmp'
+	with open(tmp_path, 'w', encoding='utf-8') as recording_file:
+		recording_file.write(text)
+	os.replace(tmp_path, path)
+	with open(path[:-len('.json')] + '.params.json', 'w', encoding='utf-8') as parameters_file:
+		json.dump({name: str(value) for name, value in (parameters or {}).items()}, parameters_file)
+	logger.info(f'Respuesta grabada en {path}')
 
 def call_webservice(url, username, password, parameters=None, out_json=False):
-	r = requests.get(url, params=parameters, auth=(username, password))
+	process = get_process_name(url)
+	with metrics.time_stage(f'rapidminer {process}'):
+		r = get_http_session().get(url, params=parameters, auth=(username, password), timeout=(RAPIDMINER_CONNECT_TIMEOUT, RAPIDMINER_READ_TIMEOUT))
+		r.raise_for_status()
+	if RAPIDMINER_RECORD_DIR is not None:
+		record_response(RAPIDMINER_RECORD_DIR, url, parameters, r.text)
 	if out_json:
-		document = json.loads(r.text)
+		with metrics.time_stage(f'json {process}'):
+			document = json.loads(r.text)
 	else:
 		document = r.text
-	return document
\ No newline at end of file
+	return document
+
+def download_webservice_tables(url, username, password, parameters=None):
+	"""Llama al servicio web y convierte su respuesta (una lista de tablas, cada una una lista de filas) en DataFrames mientras se
+	descarga, sin decodificar antes todo el cuerpo (ver parse_json_tables)
+
+	Parameters:
+		url (string): URL del servicio web
+		username (string): Usuario de RapidMiner
+		password (string): Contraseña de RapidMiner
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		list: Lista de DataFrames, uno por tabla de la respuesta
+	"""
+	process = get_process_name(url)
+	with metrics.time_stage(f'rapidminer {process}'):
+		r = get_http_session().get(url, params=parameters, auth=(username, password), timeout=(RAPIDMINER_CONNECT_TIMEOUT, RAPIDMINER_READ_TIMEOUT), stream=True)
+		try:
+			r.raise_for_status()
+			chunks = r.iter_content(chunk_size=RESPONSE_CHUNK_SIZE)
+			# Para grabar la respuesta hay que guardar el cuerpo completo
+			if RAPIDMINER_RECORD_DIR is not None:
+				content = b''.join(chunks)
+				record_response(RAPIDMINER_RECORD_DIR, url, parameters, content.decode('utf-8'))
+				chunks = [content]
+			return parse_json_tables(chunks, TABLE_SCHEMAS.get(process))
+		finally:
+			r.close()
+
+def get_history_parameters(parameters=None):
+	"""Obtiene los parámetros de una llamada sin el periodo (RAPIDMINER_DATE_PARAMETERS), es decir, los del histórico completo
+
+	Parameters:
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		dict: Parámetros del proceso sin el periodo
+	"""
+	return {name: value for name, value in (parameters or {}).items() if name not in RAPIDMINER_DATE_PARAMETERS}
+
+def save_snapshot(process, parameters, tables):
+	"""Guarda una respuesta como instantánea local si SNAPSHOT_DIR no es None. Un error al guardarla no impide usar la respuesta.
+	Solo se guardan las llamadas del histórico completo: cada periodo pedido tendría su propia instantánea y su número no dejaría de
+	crecer, y las de un periodo se pueden servir recortando la del histórico (ver load_snapshot)
+
+	Parameters:
+		process (string): Nombre del proceso de RapidMiner
+		parameters (dict): Parámetros del proceso
+		tables (list): Lista de DataFrames de la respuesta
+	"""
+	if snapshot_store is None or len(get_history_parameters(parameters)) != len(parameters or {}):
+		return
+	try:
+		with metrics.time_stage(f'snapshot {process}'):
+			snapshot_store.save(process, get_recording_key(parameters), parameters, tables)
+	except Exception:
+		logger.exception(f'No se ha podido guardar la instantánea de {process}')
+
+def load_snapshot(process, parameters=None):
+	"""Lee la última instantánea local de una llamada. Si se ha pedido un periodo (RAPIDMINER_DATE_PARAMETERS) se usa la del histórico
+	completo (quien la use debe recortarla)
+
+	Parameters:
+		process (string): Nombre del proceso de RapidMiner
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		SnapshotTables: Tablas de la instantánea o None si no hay ninguna
+	"""
+	if snapshot_store is None:
+		return None
+	return snapshot_store.load(process, get_recording_key(get_history_parameters(parameters)))
+
+def call_webservice_tables(url, username, password, parameters=None):
+	"""Obtiene las tablas de una llamada al servicio web (ver download_webservice_tables) y las guarda como instantánea local. Si RapidMiner
+	no responde, devuelve un error o una respuesta incompleta, se devuelve la última instantánea de la llamada (ver load_snapshot)
+
+	Parameters:
+		url (string): URL del servicio web
+		username (string): Usuario de RapidMiner
+		password (string): Contraseña de RapidMiner
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		list: Lista de DataFrames, uno por tabla de la respuesta (SnapshotTables si se han leído de una instantánea)
+	"""
+	process = get_process_name(url)
+	try:
+		tables = download_webservice_tables(url, username, password, parameters)
+	except (requests.RequestException, ValueError) as error:
+		tables = load_snapshot(process, parameters)
+		if tables is None:
+			raise
+		logger.warning(f'Error llamando a {process} ({error}), se usa la instantánea del {time.strftime("%Y-%m-%d %H:%M", time.localtime(tables.snapshot_time))}')
+		snapshot_fallbacks.inc(process=process)
+		return tables
+	save_snapshot(process, parameters, tables)
+	return tables
+
+class JsonTablesParser:
+	"""Clase JsonTablesParser para convertir un documento JSON con una lista de tablas (listas de filas planas) en DataFrames a medida
+	que llegan los bloques de bytes, sin tener nunca en memoria el texto completo ni todas las filas como diccionarios
+
+	Las filas completas de cada bloque se decodifican de una vez con el decodificador en C de json y sus valores se reparten en una
+	lista por columna (ver TableColumns), así los diccionarios de las filas solo existen mientras se procesa el bloque. Cada lote de
+	filas se convierte en columnas de NumPy. Si un bloque no se puede decodificar así (por ejemplo porque termina la tabla) se
+	decodifica fila a fila.
+
+	Attributes:
+		chunks (iterator): Bloques de bytes pendientes de leer
+		buffer (string): Texto decodificado pendiente de procesar
+		pos (int): Posición del siguiente carácter a procesar en buffer
+		finished (bool): Indica si ya se han leído todos los bloques
+	"""
+
+	# Filas que se acumulan antes de convertirlas en un DataFrame
+	BATCH_ROWS = 50000
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.buffer = ''
+		self.pos = 0
+		self.finished = False
+		self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+		self._decoder = json.JSONDecoder()
+		self._reads = 0
+
+	def read_more(self):
+		"""Añade al buffer el siguiente bloque, descartando el texto ya procesado
+		"""
+		chunk = next(self.chunks, None)
+		if chunk is None:
+			if self.finished:
+				raise ValueError('Respuesta JSON incompleta')
+			self.finished = True
+			chunk_text = self._text_decoder.decode(b'', final=True)
+		else:
+			chunk_text = self._text_decoder.decode(chunk)
+		self.buffer = self.buffer[self.pos:] + chunk_text
+		self.pos = 0
+		self._reads += 1
+
+	def next_token(self):
+		"""Salta los espacios y devuelve el siguiente carácter sin consumirlo
+		"""
+		while True:
+			self.pos = JSON_WHITESPACE.match(self.buffer, self.pos).end()
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+			self.read_more()
+
+	def expect(self, characters):
+		"""Consume el siguiente carácter, que debe ser uno de characters, y lo devuelve
+		"""
+		token = self.next_token()
+		if token not in characters:
+			raise ValueError(f'Respuesta JSON inesperada: se esperaba {characters!r} y se ha encontrado {token!r}')
+		self.pos += 1
+		return token
+
+	def decode_value(self):
+		"""Decodifica el siguiente valor completo, pidiendo más bloques si está cortado
+		"""
+		self.next_token()
+		while True:
+			try:
+				value, end = self._decoder.raw_decode(self.buffer, self.pos)
+			except json.JSONDecodeError:
+				if self.finished:
+					raise
+				self.read_more()
+				continue
+			# Un número al final del bloque puede continuar en el siguiente
+			if end == len(self.buffer) and not self.finished:
+				self.read_more()
+				continue
+			self.pos = end
+			return value
+
+	def decode_rows(self):
+		"""Decodifica de una vez todas las filas completas del buffer, desde la posición actual (inicio de una fila) hasta el último
+		cierre de objeto. Si ese tramo no es una lista de filas válida (termina la tabla, hay objetos anidados...) devuelve None
+
+		Returns:
+			list: Filas decodificadas o None
+		"""
+		end = self.buffer.rfind('}')
+		if end <= self.pos:
+			return None
+		segment = self.buffer[self.pos:end+1]
+		try:
+			rows = json.loads(f'[{segment}]')
+		except ValueError:
+			return None
+		if not all(isinstance(row, dict) for row in rows):
+			return None
+		# Cada fila aporta exactamente una llave de apertura salvo que haya objetos anidados (o llaves dentro de textos)
+		if segment.count('{') != len(rows) and any(isinstance(value, dict) for row in rows for value in row.values()):
+			return None
+		self.pos = end+1
+		return rows
+
+	def read_table(self, schema=None):
+		"""Lee una tabla desde su corchete inicial hasta el final incluido
+
+		Parameters:
+			schema (dict): Conversión de cada columna (ver utils/table_schemas.py)
+
+		Returns:
+			DataFrame: Tabla con una columna por clave de las filas, en el orden en que aparecen
+		"""
+		if self.next_token() != '[':
+			# Tablas con otra estructura, se convierten igual que antes
+			return json_normalize(self.decode_value())
+		self.pos += 1
+
+		frames = []
+		columns = TableColumns()
+		failed_read = None
+		while True:
+			token = self.next_token()
+			if token == ']':
+				self.pos += 1
+				break
+			if token == ',':
+				self.pos += 1
+				continue
+			# Solo se intenta decodificar un lote una vez por bloque leído, si falla se sigue fila a fila hasta el siguiente bloque
+			# decode_rows solo devuelve filas planas, las filas con objetos anidados se decodifican una a una
+			batch = self.decode_rows() if failed_read != self._reads else None
+			if batch is None:
+				failed_read = self._reads
+				row = self.decode_value()
+				if not isinstance(row, dict):
+					raise ValueError('Respuesta JSON inesperada: las filas de las tablas deben ser objetos')
+				batch = [flatten_row(row)]
+			columns.append(batch)
+			if columns.rows >= self.BATCH_ROWS:
+				frames.append(normalize_batch(columns.columns, columns.rows, schema))
+				columns = TableColumns()
+		if columns.rows or not frames:
+			frames.append(normalize_batch(columns.columns, columns.rows, schema))
+
+		return normalize_table(concat_batches(frames), schema)
+
+	def read_tables(self, schemas=None):
+		"""Lee el documento completo
+
+		Parameters:
+			schemas (list): Esquema de cada tabla (ver utils/table_schemas.py), None para dejar los tipos que deduce pandas
+
+		Returns:
+			list: Lista de DataFrames, uno por tabla
+		"""
+		tables = []
+		self.expect('[')
+		if self.next_token() == ']':
+			return tables
+		while True:
+			schema = schemas[len(tables)] if schemas is not None and len(tables) < len(schemas) else None
+			tables.append(self.read_table(schema))
+			if self.expect(',]') == ']':
+				return tables
+
+def flatten_row(row):
+	"""Aplana los objetos anidados de una fila igual que json_normalize: sus valores pasan a columnas padre.hijo, que se colocan detrás
+	de las columnas simples de la fila
+
+	Parameters:
+		row (dict): Fila de la tabla
+
+	Returns:
+		dict: Fila sin objetos anidados
+	"""
+	if not any(isinstance(value, dict) for value in row.values()):
+		return row
+	flat = {name: value for name, value in row.items() if not isinstance(value, dict)}
+	for name, value in row.items():
+		if isinstance(value, dict):
+			flat.update(flatten_object(value, name))
+	return flat
+
+def flatten_object(value, prefix):
+	"""Aplana un objeto anidado de una fila, conservando el orden de sus claves (ver flatten_row)
+	"""
+	flat = {}
+	for name, child in value.items():
+		if isinstance(child, dict):
+			flat.update(flatten_object(child, f'{prefix}.{name}'))
+		else:
+			flat[f'{prefix}.{name}'] = child
+	return flat
+
+class TableColumns:
+	"""Clase TableColumns para acumular las filas de un lote de una tabla como una lista de valores por columna, en el orden en que
+	aparecen las columnas. Las filas a las que les falta una columna tienen NaN en ella, igual que con json_normalize. El lote se
+	convierte en un DataFrame con normalize_batch
+
+	Attributes:
+		columns (dict): Lista de valores de cada columna
+		rows (int): Número de filas acumuladas
+	"""
+
+	def __init__(self):
+		self.columns = {}
+		self.rows = 0
+
+	def append(self, rows):
+		"""Añade filas planas (ver flatten_row)
+
+		Parameters:
+			rows (list): Filas a añadir
+		"""
+		# Caso habitual: todas las filas tienen las mismas columnas que la primera, se trasponen sin recorrer cada fila en Python
+		names = list(rows[0])
+		if set(map(len, rows)) == {len(names)}:
+			try:
+				self.extend({name: list(map(itemgetter(name), rows)) for name in names}, len(rows))
+				return
+			except KeyError:
+				pass
+		names = dict.fromkeys(names)
+		for row in rows:
+			if row.keys() != names.keys():
+				names.update(dict.fromkeys(row))
+		self.extend({name: [row.get(name, np.nan) for row in rows] for name in names}, len(rows))
+
+	def extend(self, values, count):
+		"""Añade los valores de varias filas
+
+		Parameters:
+			values (dict): Valores de cada columna de las filas nuevas
+			count (int): Número de filas nuevas
+		"""
+		for name in values:
+			if name not in self.columns:
+				self.columns[name] = [np.nan]*self.rows
+		for name, column in self.columns.items():
+			column.extend(values[name] if name in values else [np.nan]*count)
+		self.rows += count
+
+def parse_json_tables(chunks, schemas=None):
+	"""Convierte un documento JSON con una lista de tablas en DataFrames a medida que llegan los bloques de bytes (ver JsonTablesParser).
+	Las columnas que aparecen en el esquema de su tabla se convierten a su tipo y el resto conservan el tipo que deduce pandas
+
+	Parameters:
+		chunks (iterable): Bloques de bytes del documento en UTF-8
+		schemas (list): Esquema de cada tabla (ver utils/table_schemas.py), None para dejar los tipos que deduce pandas
+
+	Returns:
+		list: Lista de DataFrames, uno por tabla
+	"""
+	return JsonTablesParser(chunks).read_tables(schemas)
+
+def estimate_size(value):
+	"""Estima la memoria ocupada por un valor guardado en la caché
+
+	Parameters:
+		value: DataFrame, Series o colección (lista, tupla o diccionario) de ellos
+
+	Returns:
+		int: Número aproximado de bytes ocupados
+	"""
+	if isinstance(value, pd.DataFrame):
+		return int(value.memory_usage(index=True, deep=True).sum())
+	if isinstance(value, pd.Series):
+		return int(value.memory_usage(index=True, deep=True))
+	if isinstance(value, dict):
+		return sum(estimate_size(element) for element in value.values())
+	if isinstance(value, (list, tuple)):
+		return sum(estimate_size(element) for element in value)
+	return sys.getsizeof(value)
+
+class CacheEntry:
+	"""Clase CacheEntry para representar un valor guardado en la caché
+
+	Attributes:
+		value: Valor cacheado
+		size (int): Bytes estimados que ocupa el valor
+		created (float): Instante (time.monotonic) en el que se obtuvo el valor
+		revalidate_after (float): Segundos tras los que el valor se refresca en segundo plano
+		refreshing (bool): Indica si hay un refresco en segundo plano en curso
+	"""
+
+	def __init__(self, value, size, created, revalidate_after):
+		self.value = value
+		self.size = size
+		self.created = created
+		self.revalidate_after = revalidate_after
+		self.refreshing = False
+
+class WebserviceCache:
+	"""Clase WebserviceCache para compartir las respuestas de RapidMiner entre todas las sesiones del proceso
+
+	Cada clave se obtiene una única vez aunque varias sesiones la pidan a la vez. Durante ttl segundos el valor se sirve
+	directamente, durante los stale_ttl segundos siguientes se sirve el valor antiguo mientras se refresca en segundo plano y,
+	pasado ese tiempo, se vuelve a obtener de forma síncrona. Cuando se supera max_bytes (o max_entries) se eliminan las
+	entradas usadas hace más tiempo. Los valores leídos de una instantánea local (ver utils/snapshot_store.py) se refrescan cada
+	SNAPSHOT_RETRY_INTERVAL segundos hasta que RapidMiner vuelve a responder.
+
+	Los valores se comparten entre sesiones, por lo que deben tratarse como de solo lectura.
+
+	Attributes:
+		name (string): Nombre de la caché en las métricas
+		ttl (float): Segundos durante los que una entrada se considera actualizada
+		stale_ttl (float): Segundos adicionales durante los que se sirve la entrada antigua mientras se refresca
+		max_bytes (int): Memoria máxima estimada de todas las entradas
+		max_entries (int): Número máximo de entradas (None para no limitarlo)
+	"""
+
+	def __init__(self, name, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, max_bytes=CACHE_MAX_BYTES, max_entries=None):
+		self.name = name
+		self.ttl = ttl
+		self.stale_ttl = stale_ttl
+		self.max_bytes = max_bytes
+		self.max_entries = max_entries
+		self._entries = OrderedDict()
+		# Lock y número de hilos que lo usan de cada clave que se está obteniendo, se eliminan al terminar
+		self._key_locks = {}
+		self._size = 0
+		self._lock = threading.RLock()
+
+	def get(self, key, loader):
+		"""Obtiene el valor de una clave, llamando a loader si no está en la caché o ha caducado
+
+		Parameters:
+			key: Clave (hashable) del valor
+			loader (function): Función sin parámetros que obtiene el valor
+
+		Returns:
+			Valor cacheado u obtenido con loader
+		"""
+		with self._lock:
+			entry = self._lookup(key, loader)
+			if entry is not None:
+				return entry.value
+
+		with self._key_lock(key):
+			# Otra sesión puede haber obtenido el valor mientras esperábamos
+			with self._lock:
+				entry = self._lookup(key, loader)
+				if entry is not None:
+					return entry.value
+			metrics.cache_requests.inc(cache=self.name, result='miss')
+			value = loader()
+			self.put(key, value)
+			return value
+
+	def peek(self, key):
+		"""Obtiene el valor de una clave solo si ya está en la caché y no ha caducado, sin llamar nunca al servicio web
+
+		Parameters:
+			key: Clave (hashable) del valor
+
+		Returns:
+			Valor cacheado o None si no está
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or time.monotonic() - entry.created >= self.ttl + self.stale_ttl:
+				return None
+			self._entries.move_to_end(key)
+			metrics.cache_requests.inc(cache=self.name, result='hit')
+			return entry.value
+
+	def reload(self, key, loader):
+		"""Vuelve a obtener el valor de una clave aunque esté actualizado. Mientras tanto el resto de sesiones siguen usando el valor anterior
+
+		Parameters:
+			key: Clave (hashable) del valor
+			loader (function): Función sin parámetros que obtiene el valor
+
+		Returns:
+			Valor obtenido con loader
+		"""
+		with self._key_lock(key):
+			value = loader()
+			self.put(key, value)
+			return value
+
+	def put(self, key, value, revalidate_after=None):
+		"""Guarda un valor en la caché y elimina las entradas más antiguas si se superan los límites
+
+		Parameters:
+			key: Clave (hashable) del valor
+			value: Valor a guardar
+			revalidate_after (float): Segundos tras los que se refresca en segundo plano (None para ttl, o SNAPSHOT_RETRY_INTERVAL si el
+				valor se ha leído de una instantánea; 0 para refrescarlo en cuanto se pida)
+		"""
+		if revalidate_after is None:
+			revalidate_after = self.ttl if get_snapshot_time(value) is None else min(SNAPSHOT_RETRY_INTERVAL, self.ttl)
+		size = estimate_size(value)
+		if size > self.max_bytes:
+			logger.warning(f'Respuesta de {size} bytes demasiado grande para la caché, no se guarda')
+			return
+		with self._lock:
+			self._remove(key)
+			self._entries[key] = CacheEntry(value, size, time.monotonic(), revalidate_after)
+			self._size += size
+			while self._size > self.max_bytes or (self.max_entries is not None and len(self._entries) > self.max_entries):
+				self._remove(next(iter(self._entries)))
+
+	def clear(self):
+		"""Elimina todas las entradas de la caché
+		"""
+		with self._lock:
+			self._entries.clear()
+			self._size = 0
+
+	@contextmanager
+	def _key_lock(self, key):
+		"""Adquiere el lock de una clave para que solo un hilo la obtenga a la vez. El lock existe solo mientras algún hilo lo usa, así
+		no se acumulan locks de claves que ya no se piden (por ejemplo los periodos de las predicciones diarias)
+		"""
+		with self._lock:
+			key_lock, users = self._key_locks.get(key, (None, 0))
+			if key_lock is None:
+				key_lock = threading.Lock()
+			self._key_locks[key] = (key_lock, users+1)
+		try:
+			with key_lock:
+				yield
+		finally:
+			with self._lock:
+				key_lock, users = self._key_locks[key]
+				if users == 1:
+					del self._key_locks[key]
+				else:
+					self._key_locks[key] = (key_lock, users-1)
+
+	def _lookup(self, key, loader):
+		"""Busca una entrada válida (actualizada o antigua pero dentro de stale_ttl). Si es antigua lanza su refresco
+		en segundo plano con loader. Debe llamarse con self._lock adquirido.
+		"""
+		entry = self._entries.get(key)
+		if entry is None:
+			return None
+		age = time.monotonic() - entry.created
+		if age >= self.ttl + self.stale_ttl:
+			self._remove(key)
+			return None
+		self._entries.move_to_end(key)
+		stale = age >= entry.revalidate_after
+		if stale and not entry.refreshing:
+			entry.refreshing = True
+			threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+		metrics.cache_requests.inc(cache=self.name, result='stale' if stale else 'hit')
+		return entry
+
+	def _refresh(self, key, loader):
+		"""Vuelve a obtener el valor de una clave en segundo plano, manteniendo el valor antiguo si falla
+		"""
+		with self._key_lock(key):
+			try:
+				self.put(key, loader())
+			except Exception:
+				logger.exception(f'Error refrescando la caché para {key}')
+				with self._lock:
+					entry = self._entries.get(key)
+					if entry is not None:
+						entry.refreshing = False
+
+	def _remove(self, key):
+		"""Elimina una entrada y descuenta su tamaño. Debe llamarse con self._lock adquirido.
+		"""
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			self._size -= entry.size
+
+webservice_cache = WebserviceCache('webservice')
+
+def get_webservice_key(url, parameters=None):
+	"""Obtiene la clave de una llamada al servicio web en la caché compartida, independiente del orden y del tipo de los parámetros
+	"""
+	return (url, tuple(sorted((name, str(value)) for name, value in (parameters or {}).items())))
+
+def load_webservice_snapshots(url):
+	"""Carga en la caché compartida la última instantánea local de cada llamada a un proceso, para servirlas en cuanto se pidan
+	mientras se revalidan en segundo plano (por ejemplo al arrancar el servidor)
+
+	Parameters:
+		url (string): URL del servicio web
+
+	Returns:
+		int: Número de instantáneas cargadas
+	"""
+	if snapshot_store is None:
+		return 0
+	# Las instantáneas de un periodo son de versiones anteriores, ya no se guardan ni se cargan
+	snapshots = [(parameters, tables) for parameters, tables in snapshot_store.load_all(get_process_name(url))
+				if len(get_history_parameters(parameters)) == len(parameters)]
+	for parameters, tables in snapshots:
+		webservice_cache.put(get_webservice_key(url, parameters), tables, revalidate_after=0)
+	return len(snapshots)
+
+def get_webservice_dataframes(url, username, password, parameters=None, reload=False):
+	"""Obtiene las tablas de un proceso de RapidMiner como DataFrames a través de la caché compartida entre sesiones
+
+	Parameters:
+		url (string): URL del servicio web
+		username (string): Usuario de RapidMiner
+		password (string): Contraseña de RapidMiner
+		parameters (dict): Parámetros del proceso
+		reload (bool): Si es True se vuelve a llamar al servicio web aunque la respuesta cacheada esté actualizada
+
+	Returns:
+		list: Lista de DataFrames, uno por tabla de la respuesta. Son compartidos, no deben modificarse.
+	"""
+	key = get_webservice_key(url, parameters)
+
+	def load():
+		return call_webservice_tables(url, username, password, parameters)
+
+	if reload:
+		return webservice_cache.reload(key, load)
+	return webservice_cache.get(key, load)
+
+async def run_webservice_task(func, *args):
+	"""Ejecuta una función bloqueante (llamadas al servicio web y su procesado) en los hilos de RapidMiner, así el IOLoop de Tornado
+	sigue atendiendo al resto de sesiones mientras tanto
+
+	Parameters:
+		func (function): Función a ejecutar
+		*args: Parámetros de la función
+
+	Returns:
+		Valor devuelto por la función
+	"""
+	return await IOLoop.current().run_in_executor(_webservice_executor, partial(func, *args))
+
+async def get_webservice_dataframes_async(url, username, password, parameters=None):
+	"""Versión asíncrona de get_webservice_dataframes para usar desde callbacks de Bokeh
+
+	Parameters:
+		url (string): URL del servicio web
+		username (string): Usuario de RapidMiner
+		password (string): Contraseña de RapidMiner
+		parameters (dict): Parámetros del proceso
+
+	Returns:
+		list: Lista de DataFrames, uno por tabla de la respuesta. Son compartidos, no deben modificarse.
+	"""
+	return await run_webservice_task(get_webservice_dataframes, url, username, password, parameters)
@@ -0,0 +1,151 @@
+"""Servidor de sustitución de RapidMiner para pruebas y medidas de rendimiento sin conexión.
+
+Reproduce las respuestas grabadas con RAPIDMINER_RECORD_DIR (ver utils/rapidminer_proxy.py) para los procesos
+EDAR_Cartuja_Perfil_Out_JSON y EDAR_Cartuja_Prediccion_JSON, buscando la grabación según los parámetros de la llamada.
+Si no hay grabación para un periodo (RAPIDMINER_DATE_PARAMETERS), se usa la grabación sin periodo y se recortan sus series temporales.
+Para usarlo basta con apuntar RAPIDMINER_URL a http://localhost:<puerto>/api/rest/process.
+
+	python -m utils.rapidminer_standin --dir recordings --port 9096 --latency 0.5 --scale 10
+"""
+from utils.rapidminer_proxy import get_recording_path
+from utils.server_config import RAPIDMINER_RECORD_DIR, RAPIDMINER_DATE_PARAMETERS
+
+from tornado.ioloop import IOLoop
+from tornado.web import Application, RequestHandler, HTTPError
+import tornado.gen
+from datetime import datetime, timedelta
+import argparse
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# Columnas que identifican las tablas de series temporales, las únicas que crecen con el histórico de la planta
+TIME_COLUMNS = ('timestamp', 'añomes')
+# Formatos de fecha de las series temporales de RapidMiner
+TIME_FORMATS = ('%m/%d/%y', '%m/%d/%y %I:%M %p', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+
+def parse_time(value):
+	"""Convierte una fecha de una serie temporal de RapidMiner a datetime
+
+	Parameters:
+		value (string): Fecha en alguno de los formatos de TIME_FORMATS
+
+	Returns:
+		datetime: Fecha convertida o None si no tiene un formato conocido
+	"""
+	for time_format in TIME_FORMATS:
+		try:
+			return datetime.strptime(value, time_format)
+		except (ValueError, TypeError):
+			pass
+	return None
+
+def filter_document(document, start=None, end=None):
+	"""Recorta las tablas de series temporales de un documento a un periodo, igual que haría RapidMiner con los parámetros de
+	RAPIDMINER_DATE_PARAMETERS. Las filas con fechas que no se pueden interpretar se mantienen
+
+	Parameters:
+		document (list): Documento JSON con una lista de filas por tabla
+		start (string): Primer día del periodo (AAAA-MM-DD, None para no limitarlo)
+		end (string): Último día del periodo, incluido (AAAA-MM-DD, None para no limitarlo)
+
+	Returns:
+		list: Documento con las tablas recortadas
+	"""
+	start = datetime.strptime(start, '%Y-%m-%d') if start else datetime.min
+	end = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) if end else datetime.max
+	filtered_document = []
+	for table in document:
+		time_column = next((column for column in TIME_COLUMNS if table and column in table[0]), None)
+		if time_column is not None:
+			times = [parse_time(row.get(time_column)) for row in table]
+			table = [row for row, time in zip(table, times) if time is None or start <= time < end]
+		filtered_document.append(table)
+	return filtered_document
+
+def scale_document(document, scale):
+	"""Escala el número de filas de las tablas de series temporales de un documento, repitiendo sus filas (scale > 1)
+	o recortándolas (scale < 1). El resto de tablas (árbol de decisión, matriz de confusión, pesos...) no se modifican
+
+	Parameters:
+		document (list): Documento JSON con una lista de filas por tabla
+		scale (float): Factor de escala del número de filas
+
+	Returns:
+		list: Documento con las tablas escaladas
+	"""
+	scaled_document = []
+	for table in document:
+		if table and any(column in table[0] for column in TIME_COLUMNS):
+			num_rows = max(1, int(math.ceil(len(table)*scale)))
+			table = [table[i % len(table)] for i in range(num_rows)]
+		scaled_document.append(table)
+	return scaled_document
+
+class ProcessHandler(RequestHandler):
+	"""Devuelve la respuesta grabada de un proceso de RapidMiner para los parámetros de la petición
+	"""
+
+	def initialize(self, record_dir, latency, scale):
+		self.record_dir = record_dir
+		self.latency = latency
+		self.scale = scale
+
+	async def get(self, process):
+		parameters = {name: self.get_argument(name) for name in self.request.arguments}
+		path = get_recording_path(self.record_dir, process, parameters)
+		# Sin grabación para el periodo pedido se recorta la grabación del histórico completo
+		window = [parameters.get(name) for name in RAPIDMINER_DATE_PARAMETERS]
+		if not os.path.exists(path) and any(window):
+			path = get_recording_path(self.record_dir, process, {name: value for name, value in parameters.items() if name not in RAPIDMINER_DATE_PARAMETERS})
+		else:
+			window = [None, None]
+		if not os.path.exists(path):
+			raise HTTPError(404, f'No hay grabación de {process} para {parameters}')
+
+		if self.latency > 0:
+			await tornado.gen.sleep(self.latency)
+
+		with open(path, 'r', encoding='utf-8') as recording_file:
+			text = recording_file.read()
+		if self.scale != 1 or any(window):
+			document = json.loads(text)
+			if self.scale != 1:
+				document = scale_document(document, self.scale)
+			if any(window):
+				document = filter_document(document, *window)
+			text = json.dumps(document)
+
+		self.set_header('Content-Type', 'application/json')
+		self.write(text)
+
+def make_app(record_dir, latency=0, scale=1):
+	"""Crea la aplicación Tornado del servidor de sustitución
+
+	Parameters:
+		record_dir (string): Directorio de grabaciones
+		latency (float): Segundos de espera añadidos a cada respuesta
+		scale (float): Factor de escala de las tablas de series temporales
+
+	Returns:
+		Application: Aplicación Tornado
+	"""
+	return Application([
+		(r'/api/rest/process/([^/]+)', ProcessHandler, dict(record_dir=record_dir, latency=latency, scale=scale))
+	])
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Servidor de sustitución de RapidMiner que reproduce respuestas grabadas')
+	parser.add_argument('--dir', default=RAPIDMINER_RECORD_DIR or 'recordings', help='Directorio de grabaciones')
+	parser.add_argument('--port', type=int, default=9096, help='Puerto de escucha')
+	parser.add_argument('--latency', type=float, default=0, help='Segundos de espera añadidos a cada respuesta')
+	parser.add_argument('--scale', type=float, default=1, help='Factor de escala de las tablas de series temporales')
+	args = parser.parse_args()
+
+	logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+	make_app(args.dir, args.latency, args.scale).listen(args.port)
+	logger.info(f'Reproduciendo {args.dir} en el puerto {args.port} (latencia {args.latency}s, escala x{args.scale})')
+	IOLoop.current().start()
@@ -1,4 +1,53 @@
 # SERVER_IP = '3.10.15.221' # Amazon EC2
 SERVER_IP = '10.0.20.30' # Vicomtech
 def_user = 'rapidminer'
-def_pass = 'rapidminer'
\ No newline at end of file
+def_pass = 'rapidminer'
+
+# Caché de respuestas de RapidMiner compartida por todas las sesiones de Bokeh
+CACHE_TTL = 10*60 # Segundos durante los que una respuesta se considera actualizada
+CACHE_STALE_TTL = 60*60 # Segundos adicionales en los que se sirve la respuesta antigua mientras se refresca en segundo plano
+CACHE_MAX_BYTES = 512*1024*1024 # Memoria máxima ocupada por las respuestas cacheadas
+
+# Conexiones HTTP con RapidMiner
+RAPIDMINER_POOL_CONNECTIONS = 4 # Número de hosts distintos con conexiones reutilizables
+RAPIDMINER_POOL_MAXSIZE = 16 # Conexiones persistentes (keep-alive) por host
+RAPIDMINER_CONNECT_TIMEOUT = 5 # Segundos para establecer la conexión
+RAPIDMINER_READ_TIMEOUT = 300 # Segundos de espera de la respuesta (los procesos de RapidMiner pueden ser lentos)
+
+# Caché de modelos de predicción compartida por todas las sesiones de Bokeh
+PREDICTION_CACHE_TTL = 6*60*60 # Segundos tras los que un modelo se vuelve a pedir a RapidMiner
+PREDICTION_CACHE_MAX_MODELS = 64 # Número máximo de modelos (Objetivo, Discretizacion, Numero_Atributos) guardados
+MAX_SESSION_MODELS = 4 # Modelos abiertos a la vez en cada sesión de /prediccion, al superarlo se cierra el usado hace más tiempo
+SINGLE_MODEL_VIEW = False # Muestra un único modelo cada vez reutilizando sus gráficos, al cambiar de modelo solo se envían los datos nuevos
+DAILY_PRED_MAX_POINTS = 1000 # Puntos que se envían como máximo para el periodo visible de la gráfica de predicciones diarias (del orden de su ancho en píxeles)
+PAYLOAD_REPORT_RATE = 0 # Proporción de sesiones (0 a 1) en las que se mide el tamaño del documento para el histograma edar_document_payload_bytes, cada medida serializa otra vez el documento (unos 30 ms)
+
+# Precarga de datos y modelos al arrancar el servidor de Bokeh
+WARMUP_WORKERS = 4 # Llamadas simultáneas a RapidMiner durante la precarga
+WARMUP_INTERVAL = 3*60*60 # Segundos entre precargas para que los modelos no caduquen en la caché (None para precargar solo al arrancar)
+
+# Servicio web de RapidMiner. Para pruebas sin conexión se puede apuntar al servidor de sustitución (python -m utils.rapidminer_standin),
+# por ejemplo RAPIDMINER_URL = 'http://localhost:9096/api/rest/process'
+RAPIDMINER_URL = 'http://rapidminer.vicomtech.org/api/rest/process'
+RAPIDMINER_RECORD_DIR = None # Directorio donde grabar las respuestas de RapidMiner para reproducirlas después (None para no grabarlas)
+RAPIDMINER_DATE_PARAMETERS = ('Fecha_Inicio', 'Fecha_Fin') # Parámetros de EDAR_Cartuja_Prediccion_JSON con el inicio y el fin (AAAA-MM-DD) del periodo de las predicciones diarias
+
+# Instantáneas locales de las respuestas de RapidMiner. Cada respuesta obtenida se guarda en columnas (ficheros .npy que se pueden mapear
+# en memoria), al arrancar se cargan en las cachés y se revalidan en segundo plano, y si RapidMiner no responde se sirven marcadas como antiguas
+SNAPSHOT_DIR = None # Directorio de las instantáneas (None para no guardarlas)
+SNAPSHOT_KEEP_VERSIONS = 2 # Versiones que se conservan de cada proceso y parámetros
+SNAPSHOT_RETRY_INTERVAL = 60 # Segundos entre reintentos con RapidMiner mientras se sirve una instantánea
+
+# Servidor de Bokeh. En producción se lanza aparte de Flask/Gunicorn con python -m bokeh_edar40.server, así los workers de
+# Gunicorn y los procesos de Bokeh se escalan por separado
+BOKEH_PORT = 9090 # Puerto del servidor de Bokeh
+BOKEH_NUM_PROCS = 1 # Procesos del servidor de Bokeh, que comparten el puerto (0 para uno por núcleo). Cada proceso tiene sus propias cachés, instantáneas y métricas
+WARMUP_ALL_PROCS = False # Con varios procesos, precarga las cachés en todos ellos y no solo en el primero. RapidMiner recibe entonces BOKEH_NUM_PROCS veces las llamadas de cada precarga (1 + número de variables objetivo)
+BOKEH_METRICS_PORT = 9190 # Con varios procesos, cada proceso publica sus métricas en /metrics del puerto BOKEH_METRICS_PORT + número del proceso (con uno solo se publican en el puerto de Bokeh)
+BOKEH_EMBEDDED = False # Si es True, main.py arranca el servidor de Bokeh en un hilo del proceso de Flask (un solo proceso, solo para pruebas)
+
+# Modo en directo de las gráficas de outliers y predicción de /prediccion. Las filas nuevas se piden a RapidMiner a través de la caché
+# (llegan al refrescarse la respuesta, ver CACHE_TTL) o se leen de un fichero local
+STREAMING_INTERVAL = None # Milisegundos entre consultas de filas nuevas (None para desactivar el modo en directo)
+STREAMING_ROLLOVER = 5000 # Filas que se mantienen como máximo en cada serie de las gráficas en directo (None para no limitarlas)
+STREAMING_FILE = None # Fichero JSON lines del que leer las filas nuevas en lugar de RapidMiner, una fila por línea con la clave "table" (índice de la tabla del perfil)
@@ -0,0 +1,201 @@
+"""Instantáneas locales de las respuestas de RapidMiner.
+
+Cada respuesta (lista de tablas) se guarda como una versión con un fichero .npy por columna y un manifest.json con los nombres, tipos
+y categorías de las columnas y los parámetros de la llamada:
+
+	<SNAPSHOT_DIR>/<proceso>/<clave de los parámetros>/<versión>/manifest.json
+	<SNAPSHOT_DIR>/<proceso>/<clave de los parámetros>/<versión>/t<tabla>_c<columna>.npy
+
+Las columnas se leen mapeando los ficheros en memoria, sin decodificar JSON, por lo que cargar una instantánea es casi inmediato.
+Las columnas de texto y de categorías se guardan como códigos enteros con sus valores en el manifiesto.
+"""
+from utils.server_config import SNAPSHOT_DIR, SNAPSHOT_KEEP_VERSIONS
+
+import numpy as np
+import pandas as pd
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+class SnapshotTables(list):
+	"""Clase SnapshotTables para la lista de DataFrames leída de una instantánea en lugar de RapidMiner
+
+	Attributes:
+		snapshot_time (float): Instante (time.time) en el que se guardó la instantánea
+	"""
+
+	def __init__(self, tables, snapshot_time):
+		super().__init__(tables)
+		self.snapshot_time = snapshot_time
+
+def get_snapshot_time(value):
+	"""Obtiene el instante de la instantánea de la que se han leído unos datos. Sirve para las listas de tablas (SnapshotTables) y para
+	los diccionarios que lo conservan en la clave snapshot_time, como los modelos de predicción
+
+	Parameters:
+		value: Datos obtenidos del servicio web o de una instantánea
+
+	Returns:
+		float: Instante (time.time) de la instantánea o None si los datos vienen de RapidMiner
+	"""
+	if isinstance(value, dict):
+		return value.get('snapshot_time')
+	return getattr(value, 'snapshot_time', None)
+
+def encode_column(series):
+	"""Convierte una columna en el array que se guarda en disco y su descripción para el manifiesto
+
+	Parameters:
+		series (Series): Columna de una tabla
+
+	Returns:
+		tuple: Array a guardar y diccionario con el tipo de la columna
+	"""
+	if pd.api.types.is_categorical_dtype(series):
+		return series.cat.codes.values, {'kind': 'category', 'categories': series.cat.categories.tolist()}
+	if series.dtype.kind in 'biufmM':
+		return series.values, {'kind': 'array'}
+	# Textos y valores mezclados: códigos enteros (-1 para los valores vacíos) y valores distintos en el manifiesto
+	codes, uniques = pd.factorize(series)
+	return codes.astype(np.int32), {'kind': 'object', 'categories': uniques.tolist()}
+
+def decode_column(values, column):
+	"""Reconstruye una columna a partir del array leído del disco y su descripción en el manifiesto
+
+	Parameters:
+		values (array): Array leído del disco
+		column (dict): Descripción de la columna en el manifiesto
+
+	Returns:
+		array: Valores de la columna
+	"""
+	if column['kind'] == 'array':
+		return values
+	categorical = pd.Categorical.from_codes(values, column['categories'])
+	return categorical if column['kind'] == 'category' else np.asarray(categorical.astype(object))
+
+class SnapshotStore:
+	"""Clase SnapshotStore para guardar y leer las instantáneas de las respuestas de RapidMiner. Cada versión se escribe en un directorio
+	temporal que se renombra al terminar, así nunca se leen versiones a medias aunque se guarden varias a la vez
+
+	Attributes:
+		root (string): Directorio de las instantáneas
+		keep_versions (int): Versiones que se conservan de cada proceso y parámetros
+	"""
+
+	def __init__(self, root, keep_versions=SNAPSHOT_KEEP_VERSIONS):
+		self.root = root
+		self.keep_versions = max(keep_versions, 1)
+
+	def get_path(self, process, key):
+		"""Obtiene el directorio de las versiones de un proceso y unos parámetros
+		"""
+		return os.path.join(self.root, process, key)
+
+	def get_versions(self, path):
+		"""Obtiene las versiones terminadas de un directorio, de la más antigua a la más reciente
+		"""
+		try:
+			names = os.listdir(path)
+		except FileNotFoundError:
+			return []
+		return sorted(name for name in names if name.isdigit())
+
+	def save(self, process, key, parameters, tables):
+		"""Guarda una nueva versión de la respuesta de un proceso y elimina las versiones más antiguas
+
+		Parameters:
+			process (string): Nombre del proceso de RapidMiner
+			key (string): Identificador de los parámetros (ver get_recording_key)
+			parameters (dict): Parámetros del proceso
+			tables (list): Lista de DataFrames de la respuesta
+		"""
+		path = self.get_path(process, key)
+		version = f'{int(time.time()*10**6):020d}'
+		tmp_path = os.path.join(path, f'{version}.{threading.get_ident()}.tmp')
+		os.makedirs(tmp_path)
+		try:
+			manifest = {'created': time.time(), 'process': process, 'parameters': {name: str(value) for name, value in (parameters or {}).items()}, 'tables': []}
+			for i, df in enumerate(tables):
+				columns = []
+				for j, name in enumerate(df.columns):
+					values, column = encode_column(df[name])
+					column.update(name=name, file=f't{i}_c{j}.npy')
+					np.save(os.path.join(tmp_path, column['file']), values, allow_pickle=False)
+					columns.append(column)
+				manifest['tables'].append({'columns': columns, 'rows': len(df)})
+			with open(os.path.join(tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as manifest_file:
+				json.dump(manifest, manifest_file, ensure_ascii=False, default=str)
+			os.rename(tmp_path, os.path.join(path, version))
+		except Exception:
+			shutil.rmtree(tmp_path, ignore_errors=True)
+			raise
+
+		for old_version in self.get_versions(path)[:-self.keep_versions]:
+			shutil.rmtree(os.path.join(path, old_version), ignore_errors=True)
+
+	def read(self, path):
+		"""Lee una versión
+
+		Parameters:
+			path (string): Directorio de la versión
+
+		Returns:
+			tuple: Parámetros del proceso y tablas (SnapshotTables)
+		"""
+		with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as manifest_file:
+			manifest = json.load(manifest_file)
+		tables = []
+		for table in manifest['tables']:
+			data = {}
+			for column in table['columns']:
+				values = np.load(os.path.join(path, column['file']), mmap_mode='r', allow_pickle=False)
+				data[column['name']] = decode_column(values, column)
+			tables.append(pd.DataFrame(data, columns=[column['name'] for column in table['columns']], index=pd.RangeIndex(table['rows'])))
+		return manifest['parameters'], SnapshotTables(tables, manifest['created'])
+
+	def load(self, process, key):
+		"""Lee la última versión de un proceso y unos parámetros
+
+		Parameters:
+			process (string): Nombre del proceso de RapidMiner
+			key (string): Identificador de los parámetros (ver get_recording_key)
+
+		Returns:
+			SnapshotTables: Tablas de la última versión o None si no hay ninguna
+		"""
+		path = self.get_path(process, key)
+		versions = self.get_versions(path)
+		if not versions:
+			return None
+		return self.read(os.path.join(path, versions[-1]))[1]
+
+	def load_all(self, process):
+		"""Lee la última versión de cada conjunto de parámetros de un proceso. Las versiones que no se pueden leer se omiten
+
+		Parameters:
+			process (string): Nombre del proceso de RapidMiner
+
+		Returns:
+			list: Tuplas (parámetros, SnapshotTables)
+		"""
+		snapshots = []
+		process_path = os.path.join(self.root, process)
+		for key in sorted(os.listdir(process_path)) if os.path.isdir(process_path) else []:
+			versions = self.get_versions(os.path.join(process_path, key))
+			if not versions:
+				continue
+			try:
+				snapshots.append(self.read(os.path.join(process_path, key, versions[-1])))
+			except Exception:
+				logger.exception(f'No se ha podido leer la instantánea {process}/{key}/{versions[-1]}')
+		return snapshots
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR is not None else None
@@ -0,0 +1,196 @@
+"""Esquemas de las tablas de los procesos de RapidMiner.
+
+Cada tabla se convierte a sus tipos una única vez, al llenar la caché (ver call_webservice_tables), así las sesiones reciben DataFrames
+ya limpios: categorías para las columnas de clases (cluster, Indicador, Prediction...), float32 para los valores y datetime para las
+fechas. Filtrar por una categoría compara sus códigos enteros y no textos.
+
+Un esquema es una lista con un diccionario por tabla que asocia cada columna a la función que la convierte. La clave OTHER_COLUMNS
+se aplica a las columnas de texto que no aparecen en el diccionario (por ejemplo las columnas de las predicciones diarias, cuyo nombre
+depende de la variable objetivo del modelo).
+
+Mientras se lee una respuesta, cada lote de filas se convierte ya a tipos compactos (ver normalize_batch y concat_batches), así no se
+guardan todos los valores de la tabla como objetos de Python. Las conversiones que dependen de toda la columna (las categorías) se
+terminan al unir los lotes.
+"""
+from pandas.api.types import is_categorical_dtype, union_categoricals
+import numpy as np
+import pandas as pd
+
+OTHER_COLUMNS = '*'
+# Formatos de las fechas de RapidMiner
+PREDICTION_TIME_FORMAT = '%m/%d/%y %I:%M %p'
+DAILY_PRED_TIME_FORMAT = '%m/%d/%y'
+# Texto repetido en los nombres de los indicadores: average(O_MV) -> O_MV
+INDICATOR_PATTERN = r'average|\(|\)'
+
+def to_float(dtype=np.float32):
+	"""Crea la conversión de una columna numérica (RapidMiner envía muchos números como texto). Los valores no numéricos pasan a NaN
+
+	Parameters:
+		dtype (dtype): Tipo de la columna convertida
+
+	Returns:
+		function: Función que convierte una Series
+	"""
+	def convert(series):
+		return pd.to_numeric(series, errors='coerce').astype(dtype)
+	return convert
+
+def to_category(pattern=None):
+	"""Crea la conversión de una columna de clases a categoría. Si se indica pattern, se elimina de cada categoría (no de cada fila)
+
+	Parameters:
+		pattern (string): Expresión regular del texto a eliminar (None para no modificar los valores)
+
+	Returns:
+		function: Función que convierte una Series
+	"""
+	def convert(series):
+		series = series.astype('category')
+		if pattern is None:
+			return series
+		categories = series.cat.categories
+		cleaned = categories.astype(str).str.replace(pattern, '', regex=True)
+		if cleaned.is_unique:
+			return series.cat.rename_categories(cleaned)
+		# Varias categorías quedan iguales al limpiarlas, se unen en una
+		return series.map(dict(zip(categories, cleaned))).astype('category')
+	# Las categorías dependen de todos los valores de la columna, en cada lote solo se guardan sin modificar (ver normalize_batch)
+	convert.whole_table = True
+	return convert
+
+def to_datetime(time_format=None):
+	"""Crea la conversión de una columna de fechas. Las fechas que no se pueden interpretar pasan a NaT
+
+	Parameters:
+		time_format (string): Formato de las fechas (None para deducirlo)
+
+	Returns:
+		function: Función que convierte una Series
+	"""
+	def convert(series):
+		return pd.to_datetime(series, format=time_format, errors='coerce')
+	return convert
+
+INDICATOR_TABLE_SCHEMA = {'cluster': to_category(), 'Indicador': to_category(INDICATOR_PATTERN), 'valor': to_float()}
+
+TABLE_SCHEMAS = {
+	'EDAR_Cartuja_Perfil_Out_JSON': [
+		INDICATOR_TABLE_SCHEMA,
+		INDICATOR_TABLE_SCHEMA,
+		{'Weight': to_float()},
+		{'cluster': to_category(), 'añomes': to_datetime(PREDICTION_TIME_FORMAT), 'Prediction': to_float()},
+		{'cluster': to_category(), 'timestamp': to_datetime(), 'outlier': to_float()}
+	],
+	'EDAR_Cartuja_Prediccion_JSON': [
+		{'Prediction': to_category()},
+		{},
+		{'Weight': to_float()},
+		{'timestamp': to_datetime(DAILY_PRED_TIME_FORMAT), 'confidence': to_float(), OTHER_COLUMNS: to_category()}
+	]
+}
+
+def get_table_schema(process, table):
+	"""Obtiene el esquema de una tabla de un proceso
+
+	Parameters:
+		process (string): Nombre del proceso de RapidMiner
+		table (int): Índice de la tabla en la respuesta
+
+	Returns:
+		dict: Conversión de cada columna (vacío si la tabla no tiene esquema)
+	"""
+	schemas = TABLE_SCHEMAS.get(process, [])
+	return schemas[table] if table < len(schemas) else {}
+
+def get_conversion(schema, df, column):
+	"""Obtiene la conversión de una columna según el esquema de su tabla
+
+	Parameters:
+		schema (dict): Conversión de cada columna (ver TABLE_SCHEMAS)
+		df (Dataframe): Tabla
+		column (string): Nombre de la columna
+
+	Returns:
+		function: Función que convierte la columna o None si se deja como está
+	"""
+	convert = schema.get(column)
+	# Las columnas de texto pueden llegar ya como categorías sin modificar si la tabla se ha leído por lotes
+	if convert is None and (df[column].dtype == object or is_categorical_dtype(df[column].dtype)):
+		convert = schema.get(OTHER_COLUMNS)
+	return convert
+
+def normalize_batch(columns, rows, schema=None):
+	"""Crea el DataFrame de un lote de filas de una tabla con las columnas convertidas a tipos compactos. Las columnas con categorías
+	se guardan como categorías con los valores sin modificar, normalize_table termina su conversión una vez unidos los lotes (ver
+	concat_batches). Los números de estas columnas conservan su tipo aunque falten valores (convirtiendo la tabla entera pandas los
+	pasaría a float)
+
+	Parameters:
+		columns (dict): Lista de valores de cada columna, tal y como llegan de RapidMiner
+		rows (int): Número de filas del lote
+		schema (dict): Conversión de cada columna (ver TABLE_SCHEMAS)
+
+	Returns:
+		Dataframe: Lote con las columnas convertidas
+	"""
+	schema = schema or {}
+	# Las columnas con categorías no se convierten a números, en otro lote la misma columna puede tener textos
+	df = pd.DataFrame({column: pd.Series(values, dtype=object) if getattr(schema.get(column), 'whole_table', False) else values
+					for column, values in columns.items()}, index=pd.RangeIndex(rows))
+	converted = {}
+	for column in df.columns:
+		convert = get_conversion(schema, df, column)
+		if convert is not None:
+			converted[column] = df[column].astype('category') if getattr(convert, 'whole_table', False) else convert(df[column])
+	return df.assign(**converted) if converted else df
+
+def concat_batches(frames):
+	"""Une los lotes de una tabla convertidos con normalize_batch. Las columnas con categorías de cada lote se unen en una sola
+	categoría con las categorías ordenadas, igual que si se hubiera convertido la columna entera. Si no se puede (por ejemplo
+	valores de tipos distintos) la columna se une como objetos y normalize_table la convierte después. Las columnas que no están en el
+	esquema se unen como las deduce pandas en cada lote
+
+	Parameters:
+		frames (list): Lotes de la tabla
+
+	Returns:
+		Dataframe: Tabla completa
+	"""
+	if len(frames) == 1:
+		return frames[0]
+	columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+	categorical = {}
+	for column in columns:
+		parts = [frame[column] for frame in frames if column in frame.columns and frame[column].notna().any()]
+		if not parts or not all(is_categorical_dtype(part.dtype) for part in parts):
+			continue
+		empty = parts[0].cat.categories[:0]
+		# Los lotes sin valores en la columna aportan filas vacías
+		parts = [frame[column] if column in frame.columns and frame[column].notna().any()
+				else pd.Series(pd.Categorical([np.nan]*len(frame), categories=empty)) for frame in frames]
+		try:
+			categorical[column] = union_categoricals(parts, sort_categories=True)
+		except TypeError:
+			continue
+	df = pd.concat([frame.drop(columns=[column for column in categorical if column in frame.columns]) for frame in frames], ignore_index=True, sort=False)
+	return df.assign(**categorical)[columns]
+
+def normalize_table(df, schema=None):
+	"""Convierte las columnas de una tabla a los tipos de su esquema
+
+	Parameters:
+		df (Dataframe): Tabla tal y como llega de RapidMiner
+		schema (dict): Conversión de cada columna (ver TABLE_SCHEMAS)
+
+	Returns:
+		Dataframe: Tabla con las columnas convertidas
+	"""
+	if not schema:
+		return df
+	converted = {}
+	for column in df.columns:
+		convert = get_conversion(schema, df, column)
+		if convert is not None:
+			converted[column] = convert(df[column])
+	return df.assign(**converted) if converted else df